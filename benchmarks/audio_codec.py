@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of audio source serialization for database.
+
+Compares binary codec with the previous JSON serialization: encoding, decoding
+of whole record, decoding of title only, and size of records.
+
+Usage::
+
+    python benchmarks/audio_codec.py
+"""
+
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+
+from bot import codec  # noqa: E402
+from bot.schemas import AudioSource, YoutubeVideo  # noqa: E402
+
+COUNT = 10_000
+"Count of records encoded or decoded in one run"
+
+
+def json_encode(audio: AudioSource) -> str:
+    """Previous serialization of audio sources"""
+    type_ = 'youtube' if isinstance(audio, YoutubeVideo) else 'unknown'
+    return json.dumps((type_, audio.serialize()))
+
+
+def json_decode(data: str) -> AudioSource:
+    """Previous deserialization of audio sources"""
+    type_, data = json.loads(data)
+    if type_ == 'youtube':
+        return YoutubeVideo.deserialize(data)
+    return AudioSource.deserialize(data)
+
+
+def _make_videos() -> list[YoutubeVideo]:
+    return [YoutubeVideo(
+        source_url=f'https://rr3---sn-4g5ednly.googlevideo.com/videoplayback?expire=1700000000&id={i}&itag=251'
+                   '&source=youtube&mime=audio%2Fwebm&dur=212.061&lmt=1700000000000000&sig=' + 'A' * 120,
+        origin_query=f'песня номер {i}',
+        id=f'{i:011d}',
+        title=f'Исполнитель {i % 500} — Песня {i} (Official Video)',
+        author=f'Исполнитель {i % 500}',
+        duration=212,
+        acodec='opus',
+    ) for i in range(COUNT)]
+
+
+def _measure(name: str, func, items: list) -> None:
+    best = min(timeit.repeat(lambda: [func(item) for item in items], number=1, repeat=5))
+    print(f'{name:<24} {best / len(items) * 1e6:>6.2f} us per record')
+
+
+def main() -> None:
+    videos = _make_videos()
+    json_records = [json_encode(video) for video in videos]
+    binary_records = [codec.encode(video) for video in videos]
+
+    assert all(codec.decode(record) == video for record, video in zip(binary_records, videos))
+    assert all(json_decode(record) == video for record, video in zip(json_records, videos))
+
+    _measure('json encode', json_encode, videos)
+    _measure('binary encode', codec.encode, videos)
+    _measure('json decode', json_decode, json_records)
+    _measure('binary decode', codec.decode, binary_records)
+    _measure('json decode title', lambda record: json.loads(record)[1]['title'], json_records)
+    _measure('binary decode title', lambda record: codec.decode_field(record, 'title'), binary_records)
+
+    json_size = sum(len(record.encode()) for record in json_records) / COUNT
+    binary_size = sum(len(record) for record in binary_records) / COUNT
+    print(f'record size: json {json_size:.0f} bytes, binary {binary_size:.0f} bytes')
+
+
+if __name__ == '__main__':
+    main()
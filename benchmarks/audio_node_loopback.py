@@ -0,0 +1,219 @@
+"""
+Loopback test of audio node, without Discord.
+
+Starts audio nodes in this process with a fake source producing numbered frames,
+and drives them like bot does: plays, skips, seeks and stops audio, pauses reading
+and disconnects nodes. Frames are read by threads mimicking discord.py audio player.
+Checks frame order and flow control, and measures frame throughput and instruction latency.
+
+To test a real node with ffmpeg, start it and pass its address and an audio file::
+
+    python -m bot.audio_node unix:/tmp/musicbot-node.sock
+    python benchmarks/audio_node_loopback.py --address unix:/tmp/musicbot-node.sock --source audio.mp3
+
+Usage::
+
+    python benchmarks/audio_node_loopback.py [server count]
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.audio_node import AudioNode, AudioNodeClient, AudioNodePool, NodeAudioSource, INITIAL_CREDIT  # noqa: E402
+
+TRACK_FRAMES = 500
+"Length of fake audio (10 seconds)"
+
+
+class FakeSource:
+    """Produces numbered frames. Honors `-ss` option, like ffmpeg"""
+
+    def __init__(self, source: str, options: dict, mode: str) -> None:
+        match = re.search(r'-ss ([\d.]+)', options.get('before_options', ''))
+        self.frame = int(float(match.group(1)) * 50) if match else 0
+        self.length = int(source)
+
+    def read(self) -> bytes:
+        if self.frame >= self.length:
+            return b''
+        self.frame += 1
+        # Typical size of Opus frame
+        return (self.frame - 1).to_bytes(4, 'big') + bytes(116)
+
+    def cleanup(self) -> None:
+        pass
+
+
+class Reader:
+    """Reads frames in own thread, like discord.py audio player"""
+
+    def __init__(self, audio: NodeAudioSource, realtime: bool, paused: bool = False) -> None:
+        self.audio = audio
+        self.frames: list[int] = []
+        self.paused = threading.Event()
+        if paused:
+            self.paused.set()
+        self.done = threading.Event()
+        self._realtime = realtime
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            if self.paused.is_set():
+                time.sleep(0.02)
+                continue
+
+            frame = self.audio.read()
+            if not frame:
+                break
+
+            self.frames.append(int.from_bytes(frame[:4], 'big'))
+            if self._realtime:
+                time.sleep(0.02)
+
+        self.audio.cleanup()
+        self.done.set()
+
+
+async def _wait(event: threading.Event, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not event.is_set():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out')
+        await asyncio.sleep(0.005)
+
+
+async def _check_playback(client: AudioNodeClient, guilds: int) -> None:
+    """Many servers play audio to the end, reading as fast as possible"""
+
+    started = time.perf_counter()
+    readers = [Reader(client.play(guild_id, str(TRACK_FRAMES), {}, 'opus'), realtime=False)
+               for guild_id in range(guilds)]
+
+    for reader in readers:
+        await _wait(reader.done, timeout=60)
+        assert reader.frames == list(range(TRACK_FRAMES)), 'Frames lost or reordered'
+        assert reader.audio.error is None, reader.audio.error
+
+    elapsed = time.perf_counter() - started
+    print(f'Playback: {guilds} servers, {guilds * TRACK_FRAMES / elapsed:,.0f} frames/s')
+
+
+async def _check_control(client: AudioNodeClient) -> None:
+    """Skip, seek and pause of audio read in real time"""
+
+    # Skip
+    reader = Reader(client.play(1, str(TRACK_FRAMES), {}, 'opus'), realtime=True)
+    await asyncio.sleep(0.2)
+    started = time.perf_counter()
+    reader.audio.skip()
+    await _wait(reader.done)
+    print(f'Skip: audio ended in {(time.perf_counter() - started) * 1000:.0f} ms '
+          f'after {len(reader.frames)} frames')
+    assert len(reader.frames) < INITIAL_CREDIT, 'Audio was not skipped'
+
+    # Seek
+    reader = Reader(client.play(2, str(TRACK_FRAMES), {}, 'opus'), realtime=False, paused=True)
+    await asyncio.sleep(0.1)
+    reader.audio.seek(6.0)
+    await asyncio.sleep(0.1)
+    reader.paused.clear()
+    await _wait(reader.done)
+    assert reader.frames == list(range(300, TRACK_FRAMES)), f'Audio was not seeked: {reader.frames[:5]}'
+    print(f'Seek: {len(reader.frames)} frames played after seek to 6 s')
+
+    # Pause: node sends only frames it was allowed to
+    reader = Reader(client.play(3, str(TRACK_FRAMES), {}, 'opus'), realtime=True)
+    await asyncio.sleep(0.2)
+    reader.paused.set()
+    await asyncio.sleep(0.5)
+    buffered = reader.audio._frames.qsize()
+    assert buffered <= INITIAL_CREDIT, f'{buffered} frames buffered while paused'
+    print(f'Pause: {buffered} frames buffered while paused')
+    reader.audio.cleanup()
+
+
+async def _check_balancing(pool: AudioNodePool, guilds: int) -> None:
+    """Servers are spread between nodes"""
+
+    counts = {}
+    for guild_id in range(guilds):
+        node = pool.get_node(guild_id)
+        node.play(guild_id, '1', {}, 'opus')
+        counts[node.address] = counts.get(node.address, 0) + 1
+
+    print('Balancing:', ', '.join(f'{count} servers' for count in counts.values()))
+    assert max(counts.values()) - min(counts.values()) <= 1, 'Servers are not spread evenly'
+
+
+async def _check_disconnect(node: AudioNode, client: AudioNodeClient) -> None:
+    """Audio of lost node ends, so bot goes on with next audio"""
+
+    reader = Reader(client.play(4, str(TRACK_FRAMES), {}, 'opus'), realtime=True)
+    await asyncio.sleep(0.1)
+    await node.close()
+    await _wait(reader.done)
+    assert reader.audio.error is not None, 'Audio error is not set'
+    print(f'Disconnect: audio ended with "{reader.audio.error}"')
+
+
+async def _run_external(address: str, source: str) -> None:
+    """Play real audio on node started separately"""
+
+    client = AudioNodeClient(address)
+    client.start()
+    await asyncio.wait_for(client.wait_connected(), 10)
+
+    started = time.perf_counter()
+    reader = Reader(client.play(1, source, {}, 'opus'), realtime=False)
+    await _wait(reader.done, timeout=600)
+    elapsed = time.perf_counter() - started
+
+    print(f'{len(reader.frames)} frames ({len(reader.frames) / 50:.1f} s of audio) in {elapsed:.2f} s'
+          + (f', error: {reader.audio.error}' if reader.audio.error else ''))
+    await client.close()
+
+
+async def main(guilds: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        addresses = [f'unix:{tmp}/node-{i}.sock' for i in range(2)]
+        nodes = [AudioNode(address, source_factory=FakeSource) for address in addresses]
+        for node in nodes:
+            await node.start()
+
+        pool = AudioNodePool(addresses)
+        pool.start()
+        for client in pool.nodes:
+            await asyncio.wait_for(client.wait_connected(), 10)
+
+        await _check_playback(pool.nodes[0], guilds)
+        await _check_control(pool.nodes[0])
+        await _check_balancing(pool, guilds)
+        await _check_disconnect(nodes[1], pool.nodes[1])
+
+        for client in pool.nodes:
+            await client.close()
+        await nodes[0].close()
+
+    print('OK')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loopback test of audio node')
+    parser.add_argument('guilds', nargs='?', type=int, default=50, help='Count of servers playing at once')
+    parser.add_argument('--address', help='Address of node to test instead of in-process one')
+    parser.add_argument('--source', help='Audio file or link played on external node')
+    args = parser.parse_args()
+
+    if args.address:
+        asyncio.run(_run_external(args.address, args.source))
+    else:
+        asyncio.run(main(args.guilds))
@@ -0,0 +1,125 @@
+"""
+Benchmark of bot database throughput in default and tuned SQLite modes, and with reader connections.
+
+Concurrent guild operations read and save audio through `AsyncBotDatabase`,
+like command handlers do. Reads, writes and mixed load (10% of writes) are
+measured separately. Awaited writes wait for their group commit, so write
+throughput of one operation is bounded by commit interval.
+Latency of reads is measured under mixed load, where reads compete with commits.
+
+Usage::
+
+    python benchmarks/database_throughput.py [seconds per run]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+
+# Bot database and log are created in current directory on import
+_tmp = tempfile.TemporaryDirectory()
+os.chdir(_tmp.name)
+
+from bot.data import SQLiteBotDatabase, SavedAudio  # noqa: E402
+from bot.database import AsyncBotDatabase  # noqa: E402
+from bot.schemas import YoutubeVideo  # noqa: E402
+
+CONCURRENCY = (1, 8, 64)
+"Counts of concurrent guild operations"
+GUILDS = 1000
+"Count of guilds in database"
+SAVES = 10
+"Count of saved audio of each guild"
+MODES = {
+    'default': {'tuned': False, 'readers': 0},
+    'tuned': {'tuned': True, 'readers': 0},
+    'readers': {'tuned': True, 'readers': 4},
+}
+
+
+def _audio(guild_id: int, i: int) -> SavedAudio:
+    video = YoutubeVideo(
+        source_url=None, origin_query=f'audio {i}', id=f'{guild_id}-{i}', title=f'Audio {i}', author='Author',
+        duration=180)
+    return SavedAudio(f'Сохранение {i}', 'youtube', video)
+
+
+async def _fill(database: AsyncBotDatabase) -> None:
+    # Writes are done only once committed, so they are queued without waiting
+    for guild_id in range(GUILDS):
+        database.write_nowait(database.repository.set_guild_language, guild_id, 'uk')
+        for i in range(SAVES):
+            database.write_nowait(database.repository.save_guild_audio, guild_id, _audio(guild_id, i))
+    await asyncio.wrap_future(database.flush())
+
+
+async def _read(database: AsyncBotDatabase) -> None:
+    guild_id = random.randrange(GUILDS)
+    if random.random() < 0.5:
+        await database.get_guild_language(guild_id)
+    else:
+        await database.get_guild_saved_audio_by_name(guild_id, f'сохранение {random.randrange(SAVES)}')
+
+
+async def _write(database: AsyncBotDatabase) -> None:
+    guild_id = random.randrange(GUILDS)
+    await database.save_guild_audio(guild_id, _audio(guild_id, random.randrange(SAVES)))
+
+
+async def _run(database: AsyncBotDatabase, concurrency: int, duration: float,
+               write_ratio: float) -> tuple[list[float], int, float]:
+    """Run operations for `duration` seconds. Returns read latencies, count of writes and elapsed time"""
+
+    latencies = []
+    writes = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal writes
+        while time.perf_counter() < deadline:
+            if random.random() < write_ratio:
+                await _write(database)
+                writes += 1
+            else:
+                started = time.perf_counter()
+                await _read(database)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await asyncio.wrap_future(database.flush())
+    return latencies, writes, time.perf_counter() - started
+
+
+async def main(duration: float) -> None:
+    print(f'{"mode":<8} {"guild ops":>9} {"reads/s":>10} {"writes/s":>10} '
+          f'{"mixed reads/s":>14} {"mixed writes/s":>15} {"mixed read p99":>15}')
+
+    for mode, options in MODES.items():
+        path = os.path.join(_tmp.name, f'{mode}.sqlite')
+        database = AsyncBotDatabase(SQLiteBotDatabase(path, **options), commit_interval=0.05)
+        await _fill(database)
+
+        for concurrency in CONCURRENCY:
+            reads, _, elapsed = await _run(database, concurrency, duration, 0)
+            read_rate = len(reads) / elapsed
+            _, writes, elapsed = await _run(database, concurrency, duration, 1)
+            write_rate = writes / elapsed
+            reads, writes, elapsed = await _run(database, concurrency, duration, 0.1)
+            p99 = sorted(reads)[int(len(reads) * 0.99)] * 1000
+
+            print(f'{mode:<8} {concurrency:>9} {read_rate:>10,.0f} {write_rate:>10,.0f} '
+                  f'{len(reads) / elapsed:>14,.0f} {writes / elapsed:>15,.0f} {p99:>12.2f} ms')
+
+        database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else 2))
@@ -0,0 +1,107 @@
+"""
+Benchmark of outbound message scheduler with simulated Discord channels.
+
+Several commands are replied to at once in busy channels. Fake channels count
+requests and fail on requests over the channel rate limit, like Discord would
+answer with 429. Compares direct sends with scheduler, which paces requests,
+merges status messages of backlogged channels and edits "searching" messages in place.
+The rate limit period is shortened, so the benchmark runs fast.
+
+Usage::
+
+    python benchmarks/message_scheduler.py [channels] [commands per channel]
+"""
+
+import os
+import sys
+import time
+import asyncio
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+
+from bot.messages import MessageScheduler  # noqa: E402
+
+PERIOD = 0.5
+"Period of simulated channel rate limit (in seconds)"
+
+
+class FakeMessage:
+    def __init__(self, channel: 'FakeChannel', content: str) -> None:
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: str) -> 'FakeMessage':
+        await self.channel.request()
+        self.content = content
+        return self
+
+
+class FakeChannel:
+    """Channel that allows `MessageScheduler.RATE` requests per `PERIOD`, like Discord"""
+
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id
+        self.requests = 0
+        self.rate_limited = 0
+        self._history = deque()
+
+    async def request(self) -> None:
+        await asyncio.sleep(0.005)
+        now = time.monotonic()
+        while self._history and now - self._history[0] >= PERIOD:
+            self._history.popleft()
+
+        self.requests += 1
+        if len(self._history) >= MessageScheduler.RATE:
+            self.rate_limited += 1
+            return
+        self._history.append(now)
+
+    async def send(self, content: str) -> FakeMessage:
+        await self.request()
+        return FakeMessage(self, content)
+
+
+async def _command_direct(channel: FakeChannel, number: int) -> None:
+    await channel.send('Searching...')
+    await asyncio.sleep(0.01)
+    await channel.send(f'Playing {number}')
+
+
+async def _command_scheduled(scheduler: MessageScheduler, channel: FakeChannel, number: int) -> None:
+    callback = scheduler.send(channel, 'Searching...', status=True)
+    await asyncio.sleep(0.01)
+    message = await callback.edit(f'Playing {number}')
+    assert f'Playing {number}' in message.content.split('\n')
+
+
+async def _run(channels: int, commands: int, scheduled: bool) -> None:
+    scheduler = MessageScheduler()
+    scheduler.PERIOD = PERIOD
+    fake_channels = [FakeChannel(i) for i in range(channels)]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _command_scheduled(scheduler, channel, i) if scheduled else _command_direct(channel, i)
+        for channel in fake_channels for i in range(commands)
+    ))
+    elapsed = time.perf_counter() - started
+
+    requests = sum(channel.requests for channel in fake_channels)
+    limited = sum(channel.rate_limited for channel in fake_channels)
+    print(f'{"scheduler" if scheduled else "direct":<10} {requests:>6} requests, {limited:>6} rate limited, '
+          f'{scheduler.merged:>5} merged, {elapsed:.2f} s')
+
+
+def main(channels: int, commands: int) -> None:
+    print(f'{channels} channels, {commands} commands per channel, '
+          f'{MessageScheduler.RATE} requests per {PERIOD} s per channel')
+    asyncio.run(_run(channels, commands, scheduled=False))
+    asyncio.run(_run(channels, commands, scheduled=True))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,114 @@
+"""
+Benchmark of CPU time per audio stream for PCM and Opus playback paths.
+
+Decodes audio as fast as possible (not in real time) and reports CPU seconds
+spent per second of audio, which is the share of one core a playing server takes.
+
+- `pcm`: ffmpeg decodes to PCM, then discord.py encodes Opus in bot process
+- `opus-transcode`: ffmpeg encodes Opus (used when filters are applied)
+- `opus-copy`: ffmpeg copies Opus stream as is
+
+Usage::
+
+    python benchmarks/playback_cpu.py <file or direct link to opus/webm audio>
+"""
+
+import sys
+import time
+import shutil
+import resource
+import subprocess
+
+FRAME_SIZE = 3840
+"Size of 20 ms PCM frame (48 kHz, stereo, 16 bit), as read by `discord.FFmpegPCMAudio`"
+
+
+def _children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _self_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _get_duration(source: str) -> float:
+    """Get audio duration using ffprobe"""
+
+    out = subprocess.check_output([
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1', source,
+    ])
+    return float(out)
+
+
+def run_pcm(source: str) -> tuple[float, float]:
+    """Returns (ffmpeg CPU time, bot process CPU time)"""
+
+    try:
+        from discord.opus import Encoder
+        encoder = Encoder()
+    except Exception as e:  # libopus or discord.py is missing
+        print(f'Opus encoder is not available, bot-side encoding is not measured: {e}')
+        encoder = None
+
+    children_before = _children_cpu_time()
+    self_before = _self_cpu_time()
+
+    proc = subprocess.Popen(
+        ['ffmpeg', '-i', source, '-f', 's16le', '-ar', '48000', '-ac', '2', '-loglevel', 'warning', 'pipe:1'],
+        stdout=subprocess.PIPE,
+    )
+    while frame := proc.stdout.read(FRAME_SIZE):
+        if encoder is not None and len(frame) == FRAME_SIZE:
+            encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+    proc.wait()
+
+    return _children_cpu_time() - children_before, _self_cpu_time() - self_before
+
+
+def run_opus(source: str, codec: str) -> tuple[float, float]:
+    """Returns (ffmpeg CPU time, bot process CPU time)"""
+
+    children_before = _children_cpu_time()
+    self_before = _self_cpu_time()
+
+    # Same arguments as `discord.FFmpegOpusAudio`
+    proc = subprocess.Popen(
+        ['ffmpeg', '-i', source, '-map_metadata', '-1', '-f', 'opus', '-c:a', codec,
+         '-ar', '48000', '-ac', '2', '-b:a', '128k', '-loglevel', 'warning', 'pipe:1'],
+        stdout=subprocess.PIPE,
+    )
+    while proc.stdout.read(65536):
+        pass
+    proc.wait()
+
+    return _children_cpu_time() - children_before, _self_cpu_time() - self_before
+
+
+def main(source: str) -> None:
+    if shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None:
+        sys.exit('ffmpeg and ffprobe are required')
+
+    duration = _get_duration(source)
+    print(f'Audio duration: {duration:.1f} s\n')
+    print(f'{"path":<16}{"ffmpeg cpu":>12}{"bot cpu":>12}{"cpu/audio s":>14}{"streams/core":>14}')
+
+    for name, run in (
+            ('pcm', lambda: run_pcm(source)),
+            ('opus-transcode', lambda: run_opus(source, 'libopus')),
+            ('opus-copy', lambda: run_opus(source, 'copy')),
+    ):
+        started = time.perf_counter()
+        ffmpeg_cpu, bot_cpu = run()
+        per_second = (ffmpeg_cpu + bot_cpu) / duration
+        streams = 1 / per_second if per_second else float('inf')
+        print(f'{name:<16}{ffmpeg_cpu:>11.2f}s{bot_cpu:>11.2f}s{per_second:>14.4f}{streams:>14.0f}'
+              f'  ({time.perf_counter() - started:.1f} s wall)')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
@@ -0,0 +1,168 @@
+"""
+Stress test of `AudioController` playback scheduling.
+
+Sends thousands of interleaved add and skip operations to controllers of several
+servers, while fake voice clients end audio at random moments from their own
+threads (like discord.py audio thread does). Then checks that no audio was
+played twice, and that after the storm every queued audio is played once, in order.
+
+ffmpeg and network are not used: audio preparing and sources are replaced with stubs.
+
+Usage::
+
+    python benchmarks/playback_stress.py [operation count] [server count]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+os.environ.setdefault('TRACK_CACHE_MAX_MB', '0')
+
+from discord import ClientException  # noqa: E402
+from bot import audio  # noqa: E402
+from bot.audio import AudioController, _PreparedAudio  # noqa: E402
+from bot.schemas import AudioSource  # noqa: E402
+
+
+class FakeSource:
+    """Replaces ffmpeg audio source"""
+
+    def __init__(self, source: str, **options) -> None:
+        self.source = source
+        self._process = SimpleNamespace(pid=id(self), poll=lambda: 0)
+
+    def cleanup(self) -> None:
+        pass
+
+
+class FakePlayer:
+    """Audio player thread, which ends audio after random delay or on stop"""
+
+    def __init__(self, after: callable, duration: float) -> None:
+        self._after = after
+        self._done = threading.Event()
+        self._called = threading.Lock()
+        threading.Thread(target=self._run, args=(duration,), daemon=True).start()
+
+    def _run(self, duration: float) -> None:
+        self._done.wait(duration)
+        self._done.set()
+        self._after(None)
+
+    def stop(self) -> None:
+        self._done.set()
+
+    def is_playing(self) -> bool:
+        return not self._done.is_set()
+
+
+class FakeVoiceClient:
+    """Mimics `discord.VoiceClient` playback state"""
+
+    def __init__(self, guild_id: int, max_duration: float) -> None:
+        self.guild = SimpleNamespace(id=guild_id)
+        self.channel = SimpleNamespace(id=guild_id)
+        self.max_duration = max_duration
+        self.played: list[str] = []
+        self._player: FakePlayer | None = None
+
+    def play(self, source: FakeSource, after: callable) -> None:
+        if self.is_playing():
+            raise ClientException('Already playing audio.')
+        self.played.append(source.source)
+        self._player = FakePlayer(after, random.uniform(0, self.max_duration))
+
+    def stop(self) -> None:
+        if self._player is not None:
+            self._player.stop()
+            self._player = None
+
+    def is_playing(self) -> bool:
+        return self._player is not None and self._player.is_playing()
+
+    def is_paused(self) -> bool:
+        return False
+
+
+def _prepare(source: AudioSource, offset: float = 0.0, played: float = 0.0) -> _PreparedAudio:
+    return _PreparedAudio(source.source_url, {})
+
+
+def _make_sources(guild_id: int, start: int, count: int) -> list[AudioSource]:
+    return [AudioSource(title=f'{guild_id}/{i}', source_url=f'{guild_id}/{i}') for i in range(start, start + count)]
+
+
+async def _wait_idle(controllers: list[AudioController], timeout: float) -> None:
+    """Wait until all queues are played. Playback stalled with non-empty queue fails on timeout"""
+
+    deadline = time.monotonic() + timeout
+    while any(c.is_active or not c._ops.empty() or len(c.queue) != 0 for c in controllers):
+        if time.monotonic() > deadline:
+            raise AssertionError('Playback stalled')
+        await asyncio.sleep(0.01)
+
+
+async def main(operations: int, guilds: int) -> None:
+    random.seed(0)
+    audio.FFmpegOpusAudio = audio.FFmpegPCMAudio = FakeSource
+    AudioController._prepare = staticmethod(_prepare)
+
+    clients = [FakeVoiceClient(guild_id, max_duration=0.002) for guild_id in range(guilds)]
+    controllers = [AudioController.get_controller(client) for client in clients]
+    added = {client.guild.id: 0 for client in clients}
+
+    # Storm: random interleaving of operations, with audio ending at random moments
+    started = time.perf_counter()
+    for i in range(operations):
+        client = random.choice(clients)
+        controller = AudioController.get_controller(client)
+
+        if random.random() < 0.6:
+            count = random.randint(1, 5)
+            controller.add(_make_sources(client.guild.id, added[client.guild.id], count))
+            added[client.guild.id] += count
+        else:
+            controller.skip(random.randint(1, 3))
+
+        if i % 10 == 0:
+            await asyncio.sleep(random.uniform(0, 0.001))
+
+    await _wait_idle(controllers, timeout=60)
+    storm_time = time.perf_counter() - started
+
+    for client in clients:
+        assert len(client.played) == len(set(client.played)), f'Audio played twice on server {client.guild.id}'
+
+    # Calm: every added audio must be played once and in order
+    for client, controller in zip(clients, controllers):
+        client.played.clear()
+        sources = _make_sources(client.guild.id, added[client.guild.id], 50)
+        for i in range(0, len(sources), 5):
+            controller.add(sources[i:i + 5])
+
+    await _wait_idle(controllers, timeout=60)
+
+    for client in clients:
+        expected = [f'{client.guild.id}/{i}' for i in range(added[client.guild.id], added[client.guild.id] + 50)]
+        assert client.played == expected, f'Audio lost or reordered on server {client.guild.id}'
+
+    total_added = sum(added.values())
+    print(f'{operations} operations on {guilds} servers, {total_added} audio added: '
+          f'OK in {storm_time:.2f} s')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        sys.exit(__doc__)
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 8,
+    ))
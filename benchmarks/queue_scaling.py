@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of `AudioQueue` operations at different queue sizes.
+
+Compares current deque-based queue with the previous list-based implementation.
+
+Usage::
+
+    python benchmarks/queue_scaling.py
+"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+
+from bot.audio import AudioQueue  # noqa: E402
+from bot.schemas import AudioSource  # noqa: E402
+
+SIZES = (1_000, 10_000, 100_000)
+BATCH = 100
+"Count of audio in bulk operations (skip, set_next)"
+
+
+class ListAudioQueue(list):
+    """Previous list-based implementation of queue operations"""
+
+    current = None
+
+    def skip(self, count: int = 1):
+        for _ in range(count):
+            if len(self) == 0:
+                self.current = None
+                break
+            self.current = self.pop(0)
+
+    def set_next(self, audio: list):
+        for i, aud in enumerate(audio):
+            self.insert(i, aud)
+
+    def shuffle(self):
+        random.shuffle(self)
+
+    @property
+    def full_queue(self):
+        return [self.current, *self]
+
+
+def _make_queue(cls: type, size: int, tracks: list[AudioSource]):
+    queue = cls(0) if cls is AudioQueue else cls()
+    queue.extend(tracks[:size])
+    return queue
+
+
+def main() -> None:
+    tracks = [AudioSource(title=f'track {i}', source_url=f'https://example.com/{i}') for i in range(max(SIZES))]
+    batch = tracks[:BATCH]
+
+    operations = {
+        'append+popleft': lambda q: (q.append(batch[0]), q.skip()),
+        f'skip({BATCH})': lambda q: (q.skip(BATCH), q.extend(batch)),
+        f'set_next({BATCH})': lambda q: (q.set_next(batch), q.skip(BATCH)),
+        'insert middle': lambda q: (q.insert(len(q) // 2, batch[0]), q.__delitem__(len(q) // 2)),
+        'full_queue[:20]': lambda q: [a for _, a in zip(range(20), q.full_queue)],
+        'shuffle': lambda q: q.shuffle(),
+    }
+
+    print(f'{"operation":<18}{"size":>9}{"list, us":>14}{"deque, us":>14}')
+
+    for name, operation in operations.items():
+        for size in SIZES:
+            results = []
+            for cls in (ListAudioQueue, AudioQueue):
+                queue = _make_queue(cls, size, tracks)
+                number = 3 if name == 'shuffle' else 50
+                results.append(min(timeit.repeat(lambda: operation(queue), number=number, repeat=3)) / number)
+            print(f'{name:<18}{size:>9}{results[0] * 1e6:>14.1f}{results[1] * 1e6:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
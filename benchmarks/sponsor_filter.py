@@ -0,0 +1,124 @@
+"""
+Benchmark of SponsorBlock segment removal: previous `atrim` + `concat` filter
+against interval merging with input seek and single `aselect` filter.
+
+Reports ffmpeg CPU time and time to first audio byte for video with many segments.
+
+Usage::
+
+    python benchmarks/sponsor_filter.py <file or direct link to audio> [segment count]
+"""
+
+import os
+import sys
+import time
+import shlex
+import random
+import shutil
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+
+from bot import ytdlp  # noqa: E402
+from bot.schemas import SkipSegment  # noqa: E402
+
+
+def old_sponsor_filter(segments: list[SkipSegment], vid_duration_s: int) -> str:
+    """Previous implementation of `ytdlp.get_ffmpeg_sponsor_options`"""
+
+    filter_complex = ''
+    count_of_segments = 0
+
+    start = 0
+    end = segments[0].start
+    if end - start > 1:
+        filter_complex += f"[0:a]atrim={start}:{end},asetpts=PTS-STARTPTS[a0];"
+        count_of_segments += 1
+
+    for i, segment in enumerate(segments):
+        next_segment = segments[i + 1] if i + 1 < len(segments) else None
+        start = segment.end
+        end = next_segment.start if next_segment else vid_duration_s
+
+        if end - start < 1 and len(segments) > 1:
+            continue
+
+        filter_complex += f"[0:a]atrim={start}:{end},asetpts=PTS-STARTPTS[a{count_of_segments}];"
+        count_of_segments += 1
+
+    for i in range(count_of_segments):
+        filter_complex += f"[a{i}]"
+
+    filter_complex += f"concat=n={count_of_segments}:v=0:a=1[outa]"
+
+    return f'-filter_complex "{filter_complex}" -map "[outa]"'
+
+
+def _make_segments(duration: float, count: int) -> list[SkipSegment]:
+    """Intro at the start and `count` random segments (non-overlapping, so old filter can handle them)"""
+
+    random.seed(0)
+    intro_end = min(30.0, duration / 10)
+    slot = (duration - intro_end) / count
+    segments = [SkipSegment(0, intro_end, 'intro')]
+
+    for i in range(count):
+        length = random.uniform(0.2, 0.6) * slot
+        start = intro_end + i * slot + random.uniform(0, slot - length)
+        segments.append(SkipSegment(start, start + length, 'sponsor'))
+
+    return segments
+
+
+def _run(source: str, before_options: str, options: str) -> tuple[float, float, float]:
+    """Returns (ffmpeg CPU time, time to first audio, total time)"""
+
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+
+    proc = subprocess.Popen(
+        ['ffmpeg', *shlex.split(before_options), '-i', source, *shlex.split(options),
+         '-f', 's16le', '-ar', '48000', '-ac', '2', '-loglevel', 'error', 'pipe:1'],
+        stdout=subprocess.PIPE,
+    )
+    proc.stdout.read(1)
+    first_audio = time.perf_counter() - started
+    while proc.stdout.read(65536):
+        pass
+    proc.wait()
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = usage.ru_utime + usage.ru_stime - usage_before.ru_utime - usage_before.ru_stime
+    return cpu, first_audio, time.perf_counter() - started
+
+
+def main(source: str, count: int) -> None:
+    if shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None:
+        sys.exit('ffmpeg and ffprobe are required')
+
+    duration = float(subprocess.check_output([
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1', source,
+    ]))
+    segments = _make_segments(duration, count)
+    new_options = ytdlp.get_ffmpeg_sponsor_options(segments, duration)
+
+    print(f'Duration: {duration:.1f} s, segments: {len(segments)}, '
+          f'kept intervals: {len(ytdlp.get_kept_intervals(segments, duration))}\n')
+    print(f'{"filter":<10}{"ffmpeg cpu":>12}{"first audio":>13}{"total":>10}')
+
+    for name, before_options, options in (
+            ('old', '', old_sponsor_filter(segments, duration)),
+            ('new', new_options.before_options, new_options.options),
+    ):
+        cpu, first_audio, total = _run(source, before_options, options)
+        print(f'{name:<10}{cpu:>11.2f}s{first_audio:>12.3f}s{total:>9.2f}s')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else 30)
@@ -0,0 +1,74 @@
+"""
+Benchmark of bot startup path: import of `settings` and `bot.data`, and first use of language.
+
+Each run is a fresh interpreter. Runs are made with cold cache of compiled
+localization files (YAML is parsed) and with warm cache. Time of loading
+all languages is also compared with parsing YAML, as it was done on every start before.
+
+Usage::
+
+    python benchmarks/startup_import.py [runs]
+"""
+
+import os
+import sys
+import json
+import shutil
+import statistics
+import subprocess
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+
+LANGS_DIR = os.path.join(ROOT, 'langs')
+CACHE_DIR = os.path.join(LANGS_DIR, '__pycache__')
+
+# Runs in bot directory, as settings find localization files by script path
+_STARTUP_SCRIPT = f'''
+import sys, time, json
+sys.path[0] = {ROOT!r}
+started = time.perf_counter()
+import settings
+import bot.data
+imported = time.perf_counter()
+bot.data.langs[settings.os.getenv('DEFAULT_LANG')]['text.empty']
+print(json.dumps([imported - started, time.perf_counter() - imported]))
+'''
+
+
+def _run_startup(cold: bool) -> tuple[float, float]:
+    """Start interpreter and get times of import and first use of language"""
+
+    if cold:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+    # Bot database and log are created in current directory
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], cwd=tmp,
+                                capture_output=True, text=True, check=True).stdout
+
+    return tuple(json.loads(output))
+
+
+def main(runs: int) -> None:
+    for cold in (True, False):
+        times = [_run_startup(cold) for _ in range(runs)]
+        import_time = statistics.median(t[0] for t in times) * 1000
+        lang_time = statistics.median(t[1] for t in times) * 1000
+        print(f'{"cold" if cold else "warm"} cache: import {import_time:.1f} ms, first language use {lang_time:.1f} ms')
+
+    from bot.utils import load_lang_file
+
+    files = [os.path.join(LANGS_DIR, file) for file in os.listdir(LANGS_DIR) if file.endswith(('.yaml', '.yml'))]
+    parse = min(timeit.repeat(lambda: [load_lang_file(file) for file in files], number=10, repeat=5)) / 10
+    cached = min(timeit.repeat(lambda: [load_lang_file(file, CACHE_DIR) for file in files], number=10, repeat=5)) / 10
+    print(f'loading {len(files)} languages: parsing YAML {parse * 1000:.2f} ms, '
+          f'compiled cache {cached * 1000:.2f} ms ({parse / cached:.0f}x faster)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,115 @@
+"""
+Memory benchmark of queued YouTube videos.
+
+Fills queue with videos made from yt-dlp-like info dictionaries, and measures
+memory held per queued video. Compares current compact `YoutubeVideo` with the
+previous dataclass, which kept description, thumbnail and duration string.
+
+Usage::
+
+    python benchmarks/track_memory.py [queue size]
+"""
+
+import os
+import sys
+import random
+import string
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'false')
+
+from bot.audio import AudioQueue  # noqa: E402
+from bot.schemas import YoutubeVideo  # noqa: E402
+
+AUTHORS = 2000
+"Count of distinct authors in queue"
+
+
+@dataclass
+class LegacyYoutubeVideo:
+    """Previous implementation of `YoutubeVideo`"""
+
+    title: str
+    source_url: str | None
+    origin_query: str
+    id: str
+    author: str
+    description: str
+    duration: int
+    duration_str: str
+    thumbnail: str
+    acodec: str | None = None
+
+    @staticmethod
+    def from_ydl(vid_info: dict[str, any]) -> 'LegacyYoutubeVideo':
+        return LegacyYoutubeVideo(
+            source_url=vid_info.get('url'),
+            origin_query=vid_info.get('original_url'),
+            id=vid_info.get('id'),
+            title=vid_info.get('title'),
+            author=vid_info.get('uploader'),
+            description=vid_info.get('description'),
+            duration=vid_info.get('duration'),
+            duration_str=vid_info.get('duration_string'),
+            thumbnail=vid_info.get('thumbnail'),
+            acodec=vid_info.get('acodec'),
+        )
+
+
+def _make_info(rng: random.Random, text: str, authors: list[str]) -> dict[str, any]:
+    """Make info dictionary like `YoutubeDL.extract_info` returns. All strings are new objects, as after parsing"""
+
+    video_id = ''.join(rng.choices(string.ascii_letters + string.digits + '-_', k=11))
+    duration = rng.randint(60, 600)
+    start = rng.randrange(len(text) - 5000)
+
+    return {
+        'id': video_id,
+        'title': text[start:start + rng.randint(20, 80)],
+        'uploader': ''.join(rng.choice(authors)),
+        # Descriptions are often several KB
+        'description': text[start:start + rng.randint(200, 5000)],
+        'duration': duration,
+        'duration_string': f'{duration // 60}:{duration % 60:02}',
+        'thumbnail': f'https://i.ytimg.com/vi_webp/{video_id}/maxresdefault.webp',
+        'original_url': f'https://www.youtube.com/watch?v={video_id}',
+        # Stream links aren't kept for queued videos until they are resolved
+        'url': None,
+        'acodec': 'opus',
+    }
+
+
+def _measure(factory, size: int) -> float:
+    """Get memory held per queued video (in bytes)"""
+
+    rng = random.Random(0)
+    text = ''.join(rng.choices(string.ascii_letters + ' ' * 10, k=100_000))
+    authors = [f'Channel {i}' for i in range(AUTHORS)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    queue = AudioQueue.get_queue(id(factory))
+    queue.extend([factory(_make_info(rng, text, authors)) for _ in range(size)])
+
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    queue.delete()
+    return used / size
+
+
+def main(size: int) -> None:
+    legacy = _measure(LegacyYoutubeVideo.from_ydl, size)
+    compact = _measure(YoutubeVideo.from_ydl, size)
+
+    print(f'Queue of {size:,} videos, {AUTHORS:,} authors')
+    print(f'previous: {legacy:>8,.0f} bytes per video')
+    print(f'compact:  {compact:>8,.0f} bytes per video ({legacy / compact:.1f}x less)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -3,78 +3,256 @@ Module for working with audio
 """
 
 import os
-
-from discord import VoiceClient, FFmpegPCMAudio
+import time
+import asyncio
+import random
+import logging
+import weakref
+from collections import deque
+from collections.abc import Iterator, Iterable, Callable
+from itertools import chain
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+
+from discord import VoiceClient, FFmpegPCMAudio, FFmpegOpusAudio, ClientException
 from settings import FFMPEG_OPTIONS
-from bot import ytdlp
-from bot.schemas import AudioSource, YoutubeVideo
-
-
-class AudioQueue(list):
+from bot import ytdlp, metrics, ffmpeg
+from bot.cache import is_url_expired
+from bot.schemas import AudioSource, YoutubeVideo, SkipSegment
+from bot.workers import ExtractionError
+from bot.track_cache import TrackCache
+from bot.registry import GuildRegistry
+from bot.persistence import QueueJournal
+from bot.audio_node import AudioNodePool
+
+_logger = logging.getLogger(__name__)
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='prefetch')
+"Executor for preparing next audio while current one is playing"
+_track_gap = metrics.histogram('audio.track_gap_seconds')
+"Time between end of one audio and start of next one"
+
+track_cache = TrackCache(
+    path=os.getenv('TRACK_CACHE_DIR'),
+    max_bytes=int(os.getenv('TRACK_CACHE_MAX_MB')) * 1024 * 1024,
+    min_plays=int(os.getenv('TRACK_CACHE_MIN_PLAYS')),
+    ffmpeg_executable=FFMPEG_OPTIONS['executable'],
+)
+"Local cache of popular tracks"
+queue_journal = QueueJournal()
+"Journal of queue changes, used to resume playback after restart"
+audio_nodes = AudioNodePool([address for address in os.getenv('AUDIO_NODES').split(',') if address])
+"Audio node processes playback is delegated to. If none are connected, audio is played in bot process"
+
+
+class AudioQueue(deque):
     """
     Audio queue manager
+
+    Based on `deque`: adding and removing audio at both ends is O(1),
+    positional insert and removal (`insert`, `del queue[i]`) rotate from the nearest end.
+
+    Changes are recorded to `queue_journal`. Audio is numbered by sparse sequence
+    numbers, `SEQ_STEP` apart, so audio added or removed anywhere in queue is saved
+    as one row. Queue is renumbered and saved whole only if there is no free number
+    between neighbours of inserted audio, or if its order is reversed.
     """
 
-    _global_queue: dict[str, 'AudioQueue'] = {}
-    "Global queue mapping for all servers"
+    SEQ_STEP = 1 << 20
+    "Gap between sequence numbers of neighbouring audio added to queue end"
+
+    _global_queue = GuildRegistry(
+        'queues',
+        idle_timeout=int(os.getenv('GUILD_IDLE_TIMEOUT')),
+        factory=lambda guild_id: AudioQueue(guild_id),
+        is_idle=lambda queue: queue.current is None and len(queue) == 0,
+    )
+    "Global queue mapping for all servers. Empty queues are evicted when unused"
 
     @classmethod
     def get_queue(cls, guild_id: int) -> 'AudioQueue':
         """Get queue for server"""
-
-        _guild_id = str(guild_id)
-        queue = cls._global_queue.get(_guild_id)
-
-        # Create queue if it doesn't exist
-        if queue is None:
-            queue = AudioQueue(guild_id)
-            cls._global_queue[_guild_id] = queue
-
-        return queue
+        return cls._global_queue.get(guild_id)
 
     @classmethod
     def del_queue(cls, guild_id: int):
-        """Delete queue from global queue list"""
+        """Delete queue from global queue list and forget its saved state"""
 
-        _guild_id = str(guild_id)
-
-        if _guild_id in cls._global_queue:
-            del cls._global_queue[_guild_id]
+        queue_journal.forget(guild_id)
+        cls._global_queue.remove(guild_id)
 
     def __init__(self, guild_id: int) -> None:
         super().__init__()
 
         self.guild_id: int = guild_id
         "Server ID"
-        self.on_replay: bool = False
+        self._on_replay: bool = False
         "Audio replay flag"
         self._current: AudioSource | None = None
         "Current audio"
         self._latest: AudioSource | None = None
         "Latest played audio"
+        self._seqs: deque[int] = deque()
+        "Sequence numbers of audio in queue, in queue order"
+
+    # Mutating `deque` methods, recording changes to journal
+
+    def append(self, audio: AudioSource) -> None:
+        seq = self._seqs[-1] + self.SEQ_STEP if self._seqs else 0
+        self._seqs.append(seq)
+        queue_journal.insert(self.guild_id, seq, audio)
+        super().append(audio)
+
+    def appendleft(self, audio: AudioSource) -> None:
+        seq = self._seqs[0] - self.SEQ_STEP if self._seqs else 0
+        self._seqs.appendleft(seq)
+        queue_journal.insert(self.guild_id, seq, audio)
+        super().appendleft(audio)
+
+    def extend(self, audio: Iterable[AudioSource]) -> None:
+        audio = list(audio)
+        start = self._seqs[-1] + self.SEQ_STEP if self._seqs else 0
+        seqs = range(start, start + len(audio) * self.SEQ_STEP, self.SEQ_STEP)
+
+        if queue_journal.recording:
+            for seq, aud in zip(seqs, audio):
+                queue_journal.insert(self.guild_id, seq, aud)
+        self._seqs.extend(seqs)
+        super().extend(audio)
+
+    def extendleft(self, audio: Iterable[AudioSource]) -> None:
+        for aud in audio:
+            self.appendleft(aud)
+
+    def popleft(self) -> AudioSource:
+        audio = super().popleft()
+        queue_journal.delete(self.guild_id, self._seqs.popleft())
+        return audio
+
+    def pop(self) -> AudioSource:
+        audio = super().pop()
+        queue_journal.delete(self.guild_id, self._seqs.pop())
+        return audio
+
+    def clear(self) -> None:
+        super().clear()
+        self._seqs.clear()
+        queue_journal.clear(self.guild_id)
+
+    def __iadd__(self, audio: Iterable[AudioSource]) -> 'AudioQueue':
+        self.extend(audio)
+        return self
+
+    def insert(self, i: int, audio: AudioSource) -> None:
+        # Same index handling as `list.insert`
+        i = min(max(i + len(self) if i < 0 else i, 0), len(self))
+
+        if i == 0:
+            return self.appendleft(audio)
+        if i == len(self):
+            return self.append(audio)
+
+        super().insert(i, audio)
+        before, after = self._seqs[i - 1], self._seqs[i]
+
+        if after - before > 1:
+            seq = (before + after) // 2
+            self._seqs.insert(i, seq)
+            queue_journal.insert(self.guild_id, seq, audio)
+        else:
+            self._seqs.insert(i, before)
+            self._renumber()
+
+    def remove(self, audio: AudioSource) -> None:
+        del self[self.index(audio)]
+
+    def __delitem__(self, i: int) -> None:
+        super().__delitem__(i)
+        seq = self._seqs[i]
+        del self._seqs[i]
+        queue_journal.delete(self.guild_id, seq)
+
+    def __setitem__(self, i: int, audio: AudioSource) -> None:
+        super().__setitem__(i, audio)
+        queue_journal.insert(self.guild_id, self._seqs[i], audio)
+
+    def rotate(self, n: int = 1) -> None:
+        if len(self) == 0:
+            return
+
+        # Move audio between queue ends through the shorter way
+        n %= len(self)
+        if n <= len(self) // 2:
+            for _ in range(n):
+                self.appendleft(self.pop())
+        else:
+            for _ in range(len(self) - n):
+                self.append(self.popleft())
+
+    def reverse(self) -> None:
+        super().reverse()
+        self._renumber()
+
+    def _renumber(self) -> None:
+        """Number audio from scratch and record whole queue to journal"""
+
+        self._seqs = deque(range(0, len(self) * self.SEQ_STEP, self.SEQ_STEP))
+        queue_journal.clear(self.guild_id)
+
+        if queue_journal.recording:
+            for seq, audio in zip(self._seqs, self):
+                queue_journal.insert(self.guild_id, seq, audio)
 
     @property
-    def full_queue(self) -> list[AudioSource]:
-        """Queue with current audio included"""
+    def full_queue(self) -> Iterator[AudioSource]:
+        """Queue with current audio included. Iterates over queue without copying it"""
 
         if self.current is None:
-            return self.copy()
+            return iter(self)
+
+        return chain((self.current,), self)
+
+    def copy(self) -> list[AudioSource]:
+        """Get copy of queue without current audio"""
+        return list(self)
+
+    def skip(self, count: int = 1):
+        """Skip audio"""
 
-        return [self.current, *self]
+        skipped = min(count, len(self))
+
+        # Drop skipped audio at once, only last two of them become latest and current
+        for _ in range(skipped - 2):
+            self.popleft()
+        if skipped >= 2:
+            self.current = self.popleft()
+        if skipped >= 1:
+            self.current = self.popleft()
+
+        # Queue ended
+        if count > skipped:
+            self.current = None
+
+    def shuffle(self):
+        """Shuffle queue"""
+
+        items = list(self)
+        random.shuffle(items)
+        self.clear()
+        self.extend(items)
 
     def delete(self):
         """Delete queue from global queue list"""
         AudioQueue.del_queue(self.guild_id)
 
-    def skip(self, count: int = 1):
-        """Skip audio"""
+    def peek(self) -> AudioSource | None:
+        """Get audio that will be returned by `next`, without changing queue"""
 
-        for _ in range(count):
-            if len(self) == 0:
-                self.current = None
-                break
+        if self.on_replay and self.current is not None:
+            return self.current
 
-            self.current = self.pop(0)
+        return self[0] if len(self) != 0 else None
 
     def next(self) -> AudioSource | None:
         """Get next audio"""
@@ -88,10 +266,9 @@ class AudioQueue(list):
         """Set next audio"""
 
         if isinstance(audio, list):
-            for i, aud in enumerate(audio):
-                self.insert(i, aud)
+            self.extendleft(reversed(audio))
         else:
-            self.insert(0, audio)
+            self.appendleft(audio)
 
     @property
     def latest(self) -> AudioSource | None:
@@ -107,6 +284,39 @@ class AudioQueue(list):
     def current(self, value: AudioSource | None):
         self._latest = self.current or self._latest or value
         self._current = value
+        queue_journal.set_current(self.guild_id, value, self._on_replay)
+
+    @property
+    def on_replay(self) -> bool:
+        """Audio replay flag"""
+        return self._on_replay
+
+    @on_replay.setter
+    def on_replay(self, value: bool):
+        self._on_replay = value
+        queue_journal.set_current(self.guild_id, self._current, value)
+
+
+@dataclass
+class _PreparedAudio:
+    """Audio ready to be played"""
+
+    source: str
+    "Direct link or path to cached file"
+    ffmpeg_options: dict[str, any]
+    "ffmpeg options"
+    offset: float = 0.0
+    "Position in source audio (in seconds) playing starts from"
+
+
+@dataclass
+class _Prefetch:
+    """Audio being prepared in background"""
+
+    audio: AudioSource
+    "Audio to play next"
+    future: Future
+    "Future with `_PreparedAudio`, or None if audio is unavailable"
 
 
 class AudioController:
@@ -120,101 +330,405 @@ class AudioController:
     - Audio queue
     - Audio replay
     - Playback control (play, stop, skip)
+
+    Playback is driven by an asyncio task per server. Control methods only
+    enqueue operations, which the task applies one by one, and `after` callbacks
+    from discord.py audio thread are handed to event loop. So queue is changed
+    only from event loop and must not be touched from other threads.
     """
 
-    _controllers = {}
+    _controllers = GuildRegistry(
+        'controllers',
+        idle_timeout=int(os.getenv('GUILD_IDLE_TIMEOUT')),
+        is_idle=lambda cont: not cont.is_active and cont._ops.empty(),
+        on_remove=lambda cont: cont.close(),
+    )
+    "Controllers of all servers. Controllers that don't play are evicted when unused"
 
     @classmethod
     def get_controller(cls, voice_client: VoiceClient) -> 'AudioController':
-        """Get controller for server"""
+        """Get controller for server. Must be called from event loop"""
 
-        cont = cls._controllers.get(voice_client.guild.id)
+        guild_id = voice_client.guild.id
+        cont = cls._controllers.peek(guild_id)
 
-        # Create controller if it doesn't exist
-        if cont is None:
-            cont = AudioController(voice_client)
-            cls._controllers[voice_client.guild.id] = cont
+        # Create controller if it doesn't exist, or bot has reconnected since it was created
+        if cont is None or cont.voice_client is not voice_client:
+            cls._controllers.set(guild_id, AudioController(voice_client))
 
-        return cont
+        return cls._controllers.get(guild_id)
+
+    @classmethod
+    def remove_controller(cls, guild_id: int) -> None:
+        """Stop and remove controller of server"""
+        cls._controllers.remove(guild_id)
 
     def __init__(self, voice_client: VoiceClient) -> None:
-        self.voice_client = voice_client
-        self._loop_running = False
-        "Flag for stopping audio playback loop"
+        self.guild_id: int = voice_client.guild.id
+        "Server ID"
+        self._voice_client = weakref.ref(voice_client)
+        "Weak reference, so controller doesn't keep disconnected voice client alive"
+        self._loop = asyncio.get_running_loop()
+        "Event loop running the playback task"
+        self._ops: asyncio.Queue[Callable[[], None]] = asyncio.Queue()
+        "Pending playback operations, applied in order by playback task"
+        self._task = self._loop.create_task(self._run())
+        "Playback task"
+        self._starting: asyncio.Task | None = None
+        "Task preparing and starting next audio"
+        self._generation = 0
+        "Incremented on every started or interrupted audio, to ignore stale `after` callbacks"
+        self._prefetch: _Prefetch | None = None
+        "Next audio prepared while current one is playing"
+        self._track_ended_at: float | None = None
+        "Timestamp of previous audio end, used to measure gap between audios"
+        self._resuming: set[asyncio.Future] = set()
+        "Futures of pending `resume` calls, resolved on close if their operation wasn't applied"
 
-    def _play_loop(self, error: any = None) -> None:
-        """
-        Recursive function for playing audio.
+    @property
+    def voice_client(self) -> VoiceClient | None:
+        """Voice client, or None if it was destroyed"""
+        return self._voice_client()
 
-        Passed to `after` argument of `VoiceClient.play` method
-        """
+    def close(self) -> None:
+        """Stop playback task. Playing audio isn't stopped"""
+
+        self._task.cancel()
+
+        if self._starting is not None:
+            self._starting.cancel()
+            self._starting = None
+
+        self._prefetch = None
+
+        for started in self._resuming:
+            if not started.done():
+                started.set_result(None)
+
+    async def _run(self) -> None:
+        """Playback task: apply operations one by one"""
+
+        while True:
+            operation = await self._ops.get()
+
+            try:
+                operation()
+            except Exception:
+                _logger.exception('Playback operation failed')
+
+    def _submit(self, operation: Callable[[], None]) -> None:
+        """Enqueue operation for playback task. Must be called from event loop"""
+        self._ops.put_nowait(operation)
+
+    def _on_audio_end(self, generation: int, error: any = None) -> None:
+        """Passed to `after` argument of `VoiceClient.play` method. Called from audio thread"""
+
+        if error is not None:
+            _logger.warning('Audio playback failed: %s', error)
+
+        ended_at = time.perf_counter()
+        self._loop.call_soon_threadsafe(self._submit, partial(self._audio_ended, generation, ended_at))
+
+    @property
+    def is_active(self) -> bool:
+        """Is audio playing, paused or being started"""
+
+        voice_client = self.voice_client
+
+        return ((voice_client is not None and (voice_client.is_playing() or voice_client.is_paused()))
+                or (self._starting is not None and not self._starting.done()))
+
+    # Operations, applied by playback task
+
+    def _audio_ended(self, generation: int, ended_at: float) -> None:
+        # Audio was stopped by skip or stop, they handle what plays next
+        if generation != self._generation:
+            return
+
+        self._track_ended_at = ended_at
+        self._start_next()
+
+    def _add(self, sources: list[AudioSource]) -> None:
+        self.queue.extend(sources)
+
+        if not self.is_active:
+            self._start_next()
+
+    def _play(self, audio: AudioSource | list[AudioSource]) -> None:
+        self.queue.set_next(audio)
+        self._interrupt()
+        self._start_next()
 
-        # Flag for stopping loop
-        if not self._loop_running:
+    def _skip(self, count: int) -> None:
+        self.queue.skip(count - 1)
+        self._interrupt()
+        self._start_next()
+
+    def _start(self) -> None:
+        if not self.is_active:
+            self._start_next()
+
+    def _resume(self, offset: float, played: float, generation: int, started: asyncio.Future) -> None:
+        # Something was started or stopped since resume was requested, or bot has left channel
+        if generation != self._generation or self.is_active or self.voice_client is None:
+            started.done() or started.set_result(None)
             return
 
+        self._start_next(offset, played)
+        self._starting.add_done_callback(lambda _: started.done() or started.set_result(None))
+
+    def _stop(self) -> None:
+        self.queue.on_replay = False
+        self.queue.clear()
+        self.queue.current = None
+        self._prefetch = None
+        self._interrupt()
+        ffmpeg.supervisor.release(self.guild_id)
+
+    def _interrupt(self) -> None:
+        """Stop current audio or cancel starting one"""
+
+        self._generation += 1
+
+        if self._starting is not None:
+            self._starting.cancel()
+            self._starting = None
+
+        voice_client = self.voice_client
+
+        if voice_client is not None and (voice_client.is_playing() or voice_client.is_paused()):
+            voice_client.stop()
+
+    def _start_next(self, offset: float = 0.0, played: float = 0.0) -> None:
+        """Start preparing and playing next audio in queue"""
+
+        self._generation += 1
+        self._starting = self._loop.create_task(self._play_next(self._generation, offset, played))
+        self._starting.add_done_callback(self._on_started)
+
+    @staticmethod
+    def _on_started(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            _logger.error('Failed to start audio', exc_info=task.exception())
+
+    async def _play_next(self, generation: int, offset: float = 0.0, played: float = 0.0) -> None:
+        """
+        Play next audio in queue from `offset` seconds, skipping unavailable ones.
+        If `played` is set, audio is continued after it was played for `played` seconds from `offset`
+        """
+
         next_audio = self.queue.next()
+        prepared = await self._get_prepared(next_audio, offset, played)
+
+        # Skip audio that can't be resolved (e.g. unavailable playlist entries)
+        while next_audio is not None and prepared is None:
+            self.queue.skip()
+            next_audio = self.queue.current
+            prepared = await self._get_prepared(next_audio)
 
-        # Stop loop if queue is empty
+        # Queue is empty, let other servers play
         if next_audio is None:
-            self._loop_running = False
+            ffmpeg.supervisor.release(self.guild_id)
             return
 
-        self._play_audio(next_audio)
+        # Every start goes through admission, so servers can't play beyond the limit
+        try:
+            await ffmpeg.supervisor.admit(self.guild_id)
+        except ffmpeg.PlaybackBusyError:
+            _logger.info('No playback slot for server %s, not playing %s', self.guild_id, next_audio.title)
+            return
 
-    def _play_audio(self, audio: AudioSource):
-        """Play audio by bot"""
+        try:
+            self._play_audio(next_audio, prepared, generation)
+        except ClientException as e:
+            _logger.warning('Failed to play audio %s: %s', next_audio.title, e)
+            ffmpeg.supervisor.release(self.guild_id)
+            return
+
+        # Measure silence between audios
+        if self._track_ended_at is not None:
+            _track_gap.observe(time.perf_counter() - self._track_ended_at)
+            self._track_ended_at = None
+
+        self._schedule_prefetch()
+
+    def _schedule_prefetch(self) -> None:
+        """Start preparing next audio in background while current one is playing"""
+
+        audio = self.queue.peek()
+
+        if audio is None:
+            self._prefetch = None
+            return
+
+        self._prefetch = _Prefetch(audio, _prefetch_executor.submit(self._prepare, audio))
+
+    async def _get_prepared(self, audio: AudioSource | None, offset: float = 0.0,
+                            played: float = 0.0) -> _PreparedAudio | None:
+        """
+        Prepare audio for playing from `offset` seconds in executor, using prefetched result if available.
+
+        Returns None if audio is unavailable.
+        """
+
+        if audio is None:
+            return None
+
+        prefetch, self._prefetch = self._prefetch, None
+
+        if prefetch is not None and prefetch.audio is audio and offset == 0 and played == 0:
+            prepared = await asyncio.wrap_future(prefetch.future)
+
+            # Stream link could expire while previous audio was playing
+            if prepared is not None and not (prepared.source == audio.source_url
+                                             and is_url_expired(audio.source_url)):
+                return prepared
+
+        return await self._loop.run_in_executor(_prefetch_executor, self._prepare, audio, offset, played)
+
+    @staticmethod
+    def _prepare(audio: AudioSource, offset: float = 0.0, played: float = 0.0) -> _PreparedAudio | None:
+        """
+        Resolve audio if needed and build ffmpeg options for playing it from `offset` seconds.
+        If `played` is set, audio is continued after it was played for `played` seconds from `offset`,
+        so removed segments aren't counted in it.
+
+        Cached tracks are played from local file without resolving.
+        Returns None if audio is unavailable.
+        """
+
+        cached_path = track_cache.get(audio.id) if isinstance(audio, YoutubeVideo) else None
+
+        if cached_path is None:
+            try:
+                ytdlp.ensure_resolved(audio)
+            except ExtractionError as e:
+                _logger.info('Skipping unavailable audio %s: %s', audio.title, e)
+                return None
 
         ffmpeg_options = FFMPEG_OPTIONS.copy()
+        filtered = False
 
-        # Use filter for sponsor segments (SponsorBlock integration)
+        # Reconnect options are only for network streams
+        if cached_path is not None:
+            ffmpeg_options.pop('before_options', None)
+
+        segments = []
+
+        # Remove sponsor segments (SponsorBlock integration)
         if isinstance(audio, YoutubeVideo) and os.getenv('ENABLE_SPONSORBLOCK').lower() == 'true':
-            ffmpeg_options.setdefault('options', '')
-            segments = ytdlp.get_skip_segments(audio.id)
+            segments = ytdlp.get_skip_segments(audio.id) or []
 
-            if segments is not None:
-                opts = ytdlp.get_ffmpeg_sponsor_filter(segments, audio.duration)
-                ffmpeg_options['options'] += ' ' + opts
+        # Played time doesn't include removed segments, so it's converted to source time
+        duration = getattr(audio, 'duration', None)
+        if played > 0:
+            offset = ytdlp.get_source_position(segments, duration, offset, played)
 
-        self.voice_client.play(
-            FFmpegPCMAudio(audio.source_url, **ffmpeg_options),
-            after=self._play_loop
-        )
+        # Audio before resume position is skipped the same way
+        if offset > 0:
+            segments = [*segments, SkipSegment(0, offset, 'resume')]
 
-    def start(self):
-        """Start audio playback loop"""
+        sponsor_options = ytdlp.get_ffmpeg_sponsor_options(segments, duration) if segments else None
 
-        self._loop_running = True
-        self._play_loop()
+        if sponsor_options is not None:
+            ffmpeg_options['before_options'] = f"{sponsor_options.before_options} {ffmpeg_options.get('before_options', '')}".strip()
+            ffmpeg_options['options'] = f"{ffmpeg_options.get('options', '')} {sponsor_options.options}".strip()
+            filtered = sponsor_options.needs_transcoding
 
-    def stop(self):
-        """Stop audio playback loop"""
+        if os.getenv('PLAYBACK_MODE') == 'opus':
+            # Opus stream can be sent as is, if it doesn't need filtering.
+            # Otherwise ffmpeg transcodes it (discord.py treats any other codec as libopus)
+            if not filtered and (cached_path is not None or getattr(audio, 'acodec', None) == 'opus'):
+                ffmpeg_options['codec'] = 'opus'
 
-        self._loop_running = False
-        self.voice_client.stop()
+        return _PreparedAudio(cached_path or audio.source_url, ffmpeg_options, offset)
 
-    def skip(self, count: int = 1):
-        """Skip audio in queue"""
+    def _play_audio(self, audio: AudioSource, prepared: _PreparedAudio, generation: int):
+        """Play audio by bot"""
 
-        self.queue.skip(count - 1)
+        voice_client = self.voice_client
+        if voice_client is None:
+            raise ClientException('Not connected to voice.')
+
+        node = audio_nodes.get_node(self.guild_id)
 
-        if self.voice_client.is_playing():
-            self.voice_client.stop()
+        # ffmpeg of node audio runs in node process, which stops it with audio
+        if node is not None:
+            source = node.play(self.guild_id, prepared.source, prepared.ffmpeg_options, os.getenv('PLAYBACK_MODE'))
+        elif os.getenv('PLAYBACK_MODE') == 'opus':
+            source = FFmpegOpusAudio(prepared.source, **prepared.ffmpeg_options)
         else:
-            self.start()
+            source = FFmpegPCMAudio(prepared.source, **prepared.ffmpeg_options)
+
+        if node is None:
+            ffmpeg.supervisor.track(source._process, self.guild_id)
+
+        try:
+            voice_client.play(source, after=partial(self._on_audio_end, generation))
+        except ClientException:
+            # Source isn't cleaned up by discord.py if it wasn't played
+            source.cleanup()
+            raise
+
+        queue_journal.set_position(self.guild_id, voice_client.channel.id, prepared.offset)
+
+        # Popular tracks are cached while they are streamed
+        if isinstance(audio, YoutubeVideo) and prepared.source == audio.source_url:
+            track_cache.register_play(audio.id, audio.source_url, audio.duration, audio.acodec)
+
+    def start(self):
+        """Start playing queue if nothing is playing"""
+        self._submit(self._start)
+
+    def stop(self):
+        """Stop playing and clear queue"""
+        self._submit(self._stop)
+
+    def skip(self, count: int = 1):
+        """Skip audio in queue"""
+        self._submit(partial(self._skip, count))
+
+    def add(self, sources: list[AudioSource]):
+        """Add audio to queue and start playing if nothing is playing"""
+        self._submit(partial(self._add, sources))
 
     def play_audio(self, audio: AudioSource | list[AudioSource]):
         """Force play audio"""
+        self._submit(partial(self._play, audio))
 
-        self.queue.set_next(audio)
+    def clear(self):
+        """Clear queue without stopping current audio"""
+        self._submit(self.queue.clear)
 
-        if self.voice_client.is_playing():
-            self.voice_client.stop()
-        else:
-            self.start()
+    async def resume(self, offset: float, played: float = 0.0) -> None:
+        """
+        Start playing queue from `offset` seconds of first audio, or from where it was after
+        playing for `played` seconds from `offset`. Returns when audio is started or skipped.
+        Does nothing if other audio was started or stopped in the meantime
+        """
+
+        # Operations of closed controller are never applied
+        if self._task.done():
+            return
+
+        started = self._loop.create_future()
+        self._resuming.add(started)
+        started.add_done_callback(self._resuming.discard)
+        self._submit(partial(self._resume, offset, played, self._generation, started))
+        await started
 
     @property
     def queue(self) -> AudioQueue:
         """Audio queue"""
 
-        return AudioQueue.get_queue(self.voice_client.guild.id)
+        return AudioQueue.get_queue(self.guild_id)
+
+
+def cleanup_playback(guild_id: int) -> None:
+    """Forget playback state of server and kill its leftover ffmpeg processes. Called when bot leaves voice channel"""
+
+    ytdlp.cancel_guild_searches(guild_id)
+    AudioController.remove_controller(guild_id)
+    AudioQueue.del_queue(guild_id)
+    ffmpeg.supervisor.kill_guild(guild_id)
+    audio_nodes.release(guild_id)
@@ -0,0 +1,669 @@
+"""
+Module with audio node: separate process doing ffmpeg and Opus work of playback
+
+Bot sends play, stop, skip and seek instructions to node over a local socket,
+and node streams Opus frames of played audio back together with track events.
+So CPU load of audio doesn't slow down command handling, and the other way around.
+Voice connection itself stays in bot process, as discord.py owns voice gateway and encryption.
+
+Run node with::
+
+    python -m bot.audio_node unix:/tmp/musicbot-node.sock
+"""
+
+import os
+import sys
+import json
+import queue
+import struct
+import asyncio
+import logging
+import threading
+from collections.abc import Callable
+
+import discord
+
+from bot import metrics
+
+_logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('!BI')
+"Message header: message type, payload length"
+_FRAME_HEADER = struct.Struct('!QI')
+"Frame message header: server ID, track ID"
+
+MSG_CONTROL = 0
+"Message with JSON instruction or event"
+MSG_FRAME = 1
+"Message with Opus frame"
+
+INITIAL_CREDIT = 50
+"Count of frames node sends ahead before bot asks for more (1 second of audio)"
+CREDIT_BATCH = 10
+"Count of played frames after which bot asks node for more"
+READ_TIMEOUT = 10
+"Time to wait for next frame (in seconds) after which node is considered stalled"
+STATS_INTERVAL = 2
+"Interval between node load reports (in seconds)"
+
+
+# Transport
+
+def _parse_address(address: str) -> tuple[str | None, str | int]:
+    """Parse `unix:<path>` or `<host>:<port>` node address into (host, port), or (None, path) for Unix socket"""
+
+    if address.startswith('unix:'):
+        return None, address.removeprefix('unix:')
+
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+async def _connect(address: str) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Connect to node"""
+
+    host, target = _parse_address(address)
+
+    if host is None:
+        return await asyncio.open_unix_connection(target)
+    return await asyncio.open_connection(host, target)
+
+
+async def _read_message(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    """Read message. Raises `asyncio.IncompleteReadError` if connection is closed"""
+
+    msg_type, length = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return msg_type, await reader.readexactly(length)
+
+
+def _write_message(writer: asyncio.StreamWriter, msg_type: int, payload: bytes) -> None:
+    """Write message. Must be called from event loop"""
+
+    if not writer.is_closing():
+        writer.write(_HEADER.pack(msg_type, len(payload)) + payload)
+
+
+def _write_control(writer: asyncio.StreamWriter, message: dict[str, any]) -> None:
+    """Write JSON instruction or event. Must be called from event loop"""
+    _write_message(writer, MSG_CONTROL, json.dumps(message).encode())
+
+
+# Node
+
+class _EncodingSource:
+    """Encodes PCM audio source into Opus"""
+
+    def __init__(self, source: discord.AudioSource) -> None:
+        self.source = source
+        self.encoder = discord.opus.Encoder()
+
+    def read(self) -> bytes:
+        pcm = self.source.read()
+        return self.encoder.encode(pcm, self.encoder.SAMPLES_PER_FRAME) if pcm else b''
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+
+
+def create_source(source: str, options: dict[str, any], mode: str) -> any:
+    """
+    Create ffmpeg audio source producing Opus frames.
+
+    :param source: Direct link or path to file
+    :param options: Options of discord.py ffmpeg audio source
+    :param mode: Playback mode: `opus` or `pcm`. In `pcm` mode audio is encoded by node
+    """
+
+    if mode == 'opus':
+        return discord.FFmpegOpusAudio(source, **options)
+
+    options = {key: value for key, value in options.items() if key not in ('codec', 'bitrate')}
+    return _EncodingSource(discord.FFmpegPCMAudio(source, **options))
+
+
+class _Player:
+    """Audio played by node for one server. Frames are read in own thread, like in discord.py"""
+
+    def __init__(self, conn: '_NodeConnection', guild_id: int, track_id: int, instruction: dict[str, any]) -> None:
+        self.conn = conn
+        "Connection the player sends frames to"
+        self.guild_id = guild_id
+        "Server ID"
+        self.track_id = track_id
+        "Track ID, assigned by bot"
+        self.instruction = instruction
+        "Play instruction, used to restart audio on seek"
+        self.reason: str | None = None
+        "Why audio was stopped, or None if it plays"
+        self._credit = threading.Semaphore(instruction.get('credit', INITIAL_CREDIT))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'node-player-{guild_id}', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, reason: str) -> None:
+        """Stop audio. Ended event is sent with `reason`"""
+
+        if not self._stopped.is_set():
+            self.reason = reason
+            self._stopped.set()
+            self._credit.release()
+
+    def add_credit(self, frames: int) -> None:
+        """Allow sending `frames` more frames"""
+        self._credit.release(frames)
+
+    def _run(self) -> None:
+        source = None
+        error = None
+
+        try:
+            source = self.conn.node.source_factory(
+                self.instruction['source'], self.instruction.get('options', {}), self.instruction.get('mode', 'opus'))
+            self.conn.send_threadsafe({'event': 'started', 'guild': self.guild_id, 'track': self.track_id})
+
+            while True:
+                self._credit.acquire()
+                if self._stopped.is_set():
+                    break
+
+                frame = source.read()
+                if not frame:
+                    break
+
+                self.conn.send_frame_threadsafe(self.guild_id, self.track_id, frame)
+        except Exception as e:
+            _logger.exception('Audio of server %s failed', self.guild_id)
+            error = str(e)
+        finally:
+            if source is not None:
+                source.cleanup()
+
+        reason = self.reason or ('error' if error is not None else 'finished')
+        self.conn.send_threadsafe({'event': 'ended', 'guild': self.guild_id, 'track': self.track_id,
+                                   'reason': reason, 'error': error})
+        self.conn.loop.call_soon_threadsafe(self.conn.on_player_ended, self)
+
+
+class _NodeConnection:
+    """Bot connected to node"""
+
+    def __init__(self, node: 'AudioNode', reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.node = node
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.players: dict[int, _Player] = {}
+        "Server ID to player mapping"
+
+    def send(self, message: dict[str, any]) -> None:
+        _write_control(self.writer, message)
+
+    def send_threadsafe(self, message: dict[str, any]) -> None:
+        self.loop.call_soon_threadsafe(self.send, message)
+
+    def send_frame_threadsafe(self, guild_id: int, track_id: int, frame: bytes) -> None:
+        payload = _FRAME_HEADER.pack(guild_id, track_id) + frame
+        self.loop.call_soon_threadsafe(_write_message, self.writer, MSG_FRAME, payload)
+
+    def on_player_ended(self, player: _Player) -> None:
+        if self.players.get(player.guild_id) is player:
+            del self.players[player.guild_id]
+
+    async def serve(self) -> None:
+        """Handle instructions until bot disconnects, then stop its audio"""
+
+        try:
+            while True:
+                msg_type, payload = await _read_message(self.reader)
+                if msg_type == MSG_CONTROL:
+                    self.handle(json.loads(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for player in self.players.values():
+                player.stop('disconnected')
+            self.writer.close()
+
+    def handle(self, message: dict[str, any]) -> None:
+        """Apply instruction of bot"""
+
+        op = message.get('op')
+        guild_id = message.get('guild')
+        player = self.players.get(guild_id)
+
+        # Instructions for previous track of server are ignored
+        if player is not None and message.get('track', player.track_id) != player.track_id and op != 'play':
+            return
+
+        if op == 'hello':
+            self.send({'event': 'ready', 'pid': os.getpid()})
+        elif op == 'play':
+            if player is not None:
+                player.stop('replaced')
+            self._play(guild_id, message['track'], message)
+        elif op in ('stop', 'skip'):
+            if player is not None:
+                player.stop('stopped' if op == 'stop' else 'skipped')
+        elif op == 'seek':
+            if player is not None:
+                player.stop('seeked')
+                self._play(guild_id, message['new_track'], _seek_instruction(player.instruction, message['position']))
+        elif op == 'credit':
+            if player is not None:
+                player.add_credit(message['frames'])
+        else:
+            _logger.warning('Unknown instruction: %s', op)
+
+    def _play(self, guild_id: int, track_id: int, instruction: dict[str, any]) -> None:
+        player = self.players[guild_id] = _Player(self, guild_id, track_id, instruction)
+        player.start()
+
+
+def _seek_instruction(instruction: dict[str, any], position: float) -> dict[str, any]:
+    """Get play instruction starting audio from `position` (in seconds) of source"""
+
+    options = dict(instruction.get('options', {}))
+    options['before_options'] = f"-ss {position:.3f} {options.get('before_options', '')}".strip()
+    return {**instruction, 'options': options}
+
+
+class AudioNode:
+    """Node server, playing audio for connected bots"""
+
+    def __init__(self, address: str, source_factory: Callable[[str, dict, str], any] = create_source) -> None:
+        """
+        :param address: Address to listen on, `unix:<path>` or `<host>:<port>`
+        :param source_factory: Function creating audio source producing Opus frames, see `create_source`
+        """
+
+        self.address = address
+        "Address node listens on"
+        self.source_factory = source_factory
+        "Function creating audio source producing Opus frames"
+        self.connections: dict[_NodeConnection, asyncio.Task] = {}
+        "Connected bot to its serving task mapping"
+        self._server: asyncio.Server | None = None
+        self._stats_task: asyncio.Task | None = None
+
+    @property
+    def player_count(self) -> int:
+        """Count of servers node plays audio for"""
+        return sum(len(conn.players) for conn in self.connections)
+
+    async def start(self) -> None:
+        """Start listening"""
+
+        host, target = _parse_address(self.address)
+
+        if host is None:
+            # Socket file is left if node was killed
+            if os.path.exists(target):
+                os.remove(target)
+            self._server = await asyncio.start_unix_server(self._on_connect, target)
+        else:
+            self._server = await asyncio.start_server(self._on_connect, host, target)
+
+        self._stats_task = asyncio.create_task(self._report_stats())
+        _logger.info('Audio node is listening on %s', self.address)
+
+    async def close(self) -> None:
+        """Stop listening and stop all audio"""
+
+        if self._server is not None:
+            self._server.close()
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+
+        for conn in list(self.connections):
+            conn.writer.close()
+
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        conn = _NodeConnection(self, reader, writer)
+        self.connections[conn] = asyncio.current_task()
+
+        try:
+            await conn.serve()
+        finally:
+            del self.connections[conn]
+
+    async def _report_stats(self) -> None:
+        """Report load to connected bots, used to balance servers between nodes"""
+
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+
+            for conn in self.connections:
+                conn.send({'event': 'stats', 'players': self.player_count, 'own_players': len(conn.players)})
+
+
+# Bot side
+
+class NodeAudioSource(discord.AudioSource):
+    """
+    Audio source playing Opus frames streamed by node.
+
+    Node sends frames only as they are played, so paused audio doesn't pile up in memory.
+    Seeked audio gets new track ID, so frames sent before seek are dropped.
+    """
+
+    def __init__(self, client: 'AudioNodeClient', guild_id: int, track_id: int) -> None:
+        self.client = client
+        "Node playing the audio"
+        self.guild_id = guild_id
+        "Server ID"
+        self.track_id = track_id
+        "Track ID"
+        self.error: str | None = None
+        "Error reported by node"
+        self.ended = False
+        "Did node stop sending frames"
+        self._skipped = False
+        self._frames: queue.SimpleQueue[tuple[int, bytes | None]] = queue.SimpleQueue()
+        "Received (track ID, frame) pairs. None frame marks end of audio"
+        self._played = 0
+        "Count of played frames not reported to node yet"
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        """Get next frame. Called from discord.py audio thread"""
+
+        while True:
+            if self._skipped:
+                return b''
+
+            try:
+                track_id, frame = self._frames.get(timeout=READ_TIMEOUT)
+            except queue.Empty:
+                self.error = 'Audio node stalled'
+                return b''
+
+            # Sent before seek
+            if track_id == self.track_id:
+                break
+
+        if frame is None:
+            if self.error is not None:
+                _logger.warning('Audio node failed to play audio of server %s: %s', self.guild_id, self.error)
+            return b''
+
+        self._played += 1
+        if self._played >= CREDIT_BATCH:
+            self.client.send_threadsafe({'op': 'credit', 'guild': self.guild_id, 'track': self.track_id,
+                                         'frames': self._played})
+            self._played = 0
+
+        return frame
+
+    def skip(self) -> None:
+        """End audio without playing frames that were sent ahead"""
+
+        self._skipped = True
+        self._frames.put((self.track_id, None))
+        self.client.send_threadsafe({'op': 'skip', 'guild': self.guild_id, 'track': self.track_id})
+
+    def seek(self, position: float) -> None:
+        """Restart audio from `position` (in seconds) of source"""
+        self.client._call_threadsafe(self.client.seek, self, position)
+
+    def cleanup(self) -> None:
+        """Stop audio on node if it's still playing"""
+
+        if not self.ended:
+            self.ended = True
+            self.client.send_threadsafe({'op': 'stop', 'guild': self.guild_id, 'track': self.track_id})
+
+        self.client.forget_threadsafe(self)
+
+    def _push(self, track_id: int, frame: bytes) -> None:
+        self._frames.put((track_id, frame))
+
+    def _end(self, error: str | None) -> None:
+        self.ended = True
+        self.error = self.error or error
+        self._frames.put((self.track_id, None))
+
+
+class AudioNodeClient:
+    """Connection of bot to audio node. Reconnects when connection is lost"""
+
+    RECONNECT_DELAY_MAX = 30
+    "Max delay between connection attempts (in seconds)"
+
+    def __init__(self, address: str) -> None:
+        """
+        :param address: Node address, `unix:<path>` or `<host>:<port>`
+        """
+
+        self.address = address
+        "Node address"
+        self._other_load = 0
+        "Count of servers node plays audio for other bot processes, as last reported by node"
+        self._writer: asyncio.StreamWriter | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._sources: dict[tuple[int, int], NodeAudioSource] = {}
+        "(server ID, track ID) to played audio mapping"
+        self._next_track_id = 0
+        self._task: asyncio.Task | None = None
+        self._ready = asyncio.Event()
+
+    @property
+    def connected(self) -> bool:
+        """Is node connected"""
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def load(self) -> int:
+        """Count of servers node plays audio for"""
+        return len(self._sources) + self._other_load
+
+    def start(self) -> None:
+        """Start connecting to node in background. Does nothing if already started"""
+
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._run())
+
+    async def wait_connected(self) -> None:
+        """Wait until node is connected"""
+        await self._ready.wait()
+
+    async def close(self) -> None:
+        """Disconnect from node, stopping all its audio"""
+
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    def play(self, guild_id: int, source: str, options: dict[str, any], mode: str) -> NodeAudioSource:
+        """
+        Start playing audio on node. Must be called from event loop.
+
+        :param guild_id: Server ID
+        :param source: Direct link or path to file
+        :param options: Options of discord.py ffmpeg audio source
+        :param mode: Playback mode: `opus` or `pcm`
+        :raises ConnectionError: If node isn't connected
+        """
+
+        if not self.connected:
+            raise ConnectionError(f'Audio node {self.address} is not connected')
+
+        self._next_track_id += 1
+        audio = NodeAudioSource(self, guild_id, self._next_track_id)
+        self._sources[guild_id, audio.track_id] = audio
+
+        self.send({'op': 'play', 'guild': guild_id, 'track': audio.track_id, 'source': source,
+                   'options': options, 'mode': mode, 'credit': INITIAL_CREDIT})
+        return audio
+
+    def seek(self, audio: NodeAudioSource, position: float) -> None:
+        """Restart audio from `position` (in seconds) of source. Must be called from event loop"""
+
+        if self._sources.pop((audio.guild_id, audio.track_id), None) is None:
+            return
+
+        old_track_id = audio.track_id
+        self._next_track_id += 1
+        audio.track_id = self._next_track_id
+        self._sources[audio.guild_id, audio.track_id] = audio
+
+        self.send({'op': 'seek', 'guild': audio.guild_id, 'track': old_track_id, 'new_track': audio.track_id,
+                   'position': position})
+
+    def send(self, message: dict[str, any]) -> None:
+        """Send instruction to node. Must be called from event loop"""
+
+        if self.connected:
+            _write_control(self._writer, message)
+
+    def send_threadsafe(self, message: dict[str, any]) -> None:
+        """Send instruction to node from any thread"""
+        self._call_threadsafe(self.send, message)
+
+    def forget_threadsafe(self, audio: NodeAudioSource) -> None:
+        """Stop routing frames to audio from any thread"""
+        self._call_threadsafe(self._sources.pop, (audio.guild_id, audio.track_id), None)
+
+    def _call_threadsafe(self, func: Callable, *args) -> None:
+        try:
+            self._loop.call_soon_threadsafe(func, *args)
+        except RuntimeError:
+            # Event loop is closed on shutdown, audio sources are cleaned up after it
+            pass
+
+    async def _run(self) -> None:
+        delay = 1
+
+        while True:
+            try:
+                reader, self._writer = await _connect(self.address)
+            except OSError as e:
+                _logger.warning('Failed to connect to audio node %s: %s', self.address, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_DELAY_MAX)
+                continue
+
+            _logger.info('Connected to audio node %s', self.address)
+            delay = 1
+            self.send({'op': 'hello'})
+            self._ready.set()
+
+            try:
+                await self._read(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                self._ready.clear()
+                self._writer.close()
+                self._writer = None
+                self._other_load = 0
+
+                # Audio of lost node ends, and controllers go on with next audio
+                for audio in self._sources.values():
+                    audio._end('Audio node disconnected')
+                self._sources.clear()
+
+            _logger.warning('Disconnected from audio node %s', self.address)
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            msg_type, payload = await _read_message(reader)
+
+            if msg_type == MSG_FRAME:
+                guild_id, track_id = _FRAME_HEADER.unpack_from(payload)
+                audio = self._sources.get((guild_id, track_id))
+                if audio is not None:
+                    audio._push(track_id, payload[_FRAME_HEADER.size:])
+                continue
+
+            event = json.loads(payload)
+            name = event.get('event')
+
+            if name == 'ended':
+                audio = self._sources.pop((event['guild'], event['track']), None)
+                if audio is not None:
+                    audio._end(event.get('error'))
+            elif name == 'stats':
+                # Nodes can be shared by processes of sharded bot
+                self._other_load = event['players'] - event['own_players']
+            elif name == 'ready':
+                _logger.debug('Audio node %s has PID %s', self.address, event['pid'])
+
+
+class AudioNodePool:
+    """
+    Audio nodes that bot plays audio on.
+
+    Server is assigned to least loaded node when it starts playing, and stays
+    on it while node is connected. If no node is connected, audio is played locally.
+    """
+
+    def __init__(self, addresses: list[str]) -> None:
+        """
+        :param addresses: Node addresses. If empty, pool is disabled
+        """
+
+        self.nodes = [AudioNodeClient(address) for address in addresses]
+        "Node connections"
+        self._assigned: dict[int, AudioNodeClient] = {}
+        "Server ID to node mapping"
+
+        metrics.gauge('audio_node.connected', lambda: sum(node.connected for node in self.nodes))
+        metrics.gauge('audio_node.assigned_guilds', lambda: len(self._assigned))
+
+    @property
+    def enabled(self) -> bool:
+        """Are nodes configured"""
+        return bool(self.nodes)
+
+    def start(self) -> None:
+        """Start connecting to nodes. Must be called from event loop"""
+
+        for node in self.nodes:
+            node.start()
+
+    def get_node(self, guild_id: int) -> AudioNodeClient | None:
+        """Get node for server, or None if no node is connected"""
+
+        node = self._assigned.get(guild_id)
+
+        if node is None or not node.connected:
+            connected = [node for node in self.nodes if node.connected]
+            if not connected:
+                return None
+
+            node = self._assigned[guild_id] = min(connected, key=lambda n: n.load)
+
+        return node
+
+    def release(self, guild_id: int) -> None:
+        """Unassign server from its node, e.g. when bot leaves voice channel"""
+        self._assigned.pop(guild_id, None)
+
+
+def main() -> None:
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format=os.getenv('LOG_FORMAT', logging.BASIC_FORMAT))
+
+    if len(sys.argv) != 2:
+        sys.exit('Usage: python -m bot.audio_node <unix:path | host:port>')
+
+    async def _serve() -> None:
+        node = AudioNode(sys.argv[1])
+        await node.start()
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(_serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Module with in-memory caches used by bot
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse, parse_qs
+
+from bot.schemas import YoutubeVideo, SkipSegment
+from bot.utils import is_url
+
+if TYPE_CHECKING:
+    from bot.data import BotDatabaseRepository
+
+_YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com')
+_VIDEO_ID_RE = re.compile(r'^[\w-]{11}$')
+
+
+def get_youtube_video_id(url: str) -> str | None:
+    """Get YouTube video ID from link, or None if it's not a link to YouTube video"""
+
+    res = urlparse(url)
+    host = res.netloc.lower()
+
+    if host == 'youtu.be':
+        video_id = res.path.lstrip('/')
+    elif host in _YOUTUBE_HOSTS and res.path == '/watch':
+        video_id = parse_qs(res.query).get('v', [''])[0]
+    elif host in _YOUTUBE_HOSTS and res.path.startswith('/shorts/'):
+        video_id = res.path.removeprefix('/shorts/')
+    else:
+        return None
+
+    return video_id if _VIDEO_ID_RE.match(video_id) else None
+
+
+def is_playlist_url(url: str) -> bool:
+    """Check if string is link to YouTube playlist"""
+
+    if not is_url(url):
+        return False
+
+    res = urlparse(url)
+    if res.netloc.lower() not in _YOUTUBE_HOSTS:
+        return False
+
+    return res.path == '/playlist' or 'list' in parse_qs(res.query)
+
+
+def normalize_query(url_or_search: str) -> str:
+    """
+    Get cache key for link or search query.
+
+    Links to YouTube videos (but not playlists) are reduced to video ID, so different links
+    to the same video share one key. Search queries are case- and whitespace-insensitive.
+    """
+
+    url_or_search = url_or_search.strip()
+
+    if is_playlist_url(url_or_search):
+        return f'url:{url_or_search}'
+
+    if is_url(url_or_search):
+        video_id = get_youtube_video_id(url_or_search)
+        return f'id:{video_id}' if video_id is not None else f'url:{url_or_search}'
+
+    return 'search:' + ' '.join(url_or_search.lower().split())
+
+
+def get_url_expire_time(url: str | None) -> float:
+    """Get expiration timestamp of googlevideo stream link (`expire=` parameter), or 0 if unknown"""
+
+    if not url:
+        return 0
+
+    expire = parse_qs(urlparse(url).query).get('expire')
+    if expire is None or not expire[0].isdigit():
+        return 0
+
+    return float(expire[0])
+
+
+def is_url_expired(url: str | None) -> bool:
+    """Check if stream link is expired or about to expire. Links without `expire=` never expire."""
+
+    expire = get_url_expire_time(url)
+    return expire != 0 and expire - ResolverCache.URL_EXPIRE_MARGIN < time.time()
+
+
+@dataclass
+class _CacheEntry:
+    video: YoutubeVideo
+    "Cached video with stream link"
+    expires_at: float
+    "Metadata expiration timestamp"
+    url_expires_at: float
+    "Stream link expiration timestamp"
+
+
+class ResolverCache:
+    """
+    LRU cache for results of YouTube lookups.
+
+    Video metadata is stored for `METADATA_TTL` seconds, stream link
+    only until its `expire=` timestamp. Thread-safe.
+    """
+
+    METADATA_TTL = 7 * 24 * 60 * 60
+    "Time to store video metadata (in seconds)"
+    URL_EXPIRE_MARGIN = 10 * 60
+    "Stream link is considered expired this many seconds before its `expire=` timestamp"
+
+    def __init__(self, max_size: int) -> None:
+        """
+        :param max_size: Max count of cached videos
+        """
+
+        self.max_size = max_size
+        "Max count of cached videos"
+        self.hits = 0
+        "Count of lookups with cached metadata and valid stream link"
+        self.misses = 0
+        "Count of lookups without cached metadata"
+        self.url_misses = 0
+        "Count of lookups with cached metadata but expired stream link"
+        self._videos: OrderedDict[str, _CacheEntry] = OrderedDict()
+        "Video ID to cache entry mapping"
+        self._queries: OrderedDict[str, str] = OrderedDict()
+        "Normalized query to video ID mapping"
+        self._lock = threading.Lock()
+
+    def _get_entry(self, url_or_search: str) -> _CacheEntry | None:
+        """Get cache entry for query and mark it as recently used. Lock must be held."""
+
+        key = normalize_query(url_or_search)
+
+        if key.startswith('id:'):
+            video_id = key.removeprefix('id:')
+        else:
+            video_id = self._queries.get(key)
+            if video_id is None:
+                return None
+            self._queries.move_to_end(key)
+
+        entry = self._videos.get(video_id)
+        if entry is None:
+            return None
+
+        if entry.expires_at < time.time():
+            del self._videos[video_id]
+            return None
+
+        self._videos.move_to_end(video_id)
+        return entry
+
+    def get(self, url_or_search: str) -> YoutubeVideo | None:
+        """Get cached video with valid stream link, or None"""
+
+        with self._lock:
+            entry = self._get_entry(url_or_search)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.url_expires_at - self.URL_EXPIRE_MARGIN < time.time():
+                self.url_misses += 1
+                return None
+
+            self.hits += 1
+            return replace(entry.video)
+
+    def get_metadata(self, url_or_search: str) -> YoutubeVideo | None:
+        """Get cached video regardless of stream link expiration, or None"""
+
+        with self._lock:
+            entry = self._get_entry(url_or_search)
+            return replace(entry.video) if entry is not None else None
+
+    def put(self, url_or_search: str, video: YoutubeVideo) -> None:
+        """Store video in cache"""
+
+        with self._lock:
+            self._videos[video.id] = _CacheEntry(
+                video=replace(video),
+                expires_at=time.time() + self.METADATA_TTL,
+                url_expires_at=get_url_expire_time(video.source_url),
+            )
+            self._videos.move_to_end(video.id)
+
+            key = normalize_query(url_or_search)
+            if not key.startswith('id:'):
+                self._queries[key] = video.id
+                self._queries.move_to_end(key)
+
+            # Evict least recently used entries
+            while len(self._videos) > self.max_size:
+                self._videos.popitem(last=False)
+            while len(self._queries) > self.max_size:
+                self._queries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        """Get cache counters"""
+
+        return {
+            'size': len(self._videos),
+            'hits': self.hits,
+            'misses': self.misses,
+            'url_misses': self.url_misses,
+        }
+
+
+class SegmentCache:
+    """
+    LRU cache of SponsorBlock segments, persisted in bot database.
+
+    Empty list means that video has no segments (or lookup failed recently),
+    so it isn't looked up again until entry expires. Thread-safe.
+    """
+
+    TTL = 24 * 60 * 60
+    "Time to store found segments (in seconds)"
+    EMPTY_TTL = 6 * 60 * 60
+    "Time to remember that video has no segments (in seconds)"
+    ERROR_TTL = 5 * 60
+    "Time to remember failed lookup (in seconds). Such entries aren't persisted"
+
+    def __init__(self, max_size: int) -> None:
+        """
+        :param max_size: Max count of videos kept in memory
+        """
+
+        self.max_size = max_size
+        "Max count of videos kept in memory"
+        self.database: 'BotDatabaseRepository | None' = None
+        "Database for persistent storage. Set by `bot.data`"
+        self._entries: OrderedDict[str, tuple[list[SkipSegment], float]] = OrderedDict()
+        "Video ID to (segments, expiration timestamp) mapping"
+        self._lock = threading.Lock()
+
+    def get(self, video_id: str, persisted: bool = True) -> list[SkipSegment] | None:
+        """
+        Get cached segments of video, or None if they are unknown
+
+        :param persisted: Look up segments in database if they aren't in memory.
+            Blocks until database read is done, so must not be used from event loop
+        """
+
+        with self._lock:
+            entry = self._entries.get(video_id)
+
+            if entry is not None and entry[1] >= time.time():
+                self._entries.move_to_end(video_id)
+                return entry[0]
+
+        if self.database is None or not persisted:
+            return None
+
+        row = self.database.get_video_skip_segments(video_id)
+        if row is None:
+            return None
+
+        segments, fetched_at = row
+        expires_at = fetched_at + (self.TTL if segments else self.EMPTY_TTL)
+        if expires_at < time.time():
+            return None
+
+        self._put(video_id, segments, expires_at)
+        return segments
+
+    def put(self, video_id: str, segments: list[SkipSegment]) -> None:
+        """Store segments of video"""
+
+        self._put(video_id, segments, time.time() + (self.TTL if segments else self.EMPTY_TTL))
+
+        if self.database is not None:
+            self.database.set_video_skip_segments(video_id, segments)
+
+    def put_error(self, video_id: str) -> None:
+        """Remember failed lookup, so it isn't retried for `ERROR_TTL` seconds"""
+        self._put(video_id, [], time.time() + self.ERROR_TTL)
+
+    def _put(self, video_id: str, segments: list[SkipSegment], expires_at: float) -> None:
+        with self._lock:
+            self._entries[video_id] = (segments, expires_at)
+            self._entries.move_to_end(video_id)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,146 @@
+"""
+Module with compact binary codec of audio sources, used to store them in database.
+
+Record layout (big-endian)::
+
+    version: u8, type: u8, field count: u8
+    for each field:
+        key: u8 (value kind in high 2 bits, field ID in low 6 bits), length: u16, value: `length` bytes
+
+Strings are stored as UTF-8, integers as i64, floats as f64, None without value.
+Fields of each type are identified by their position in `_TYPES`, so new fields must
+only be appended there and must have default values. Adding fields doesn't change
+`VERSION`: readers skip fields they don't know and use defaults for missing ones.
+Every type starts with `AudioSource` fields, so types unknown to reader are decoded as `AudioSource`.
+"""
+
+import struct
+
+from bot.schemas import AudioSource, YoutubeVideo
+
+VERSION = 1
+"Version of record layout. Changed only if records can't be read by older code"
+
+_RECORD = struct.Struct('!BBB')
+_FIELD = struct.Struct('!BH')
+_INT = struct.Struct('!q')
+_FLOAT = struct.Struct('!d')
+
+_NONE, _STR, _INT_KIND, _FLOAT_KIND = range(4)
+_MAX_LENGTH = 0xFFFF
+
+_TYPES: dict[int, tuple[type[AudioSource], tuple[str, ...]]] = {
+    0: (AudioSource, ('title', 'source_url')),
+    1: (YoutubeVideo, ('title', 'source_url', 'origin_query', 'id', 'author', 'duration', 'acodec')),
+}
+"Type ID to type and names of its fields. Append only"
+_TYPE_IDS = {cls: type_id for type_id, (cls, _) in _TYPES.items()}
+
+
+def encode(audio: AudioSource) -> bytes:
+    """Encode audio source"""
+
+    type_id = _TYPE_IDS[type(audio)]
+    names = _TYPES[type_id][1]
+    parts = [_RECORD.pack(VERSION, type_id, len(names))]
+
+    for field_id, name in enumerate(names):
+        value = getattr(audio, name)
+
+        if value is None:
+            parts.append(_FIELD.pack(_NONE << 6 | field_id, 0))
+        elif isinstance(value, str):
+            value = value.encode()
+            if len(value) > _MAX_LENGTH:
+                raise ValueError(f'Field {name} is too long: {len(value)} bytes')
+            parts.append(_FIELD.pack(_STR << 6 | field_id, len(value)))
+            parts.append(value)
+        elif isinstance(value, int):
+            parts.append(_FIELD.pack(_INT_KIND << 6 | field_id, _INT.size))
+            parts.append(_INT.pack(value))
+        elif isinstance(value, float):
+            parts.append(_FIELD.pack(_FLOAT_KIND << 6 | field_id, _FLOAT.size))
+            parts.append(_FLOAT.pack(value))
+        else:
+            raise TypeError(f'Field {name} has unsupported type: {type(value).__name__}')
+
+    return b''.join(parts)
+
+
+def decode(data: bytes | memoryview) -> AudioSource:
+    """Decode audio source encoded by `encode`. Values are read from `data` without copying it"""
+
+    view = memoryview(data)
+    cls, names = _get_type(view)
+    known = len(names)
+    values = {}
+    offset = _RECORD.size
+    unpack_field = _FIELD.unpack_from
+
+    # Inlined `_iter_fields`, as this is the hot path of loading queues and saves
+    for _ in range(view[2]):
+        key, length = unpack_field(view, offset)
+        offset += _FIELD.size
+        field_id = key & 0x3F
+
+        if field_id < known:
+            if key >> 6 == _STR:
+                values[names[field_id]] = str(view[offset:offset + length], 'utf-8')
+            else:
+                values[names[field_id]] = _read_value(view, key >> 6, offset, offset + length)
+
+        offset += length
+
+    return cls(**values)
+
+
+def decode_field(data: bytes | memoryview, name: str) -> any:
+    """
+    Decode one field of audio source encoded by `encode`, skipping other fields.
+
+    :returns: Field value, or None if record doesn't have it
+    :raises KeyError: If type of audio source doesn't have such field
+    """
+
+    view = memoryview(data)
+    cls, names = _get_type(view)
+    if name not in names:
+        raise KeyError(f'{cls.__name__} has no field {name}')
+    field_id = names.index(name)
+
+    for record_field_id, kind, start, end in _iter_fields(view):
+        if record_field_id == field_id:
+            return _read_value(view, kind, start, end)
+
+    return None
+
+
+def _get_type(view: memoryview) -> tuple[type[AudioSource], tuple[str, ...]]:
+    """Get type of record and names of its fields"""
+
+    version, type_id, _ = _RECORD.unpack_from(view)
+    if version > VERSION:
+        raise ValueError(f'Unsupported record version: {version}')
+
+    return _TYPES.get(type_id, _TYPES[0])
+
+
+def _iter_fields(view: memoryview):
+    """Iterate over fields of record as (field ID, value kind, value start, value end)"""
+
+    offset = _RECORD.size
+    for _ in range(view[2]):
+        key, length = _FIELD.unpack_from(view, offset)
+        offset += _FIELD.size
+        yield key & 0x3F, key >> 6, offset, offset + length
+        offset += length
+
+
+def _read_value(view: memoryview, kind: int, start: int, end: int) -> any:
+    if kind == _STR:
+        return str(view[start:end], 'utf-8')
+    if kind == _INT_KIND:
+        return _INT.unpack_from(view, start)[0]
+    if kind == _FLOAT_KIND:
+        return _FLOAT.unpack_from(view, start)[0]
+    return None
@@ -6,20 +6,76 @@ import os
 
 import discord.utils
 from datetime import datetime
-from yt_dlp import YoutubeDL
+from itertools import islice
 from discord.ext.commands import Context, parameter
 
 from settings import bot
-from bot import ytdlp
+from bot import ytdlp, ffmpeg
+from bot.messages import scheduler, OutgoingMessage
 from bot.data import GuildData, langs
-from bot.audio import AudioQueue, AudioController
+from bot.audio import AudioController, cleanup_playback
+from bot.schemas import AudioSource
+
+QUEUE_VIEW_LIMIT = 20
+"Max count of audio shown by `queue` command"
+
+
+def _reply(ctx: Context, content: str, status: bool = True) -> OutgoingMessage:
+    """
+    Queue message to channel of command. Status messages can be merged
+    with other ones if channel is backlogged
+    """
+    return scheduler.send(ctx.channel, content, status)
+
+
+async def _search(ctx: Context, url_or_search: str) -> list[AudioSource] | None:
+    """
+    Search audio without blocking other servers.
+
+    Sends error message and returns None if lookup is not possible or was cancelled.
+    """
+
+    guild = GuildData.get_instance(ctx.guild.id)
+
+    try:
+        return await ytdlp.search_async(url_or_search, ctx.guild.id)
+    except ytdlp.ResolverBusyError:
+        await _reply(ctx, guild.lang['error.resolver_busy'])
+    except ytdlp.SearchCancelledError:
+        pass
+
+    return None
+
+
+async def _admit(ctx: Context) -> bool:
+    """
+    Take playback slot for server, waiting for it if too many servers are playing.
+
+    Sends message if server has to wait or can't play now, and returns False in the latter case.
+    """
+
+    if ffmpeg.supervisor.is_admitted(ctx.guild.id):
+        return True
+
+    guild = GuildData.get_instance(ctx.guild.id)
+
+    if not ffmpeg.supervisor.has_free_slot:
+        await _reply(ctx, guild.lang['result.playback_queued'])
+
+    try:
+        await ffmpeg.supervisor.admit(ctx.guild.id)
+    except ffmpeg.PlaybackBusyError:
+        await _reply(ctx, guild.lang['error.playback_busy'])
+        return False
+
+    return True
 
 
 @bot.command()
 async def ping(ctx: Context):
     """Check bot availability"""
 
-    await ctx.send('Pong!')
+    await _reply(ctx, 'Pong!')
 
 
 @bot.command('echo', aliases=['say', 'bot'])
@@ -30,7 +86,7 @@ async def echo(
 ):
     """Send message on behalf of bot"""
 
-    await ctx.send(message)
+    await _reply(ctx, message, status=False)
 
 
 @bot.command('connect', aliases=['join', 'j'])
@@ -41,7 +97,7 @@ async def connect(ctx: Context) -> bool:
 
     # Throw error if user is not in voice channel
     if ctx.author.voice is None:
-        await ctx.send(guild.lang['error.not_in_voice_channel'])
+        await _reply(ctx, guild.lang['error.not_in_voice_channel'])
         return False
 
     # Connect to voice channel if bot is not connected
@@ -59,8 +115,9 @@ async def leave(ctx: Context) -> bool:
     if ctx.voice_client is None:
         return False
 
+    ytdlp.cancel_guild_searches(ctx.guild.id)
     await ctx.voice_client.disconnect(force=False)
-    AudioQueue.get_queue(ctx.guild.id).delete()
+    cleanup_playback(ctx.guild.id)
     return True
 
 
@@ -78,14 +135,14 @@ async def spam(
 
     # Validate arguments
     if count < 1 or count > 100:
-        return await ctx.send(guild.lang['error.args.spam_count'])
+        return await _reply(ctx, guild.lang['error.args.spam_count'])
     if delay < 0.5 or delay > 60:
-        return await ctx.send(guild.lang['error.args.spam_delay'])
+        return await _reply(ctx, guild.lang['error.args.spam_delay'])
 
     _spam = GuildData.get_instance(ctx.guild.id).create_spam(text, count, delay)
 
     async for _ in _spam:
-        await ctx.send(text)
+        await _reply(ctx, text, status=False)
 
 
 @bot.command('stopspam', aliases=['switch'])
@@ -104,7 +161,7 @@ async def stopspam(
     if code == correct_code:
         GuildData.get_instance(ctx.guild.id).spam.stop()
     else:
-        await ctx.send(guild.lang['error.args.stopspam.code'])
+        await _reply(ctx, guild.lang['error.args.stopspam.code'])
 
 
 @bot.command('getlink', aliases=['geturl', 'link'])
@@ -115,10 +172,9 @@ async def getlink(
 ):
     """Get direct link to video/audio"""
 
-    _format = 'bestaudio' if result_type == 'audio' else 'best*[acodec!=none]'
-    video = YoutubeDL({'format': _format}).extract_info(url, download=False)
+    link = await ytdlp.get_direct_link(url, audio_only=result_type == 'audio')
 
-    await ctx.send(video['url'])
+    await _reply(ctx, link, status=False)
 
 
 @bot.command('play', aliases=['p'])
@@ -141,7 +197,7 @@ async def play(
     guild = GuildData.get_instance(ctx.guild.id)
 
     # Send callback message
-    await ctx.send(guild.lang['result.searching'])
+    callback = _reply(ctx, guild.lang['result.searching'])
 
     # Start playing
     channel = ctx.author.voice.channel
@@ -150,14 +206,16 @@ async def play(
         voice_client = await channel.connect()
     else:
         await voice_client.move_to(channel)
+    sources = await _search(ctx, url_or_search)
+    if sources is None or not await _admit(ctx):
+        return
     controller = AudioController.get_controller(voice_client)
-    sources = ytdlp.search(url_or_search)
+    ytdlp.prefetch_skip_segments(sources)
     controller.play_audio(sources)
+    ytdlp.resolve_in_background(sources, ctx.guild.id)
 
-    # Send another callback message
-    audio = controller.queue.current
-    if audio is not None:
-        await ctx.send(guild.lang['result.video_playing'].format(audio.title))
+    # Replace callback message
+    await callback.edit(guild.lang['result.video_playing'].format(sources[0].title))
 
 
 @bot.command('add', aliases=['a', '+'])
@@ -180,7 +238,7 @@ async def add(
     guild = GuildData.get_instance(ctx.guild.id)
 
     # Send callback message
-    await ctx.send(guild.lang['result.searching'])
+    callback = _reply(ctx, guild.lang['result.searching'])
 
     # Add video to queue
     channel = ctx.author.voice.channel
@@ -189,18 +247,18 @@ async def add(
         voice_client = await channel.connect()
     else:
         await voice_client.move_to(channel)
-    sources = ytdlp.search(url_or_search)
+    sources = await _search(ctx, url_or_search)
+    if sources is None or not await _admit(ctx):
+        return
     controller = AudioController.get_controller(voice_client)
-    controller.queue.extend(sources)
+    ytdlp.prefetch_skip_segments(sources)
 
-    # Send another callback message
-    if len(controller.queue) != 0:
-        video = controller.queue[0]
-        await ctx.send(guild.lang['result.video_added'].format(video.title))
+    # Starts playing if nothing is playing
+    controller.add(sources)
+    ytdlp.resolve_in_background(sources, ctx.guild.id)
 
-    # Start playing if queue was empty
-    if not voice_client.is_playing():
-        controller.start()
+    # Replace callback message
+    await callback.edit(guild.lang['result.video_added'].format(sources[0].title))
 
 
 @bot.command('skip', aliases=['next', 'nx', 'sk'])
@@ -215,14 +273,18 @@ async def skip(
 
     # Error if bot is not in voice channel
     if voice_client is None:
-        return await ctx.send(guild.lang['error.not_in_voice_channel'])
+        return await _reply(ctx, guild.lang['error.not_in_voice_channel'])
+
+    # Next audio needs playback slot, if server has released it
+    if not await _admit(ctx):
+        return
 
     # Skip current audio
     controller = AudioController.get_controller(voice_client)
     controller.skip(count)
 
     # Send message
-    await ctx.send(guild.lang['result.video_skipped'])
+    await _reply(ctx, guild.lang['result.video_skipped'])
 
 
 @bot.command('stop', aliases=['s'])
@@ -237,22 +299,20 @@ async def stop(ctx: Context):
     else:
         await voice_client.move_to(channel)
 
-    # If already stopped, send error
-    if not voice_client.is_playing():
-        return await ctx.send(guild.lang['error.not_playing'])
+    # Cancel pending lookups, so they won't start playing after stop
+    cancelled = ytdlp.cancel_guild_searches(ctx.guild.id)
 
-    _queue = AudioQueue.get_queue(ctx.guild.id)
+    controller = AudioController.get_controller(voice_client)
 
-    # Stop replay
-    if _queue.on_replay:
-        _queue.on_replay = False
+    # If already stopped, send error
+    if not controller.is_active and not cancelled:
+        return await _reply(ctx, guild.lang['error.not_playing'])
 
-    # Stop playing and clear queue
-    _queue.clear()
-    voice_client.stop()
+    # Stop replay, stop playing and clear queue
+    controller.stop()
 
     # Send message
-    await ctx.send(guild.lang['result.video_stopped'])
+    await _reply(ctx, guild.lang['result.video_stopped'])
 
 
 @bot.command('pause', aliases=['wait'])
@@ -263,16 +323,16 @@ async def pause(ctx: Context):
 
     # Error if bot is not in voice channel
     if ctx.voice_client is None:
-        return await ctx.send(guild.lang['error.not_in_voice_channel'])
+        return await _reply(ctx, guild.lang['error.not_in_voice_channel'])
     # Error if bot is already paused
     if ctx.voice_client.is_paused():
-        return await ctx.send(guild.lang['error.already_paused'])
+        return await _reply(ctx, guild.lang['error.already_paused'])
     # Error if bot is not playing
     if not ctx.voice_client.is_playing():
-        return await ctx.send(guild.lang['error.already_stopped'])
+        return await _reply(ctx, guild.lang['error.already_stopped'])
 
     ctx.voice_client.pause()
-    await ctx.send(guild.lang['result.video_paused'])
+    await _reply(ctx, guild.lang['result.video_paused'])
 
 
 @bot.command('resume', aliases=['continue', 'unpause', 'res'])
@@ -283,16 +343,16 @@ async def resume(ctx: Context):
 
     # Error if bot is not in voice channel
     if ctx.voice_client is None:
-        return await ctx.send(guild.lang['error.not_in_voice_channel'])
+        return await _reply(ctx, guild.lang['error.not_in_voice_channel'])
     # Error if bot is already playing
     if ctx.voice_client.is_playing():
-        return await ctx.send(guild.lang['error.already_playing'])
+        return await _reply(ctx, guild.lang['error.already_playing'])
     # Error if bot is not paused
     if not ctx.voice_client.is_paused():
-        return await ctx.send(guild.lang['error.queue_empty'])
+        return await _reply(ctx, guild.lang['error.queue_empty'])
 
     ctx.voice_client.resume()
-    await ctx.send(guild.lang['result.video_resumed'])
+    await _reply(ctx, guild.lang['result.video_resumed'])
 
 
 @bot.command('replay', aliases=['repeat', 'loop', 'repl', 'rep', 'rp'])
@@ -314,23 +374,27 @@ async def replay(
     if url_or_search is None:
         if guild.queue.on_replay:
             guild.queue.on_replay = False
-            await ctx.send(guild.lang['result.replay_disabled'])
+            await _reply(ctx, guild.lang['result.replay_disabled'])
         else:
             guild.queue.on_replay = True
-            await ctx.send(guild.lang['result.replay_enabled'])
+            await _reply(ctx, guild.lang['result.replay_enabled'])
         return
 
     # Send callback message
-    await ctx.send(guild.lang['result.searching'])
+    callback = _reply(ctx, guild.lang['result.searching'])
 
     # Start auto replay
-    sources = ytdlp.search(url_or_search)
+    sources = await _search(ctx, url_or_search)
+    if sources is None or not await _admit(ctx):
+        return
     controller = AudioController.get_controller(ctx.voice_client)
     controller.queue.on_replay = True
+    ytdlp.prefetch_skip_segments(sources)
     controller.play_audio(sources)
+    ytdlp.resolve_in_background(sources, ctx.guild.id)
 
-    # Send another callback message
-    await ctx.send(guild.lang['result.replay_enabled'])
+    # Replace callback message
+    await callback.edit(guild.lang['result.replay_enabled'])
 
 
 @bot.command('queue', aliases=['list'])
@@ -341,13 +405,20 @@ async def queue(ctx: Context):
 
     # Error if queue is empty
     if len(guild.queue) == 0 and guild.queue.current is None:
-        return await ctx.send(guild.lang['result.queue_empty'])
+        return await _reply(ctx, guild.lang['result.queue_empty'])
+
+    # Show only beginning of queue, it can contain thousands of audio
+    lines = [
+        f'{i + 1}. {video.title}'
+        for i, video in enumerate(islice(guild.queue.full_queue, QUEUE_VIEW_LIMIT))
+    ]
+    hidden = len(guild.queue) + (guild.queue.current is not None) - len(lines)
+    if hidden > 0:
+        lines.append(guild.lang['text.more_items'].format(hidden))
 
     # Send message
-    await ctx.send(guild.lang['result.queue'].format(
-        '\n'.join(
-            f'{i + 1}. {video.title}' for i, video in enumerate(guild.queue.full_queue)
-        ) or guild.lang['text.empty']
+    await _reply(ctx, guild.lang['result.queue'].format(
+        '\n'.join(lines) or guild.lang['text.empty']
     ))
 
 
@@ -360,12 +431,15 @@ async def clear(ctx: Context):
 
     # Error if queue is empty
     if queue_len == 0:
-        return await ctx.send(guild.lang['error.queue_empty'])
+        return await _reply(ctx, guild.lang['error.queue_empty'])
 
-    queue.clear()
+    if ctx.voice_client is not None:
+        AudioController.get_controller(ctx.voice_client).clear()
+    else:
+        guild.queue.clear()
 
     # Send message
-    await ctx.send(guild.lang['result.queue_cleared'].format(queue_len))
+    await _reply(ctx, guild.lang['result.queue_cleared'].format(queue_len))
 
 
 @bot.command('playlast', aliases=['last', 'latest'])
@@ -377,15 +451,16 @@ async def playlast(ctx: Context):
 
     # Error if last audio is not found
     if controller.queue.latest is None:
-        return await ctx.send(guild.lang['error.no_last_video'])
+        return await _reply(ctx, guild.lang['error.no_last_video'])
 
-    controller.queue.set_next(controller.queue.latest)
+    if not await _admit(ctx):
+        return
 
     # Play last audio
-    controller.skip()
+    controller.play_audio(controller.queue.latest)
 
     # Send message
-    await ctx.send(guild.lang['result.playing_last'])
+    await _reply(ctx, guild.lang['result.playing_last'])
 
 
 @bot.command('language', aliases=['lang'])
@@ -399,16 +474,16 @@ async def language(
 
     # Show help if no arguments
     if lang_code is None:
-        return await ctx.send(guild.lang['result.language_help'].format(guild.lang_code))
+        return await _reply(ctx, guild.lang['result.language_help'].format(guild.lang_code))
 
     # Error if language is not found
     if lang_code not in langs:
-        return await ctx.send(guild.lang['error.language_not_found'])
+        return await _reply(ctx, guild.lang['error.language_not_found'])
 
     guild.lang_code = lang_code
 
     # Send message
-    await ctx.send(guild.lang['result.language_set'])
+    await _reply(ctx, guild.lang['result.language_set'])
 
 
 @bot.command('languages', aliases=['langs'])
@@ -416,7 +491,7 @@ async def languages(ctx: Context):
     """Show available languages"""
 
     guild = GuildData.get_instance(ctx.guild.id)
-    await ctx.send(guild.lang['result.languages'])
+    await _reply(ctx, guild.lang['result.languages'])
 
 
 @bot.command('save', aliases=['savevideo', 'savevid', 'savecurrent', 'savecur'])
@@ -435,24 +510,30 @@ async def save(
     guild = GuildData.get_instance(ctx.guild.id)
 
     # Error, if limit is reached
-    if len(guild.get_saved_audio()) >= int(os.getenv('SAVES_LIMIT')):
-        return await ctx.send(guild.lang['error.saves_limit'])
+    if await guild.count_saved_audio() >= int(os.getenv('SAVES_LIMIT')):
+        return await _reply(ctx, guild.lang['error.saves_limit'])
+
+    # Error, if name is taken
+    if await guild.get_saved_audio_by_name(name) is not None:
+        return await _reply(ctx, guild.lang['error.video_name_taken'].format(name))
 
     # Save video by url or search query
     if url_or_search is not None:
-        videos = ytdlp.search(url_or_search)
+        videos = await _search(ctx, url_or_search)
+        if videos is None:
+            return
 
-        guild.save_audio(videos[0], name)
-        return await ctx.send(guild.lang['result.video_saved'].format(name))
+        await guild.save_audio(videos[0], name)
+        return await _reply(ctx, guild.lang['result.video_saved'].format(name))
 
     # Save current video
     else:
         # Error, if no current video
         if guild.queue.current is None:
-            return await ctx.send(guild.lang['error.no_current_video'])
+            return await _reply(ctx, guild.lang['error.no_current_video'])
 
-        guild.save_audio(guild.queue.current, name)
-        await ctx.send(guild.lang['result.video_saved'].format(name))
+        await guild.save_audio(guild.queue.current, name)
+        await _reply(ctx, guild.lang['result.video_saved'].format(name))
 
 
 @bot.command('saves', aliases=['saved', 'getsaves', 'savedvideos', 'savedvids'])
@@ -460,10 +541,10 @@ async def saves(ctx: Context):
     """Show saved videos"""
 
     guild = GuildData.get_instance(ctx.guild.id)
-    saves = guild.get_saved_audio()
+    saves = await guild.get_saved_audio()
 
     # Send message
-    await ctx.send(guild.lang['result.saved_videos'].format(
+    await _reply(ctx, guild.lang['result.saved_videos'].format(
         '\n'.join(
             f'**{save.name}**: {save.source.title}' for save in saves
         ) or guild.lang['text.empty']
@@ -476,12 +557,12 @@ async def clearsaves(ctx: Context):
     """Clear saved videos list"""
 
     guild = GuildData.get_instance(ctx.guild.id)
-    saves_len = len(guild.get_yt_saves())
+    saves_len = await guild.count_saved_audio()
 
-    guild.clear_saves()
+    await guild.clear_saves()
 
     # Send message
-    await ctx.send(guild.lang['result.saved_videos_cleared'].format(saves_len))
+    await _reply(ctx, guild.lang['result.saved_videos_cleared'].format(saves_len))
 
 
 @bot.command('delsave', aliases=['unsave', 'remsave', 'deletevideo',
@@ -494,16 +575,16 @@ async def delsave(
     """Delete saved video"""
 
     guild = GuildData.get_instance(ctx.guild.id)
-    save = guild.get_saved_audio_by_name(name)
+    save = await guild.get_saved_audio_by_name(name)
 
     # Error, if video not found
     if save is None:
-        return await ctx.send(guild.lang['error.video_not_found'])
+        return await _reply(ctx, guild.lang['error.video_not_found'])
 
-    guild.delete_saved_audio(name)
+    await guild.delete_saved_audio(name)
 
     # Send message
-    await ctx.send(guild.lang['result.video_deleted'].format(name))
+    await _reply(ctx, guild.lang['result.video_deleted'].format(name))
 
 
 @bot.command('playsaved', aliases=['playsave', 'ps'])
@@ -519,18 +600,22 @@ async def playsaved(
             return
 
     guild = GuildData.get_instance(ctx.guild.id)
-    save = guild.get_saved_audio_by_name(name)
+    save = await guild.get_saved_audio_by_name(name)
 
     # Error, if video not found
     if save is None:
-        return await ctx.send(guild.lang['error.video_not_found'])
+        return await _reply(ctx, guild.lang['error.video_not_found'])
+
+    if not await _admit(ctx):
+        return
 
     # Start playing
     controller = AudioController.get_controller(ctx.voice_client)
+    ytdlp.prefetch_skip_segments([save.source])
     controller.play_audio(save.source)
 
     # Send message
-    await ctx.send(guild.lang['result.video_playing'].format(save.source.title))
+    await _reply(ctx, guild.lang['result.video_playing'].format(save.source.title))
 
 
 @bot.command('replaysaved', aliases=['replaysave', 'rs'])
@@ -546,16 +631,20 @@ async def replaysaved(
             return
 
     guild = GuildData.get_instance(ctx.guild.id)
-    save = guild.get_saved_audio_by_name(name)
+    save = await guild.get_saved_audio_by_name(name)
 
     # Error, if video not found
     if save is None:
-        return await ctx.send(guild.lang['error.video_not_found'])
+        return await _reply(ctx, guild.lang['error.video_not_found'])
+
+    if not await _admit(ctx):
+        return
 
     # Start auto replay
     controller = AudioController.get_controller(ctx.voice_client)
     controller.queue.on_replay = True
+    ytdlp.prefetch_skip_segments([save.source])
     controller.play_audio(save.source)
 
     # Send message
-    await ctx.send(guild.lang['result.video_playing'].format(save.source.title))
+    await _reply(ctx, guild.lang['result.video_playing'].format(save.source.title))
@@ -3,37 +3,84 @@ Module for working with data
 """
 
 import os
+import asyncio
 import pathlib
 import time
 import json
 import sqlite3
+import threading
 from abc import ABC, abstractmethod
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
 from dataclasses import dataclass
 
-from settings import LANGS_DIR
-from bot.audio import AudioQueue
-from bot.schemas import SpamState, Language, YoutubeVideo, AudioSource
+from settings import LANGS_DIR, SHARD_COUNT, SHARD_IDS
+from bot.audio import AudioQueue, queue_journal
+from bot.registry import GuildRegistry
+from bot import ytdlp, codec
+from bot.schemas import SpamState, Language, YoutubeVideo, AudioSource, SkipSegment, PlaybackState, QueueChanges
 from bot.utils import load_lang_file
+from bot.persistence import HEARTBEAT_KEY
+from bot.database import AsyncBotDatabase
 
 LANG_FILE_EXT_WHITELIST = ['.yaml', '.yml']
 "Whitelist of localization file extensions that will be loaded"
+SQLITE_MMAP_SIZE = 256 * 2 ** 20
+"Size of database file mapped to memory in tuned mode (in bytes)"
+SQLITE_CACHE_SIZE = 16 * 2 ** 10
+"Size of page cache of each connection in tuned mode (in KiB)"
+SQLITE_STATEMENT_CACHE = 256
+"Count of prepared statements cached by each connection"
 
 
-def _load_langs(path: str) -> dict[str, Language]:
-    """Load languages from specified directory"""
+class LanguageCatalog(Mapping[str, Language]):
+    """
+    Languages from localization files in directory, mapped by language code.
+
+    Each language is loaded on first use, from compiled file cached in `__pycache__`
+    subdirectory, so only languages that are used are loaded, and YAML isn't parsed on start.
+    Files can be checked in advance by `load_all`.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: Directory with localization files
+        """
+
+        self.path = path
+        "Directory with localization files"
+        self._files = {pathlib.Path(file).stem: os.path.join(path, file) for file in sorted(os.listdir(path))
+                       if pathlib.Path(file).suffix in LANG_FILE_EXT_WHITELIST}
+        "Language code to localization file mapping"
+        self._langs: dict[str, Language] = {}
+
+    def __getitem__(self, lang_code: str) -> Language:
+        lang = self._langs.get(lang_code)
+
+        if lang is None:
+            lang = load_lang_file(self._files[lang_code], os.path.join(self.path, '__pycache__'))
+            self._langs[lang_code] = lang
+
+        return lang
 
-    _langs = {}
+    def load_all(self) -> None:
+        """
+        Load all languages, so broken localization files fail on bot start instead of in commands
 
-    for file in os.listdir(path):
-        file_ext = pathlib.Path(file).suffix
+        :raises SyntaxError: If localization file or its template is invalid
+        """
 
-        if file_ext not in LANG_FILE_EXT_WHITELIST:
-            continue
+        for lang_code in self._files:
+            self[lang_code]
 
-        lang = load_lang_file(f'{path}/{file}')
-        _langs[lang.lang_code] = lang
+    def __contains__(self, lang_code: object) -> bool:
+        return lang_code in self._files
 
-    return _langs
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._files)
+
+    def __len__(self) -> int:
+        return len(self._files)
 
 
 @dataclass
@@ -55,6 +102,20 @@ class BotDatabaseRepository(ABC):
     It's used for storing data in database
     """
 
+    deferred_commit = False
+    "If set, writes aren't committed until `commit` is called, so several writes are committed at once"
+    readers = 0
+    "Count of threads that can run reads concurrently with writes, each calling `attach_reader` first"
+
+    def commit(self) -> None:
+        """Commit deferred writes"""
+
+    def rollback(self) -> None:
+        """Discard deferred writes"""
+
+    def attach_reader(self) -> None:
+        """Prepare current thread for running reads. Reads see only committed writes there"""
+
     @abstractmethod
     def get_guild_saved_audio(self, guild_id: int) -> list[SavedAudio]:
         """Get saved audio list"""
@@ -71,6 +132,43 @@ class BotDatabaseRepository(ABC):
     def set_guild_language(self, guild_id: int, lang_code: str) -> None:
         """Set guild language"""
 
+    @abstractmethod
+    def get_guild_languages(self, shard_count: int = 0, shard_ids: list[int] | None = None) -> dict[int, str]:
+        """
+        Get languages of all servers that have it set.
+
+        If `shard_ids` is set, only servers in these shards are returned.
+        """
+
+    @abstractmethod
+    def get_video_skip_segments(self, video_id: str) -> tuple[list[SkipSegment], float] | None:
+        """Get SponsorBlock segments of video and timestamp when they were fetched"""
+
+    @abstractmethod
+    def set_video_skip_segments(self, video_id: str, segments: list[SkipSegment]) -> None:
+        """Set SponsorBlock segments of video"""
+
+    @abstractmethod
+    def save_queue_changes(self, changes: list[QueueChanges], heartbeat: float | None) -> None:
+        """Apply queue changes of servers and save timestamp of last save, if set"""
+
+    @abstractmethod
+    def get_playback_states(self) -> tuple[list[PlaybackState], float | None]:
+        """Get saved playback states of all servers and timestamp of last save"""
+
+    @abstractmethod
+    def get_queue_items(self, guild_id: int) -> list[AudioSource]:
+        """Get saved queue of server"""
+
+    @abstractmethod
+    def delete_orphan_queue_items(self, shard_count: int = 0, shard_ids: list[int] | None = None) -> None:
+        """
+        Delete saved queues of servers without playback state.
+
+        If `shard_ids` is set, only queues of servers in these shards are deleted,
+        as other shards can be run by another process.
+        """
+
     def save_guild_audio(self, guild_id: int, audio: SavedAudio) -> None:
         """Save audio to database"""
         saves = self.get_guild_saved_audio(guild_id)
@@ -94,6 +192,10 @@ class BotDatabaseRepository(ABC):
 
         return None
 
+    def count_guild_saved_audio(self, guild_id: int) -> int:
+        """Get count of saved audio"""
+        return len(self.get_guild_saved_audio(guild_id))
+
     def clear_guild_saved_audio(self, guild_id: int) -> None:
         """Clear guild YouTube saves"""
         self.set_guild_saved_audio(guild_id, [])
@@ -102,11 +204,98 @@ class BotDatabaseRepository(ABC):
 class SQLiteBotDatabase(BotDatabaseRepository):
     """Bot database based on SQLite"""
 
-    def __init__(self, path: str) -> None:
-        self._db = sqlite3.connect(path, check_same_thread=False)
-        self._db.row_factory = sqlite3.Row
+    def __init__(self, path: str, busy_timeout: float = 5.0, tuned: bool = False, readers: int = 0) -> None:
+        """
+        :param path: Database file
+        :param busy_timeout: Max time to wait for database locked by another process (in seconds)
+        :param tuned: Trade durability of last commits on power loss for speed, and use more memory for cache
+        :param readers: Count of read-only connections for reads running concurrently with writes
+        """
+
+        self.path = path
+        "Database file"
+        self.busy_timeout = busy_timeout
+        "Max time to wait for database locked by another process (in seconds)"
+        self.tuned = tuned
+        "Is tuned mode enabled"
+        self.readers = readers
+        self._local = threading.local()
+
+        self._db = self._connect()
+        # Readers don't block writer, so bot processes of sharded bot can share database
+        self._db.execute('PRAGMA journal_mode=WAL')
+        if tuned:
+            # In WAL mode database can't be corrupted without fsync on every commit,
+            # only last commits can be lost on power loss
+            self._db.execute('PRAGMA synchronous=NORMAL')
         self._init_db()
 
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open connection to database"""
+
+        if read_only:
+            db = sqlite3.connect(pathlib.Path(self.path).absolute().as_uri() + '?mode=ro', uri=True,
+                                 check_same_thread=False, timeout=self.busy_timeout,
+                                 cached_statements=SQLITE_STATEMENT_CACHE)
+        else:
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=self.busy_timeout,
+                                 cached_statements=SQLITE_STATEMENT_CACHE)
+
+        db.row_factory = sqlite3.Row
+        if self.tuned:
+            db.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+            db.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE}')
+
+        return db
+
+    @property
+    def _reader(self) -> sqlite3.Connection:
+        """Connection for reads: read-only connection of current thread if it's attached, or main one"""
+        return getattr(self._local, 'db', self._db)
+
+    def attach_reader(self) -> None:
+        if getattr(self._local, 'db', None) is None:
+            self._local.db = self._connect(read_only=True)
+
+    def commit(self) -> None:
+        self._db.commit()
+
+    def rollback(self) -> None:
+        self._db.rollback()
+
+    def _commit(self) -> None:
+        """Commit write, unless commits are deferred"""
+
+        if not self.deferred_commit:
+            self._db.commit()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Make writes inside the block atomic.
+
+        If commits are deferred, block is a savepoint inside current transaction,
+        so its failure doesn't discard other writes.
+        """
+
+        if not self.deferred_commit:
+            with self._db:
+                yield
+            return
+
+        # Savepoint without open transaction would commit on release
+        if not self._db.in_transaction:
+            self._db.execute('BEGIN')
+
+        self._db.execute('SAVEPOINT write')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK TO write')
+            raise
+        finally:
+            self._db.execute('RELEASE write')
+
     def _init_db(self):
         """Initialize database"""
 
@@ -117,23 +306,73 @@ class SQLiteBotDatabase(BotDatabaseRepository):
                 saves JSON
             );
         ''')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS skip_segments (
+                video_id TEXT PRIMARY KEY,
+                segments JSON,
+                fetched_at REAL
+            );
+        ''')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS playback_state (
+                guild_id INTEGER PRIMARY KEY,
+                channel_id INTEGER,
+                current JSON,
+                on_replay INTEGER,
+                position REAL,
+                position_at REAL
+            );
+        ''')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS queue_items (
+                guild_id INTEGER,
+                seq INTEGER,
+                audio JSON,
+                PRIMARY KEY (guild_id, seq)
+            ) WITHOUT ROWID;
+        ''')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value
+            );
+        ''')
+        # Names are compared by `name_key`, as SQLite NOCASE collation only folds ASCII letters
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS saved_audio (
+                id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                name_key TEXT NOT NULL,
+                type TEXT,
+                source JSON
+            );
+        ''')
+        self._db.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS saved_audio_name ON saved_audio (guild_id, name_key);
+        ''')
         self._db.commit()
+        self._migrate_saves()
 
-    def _init_guild(self, guild_id: int):
-        """Initialize guild in database if it doesn't exist"""
+    def _migrate_saves(self):
+        """Move saves from JSON column of `guilds` table into `saved_audio` table"""
 
-        row = self._db.execute(
-            f'SELECT guild_id FROM guilds WHERE guild_id = ?',
-            (guild_id,)).fetchone()
+        with self._db:
+            rows = self._db.execute(
+                "SELECT guild_id, saves FROM guilds WHERE saves IS NOT NULL AND saves != '[]'").fetchall()
 
-        if row is None:
-            self._db.execute(
-                f'INSERT INTO guilds (guild_id, lang_code, saves) VALUES (?, ?, ?)',
-                (guild_id, os.getenv('DEFAULT_LANG'), json.dumps([])))
-            self._db.commit()
+            if not rows:
+                return
+
+            # Names could repeat, first save was found by name before
+            self._db.executemany(
+                'INSERT OR IGNORE INTO saved_audio (guild_id, name, name_key, type, source) VALUES (?, ?, ?, ?, ?)',
+                [(row['guild_id'], name, name.lower(), type_, json.dumps(data))
+                 for row in rows for name, type_, data in json.loads(row['saves'])])
+            self._db.execute('UPDATE guilds SET saves = NULL')
 
     def get_guild_language(self, guild_id: int) -> str | None:
-        row = self._db.execute(
+        row = self._reader.execute(
             f'SELECT lang_code FROM guilds WHERE guild_id = ?',
             (guild_id,)).fetchone()
 
@@ -143,41 +382,242 @@ class SQLiteBotDatabase(BotDatabaseRepository):
         return row['lang_code']
 
     def set_guild_language(self, guild_id: int, lang_code: str) -> None:
+        # Replacing row would clear other columns
         self._db.execute(
-            f'INSERT OR REPLACE INTO guilds (guild_id, lang_code) VALUES (?, ?)',
+            'INSERT INTO guilds (guild_id, lang_code) VALUES (?, ?) '
+            'ON CONFLICT (guild_id) DO UPDATE SET lang_code = excluded.lang_code',
             (guild_id, lang_code))
 
-        self._db.commit()
+        self._commit()
+
+    def get_guild_languages(self, shard_count: int = 0, shard_ids: list[int] | None = None) -> dict[int, str]:
+        query = 'SELECT guild_id, lang_code FROM guilds WHERE lang_code IS NOT NULL'
+        params = []
+
+        if shard_ids is not None:
+            query += f' AND (guild_id >> 22) % ? IN ({", ".join("?" * len(shard_ids))})'
+            params = [shard_count, *shard_ids]
+
+        return dict(self._reader.execute(query, params).fetchall())
 
     def get_guild_saved_audio(self, guild_id: int) -> list[SavedAudio]:
         """Get saved audio list"""
 
-        row = self._db.execute(
-            'SELECT saves FROM guilds WHERE guild_id = ?',
-            (guild_id,)).fetchone()
+        rows = self._reader.execute(
+            'SELECT name, type, source FROM saved_audio WHERE guild_id = ? ORDER BY id',
+            (guild_id,)).fetchall()
 
-        if row is None:
-            return []
-
-        saves = json.loads(row['saves'])
-        audio_list = []
-        for name, type_, data in saves:
-            if type_ == 'youtube':
-                source = YoutubeVideo.deserialize(data)
-            else:
-                source = AudioSource.deserialize(data)
-            audio_list.append(SavedAudio(name, type_, source))
-        return audio_list
+        return [_load_saved_audio(row) for row in rows]
 
     def set_guild_saved_audio(self, guild_id: int, saves: list[SavedAudio]) -> None:
         """Set saved audio list"""
 
-        self._init_guild(guild_id)
+        with self._transaction():
+            self._db.execute('DELETE FROM saved_audio WHERE guild_id = ?', (guild_id,))
+            self._db.executemany(
+                'INSERT OR IGNORE INTO saved_audio (guild_id, name, name_key, type, source) VALUES (?, ?, ?, ?, ?)',
+                [(guild_id, audio.name, audio.name.lower(), audio.type, codec.encode(audio.source))
+                 for audio in saves])
+
+    def save_guild_audio(self, guild_id: int, audio: SavedAudio) -> None:
+        """Save audio to database. Saved audio with the same name is kept"""
+
         self._db.execute(
-            'UPDATE guilds SET saves = ? WHERE guild_id = ?',
-            (json.dumps([(audio.name, audio.type, audio.source.serialize()) for audio in saves]), guild_id))
+            'INSERT INTO saved_audio (guild_id, name, name_key, type, source) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (guild_id, name_key) DO NOTHING',
+            (guild_id, audio.name, audio.name.lower(), audio.type, codec.encode(audio.source)))
+        self._commit()
 
-        self._db.commit()
+    def delete_guild_audio(self, guild_id: int, name: str) -> None:
+        self._db.execute(
+            'DELETE FROM saved_audio WHERE guild_id = ? AND name_key = ?',
+            (guild_id, name.lower()))
+        self._commit()
+
+    def get_guild_saved_audio_by_name(self, guild_id: int, name: str) -> SavedAudio | None:
+        row = self._reader.execute(
+            'SELECT name, type, source FROM saved_audio WHERE guild_id = ? AND name_key = ?',
+            (guild_id, name.lower())).fetchone()
+
+        return _load_saved_audio(row) if row is not None else None
+
+    def count_guild_saved_audio(self, guild_id: int) -> int:
+        return self._reader.execute(
+            'SELECT COUNT(*) FROM saved_audio WHERE guild_id = ?',
+            (guild_id,)).fetchone()[0]
+
+    def clear_guild_saved_audio(self, guild_id: int) -> None:
+        self._db.execute('DELETE FROM saved_audio WHERE guild_id = ?', (guild_id,))
+        self._commit()
+
+    def get_video_skip_segments(self, video_id: str) -> tuple[list[SkipSegment], float] | None:
+        row = self._reader.execute(
+            'SELECT segments, fetched_at FROM skip_segments WHERE video_id = ?',
+            (video_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        segments = [SkipSegment(*segment) for segment in json.loads(row['segments'])]
+        return segments, row['fetched_at']
+
+    def set_video_skip_segments(self, video_id: str, segments: list[SkipSegment]) -> None:
+        self._db.execute(
+            'INSERT OR REPLACE INTO skip_segments (video_id, segments, fetched_at) VALUES (?, ?, ?)',
+            (video_id, json.dumps([(seg.start, seg.end, seg.category) for seg in segments]), time.time()))
+
+        self._commit()
+
+    def save_queue_changes(self, changes: list[QueueChanges], heartbeat: float | None) -> None:
+        with self._transaction():
+            for guild_changes in changes:
+                guild_id = guild_changes.guild_id
+
+                if guild_changes.cleared:
+                    self._db.execute('DELETE FROM queue_items WHERE guild_id = ?', (guild_id,))
+
+                self._db.executemany(
+                    'DELETE FROM queue_items WHERE guild_id = ? AND seq = ?',
+                    [(guild_id, seq) for seq, audio in guild_changes.items.items() if audio is None])
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO queue_items (guild_id, seq, audio) VALUES (?, ?, ?)',
+                    [(guild_id, seq, _dump_audio(audio)) for seq, audio in guild_changes.items.items()
+                     if audio is not None])
+
+                if not guild_changes.state_changed:
+                    continue
+
+                state = guild_changes.state
+                if state is None:
+                    self._db.execute('DELETE FROM playback_state WHERE guild_id = ?', (guild_id,))
+                else:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO playback_state '
+                        '(guild_id, channel_id, current, on_replay, position, position_at) VALUES (?, ?, ?, ?, ?, ?)',
+                        (guild_id, state.channel_id, _dump_audio(state.current), state.on_replay,
+                         state.position, state.position_at))
+
+            if heartbeat is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                    (HEARTBEAT_KEY, heartbeat))
+
+    def get_playback_states(self) -> tuple[list[PlaybackState], float | None]:
+        rows = self._reader.execute('SELECT * FROM playback_state').fetchall()
+        heartbeat = self._reader.execute('SELECT value FROM meta WHERE key = ?', (HEARTBEAT_KEY,)).fetchone()
+
+        states = [PlaybackState(
+            guild_id=row['guild_id'],
+            current=_load_audio(row['current']),
+            on_replay=bool(row['on_replay']),
+            channel_id=row['channel_id'],
+            position=row['position'],
+            position_at=row['position_at'],
+        ) for row in rows]
+        return states, heartbeat['value'] if heartbeat is not None else None
+
+    def get_queue_items(self, guild_id: int) -> list[AudioSource]:
+        rows = self._reader.execute(
+            'SELECT audio FROM queue_items WHERE guild_id = ? ORDER BY seq',
+            (guild_id,)).fetchall()
+
+        return [_load_audio(row['audio']) for row in rows]
+
+    def delete_orphan_queue_items(self, shard_count: int = 0, shard_ids: list[int] | None = None) -> None:
+        query = 'DELETE FROM queue_items WHERE guild_id NOT IN (SELECT guild_id FROM playback_state)'
+        params = []
+
+        if shard_ids is not None:
+            query += f' AND (guild_id >> 22) % ? IN ({", ".join("?" * len(shard_ids))})'
+            params = [shard_count, *shard_ids]
+
+        self._db.execute(query, params)
+        self._commit()
+
+
+def _dump_audio(audio: AudioSource) -> bytes:
+    """Serialize audio source with its type"""
+    return codec.encode(audio)
+
+
+def _load_saved_audio(row: sqlite3.Row) -> SavedAudio:
+    """Load saved audio from `saved_audio` table row"""
+
+    # Rows saved before binary codec are in JSON
+    if isinstance(row['source'], bytes):
+        source = codec.decode(row['source'])
+    else:
+        data = json.loads(row['source'])
+        source = YoutubeVideo.deserialize(data) if row['type'] == 'youtube' else AudioSource.deserialize(data)
+
+    return SavedAudio(row['name'], row['type'], source)
+
+
+def _load_audio(data: bytes | str) -> AudioSource:
+    """Deserialize audio source serialized by `_dump_audio`"""
+
+    # Rows saved before binary codec are in JSON
+    if isinstance(data, bytes):
+        return codec.decode(data)
+
+    type_, data = json.loads(data)
+    if type_ == 'youtube':
+        return YoutubeVideo.deserialize(data)
+    return AudioSource.deserialize(data)
+
+
+class GuildSettingsCache:
+    """
+    Write-through cache of server settings.
+
+    Settings of all servers are loaded by `load` with one query before bot connects to
+    gateway, after which reading them doesn't touch database. Changes are applied to cache
+    at once and saved in background. Must only be used from event loop.
+    """
+
+    def __init__(self, database: AsyncBotDatabase) -> None:
+        self.database = database
+        "Bot database"
+        self._languages: dict[int, str | None] = {}
+        self._loaded = False
+        self._reads: dict[int, asyncio.Task] = {}
+        "Server ID to background read of its settings, made before loading"
+
+    async def load(self) -> None:
+        """Load settings of all servers of this process. Does nothing if already loaded"""
+
+        if self._loaded:
+            return
+
+        languages = await self.database.get_guild_languages(SHARD_COUNT, SHARD_IDS)
+        # Settings changed while loading are newer
+        self._languages = languages | {k: v for k, v in self._languages.items() if v is not None}
+        self._loaded = True
+
+    def get_language(self, guild_id: int) -> str | None:
+        """Get server language, or None if it's not set"""
+
+        # Before loading, settings are read from database one by one in background,
+        # and default settings are used until they are read
+        if not self._loaded and guild_id not in self._languages and guild_id not in self._reads:
+            self._reads[guild_id] = asyncio.create_task(self._read_language(guild_id))
+
+        return self._languages.get(guild_id)
+
+    async def _read_language(self, guild_id: int) -> None:
+        try:
+            language = await self.database.get_guild_language(guild_id)
+        finally:
+            del self._reads[guild_id]
+
+        # Language could be changed or loaded while it was read
+        self._languages.setdefault(guild_id, language)
+
+    def set_language(self, guild_id: int, lang_code: str) -> None:
+        """Set server language"""
+
+        self._languages[guild_id] = lang_code
+        self.database.write_nowait(self.database.repository.set_guild_language, guild_id, lang_code)
 
 
 class GuildData:
@@ -186,10 +626,17 @@ class GuildData:
     MOVE_COOLDOWN = 0.75
     "Cooldown for bot move between voice channels (in seconds)"
 
-    database: SQLiteBotDatabase
+    database: AsyncBotDatabase
     "Bot database"
-    _global_data = {}
-    "Global data mapping for all servers"
+    settings: GuildSettingsCache
+    "Server settings"
+    _global_data = GuildRegistry(
+        'guild_data',
+        idle_timeout=int(os.getenv('GUILD_IDLE_TIMEOUT')),
+        factory=lambda guild_id: GuildData(guild_id),
+        is_idle=lambda data: data.spam is None or data.spam.progress >= data.spam.repeats,
+    )
+    "Global data mapping for all servers. Data is evicted when unused and loaded again on demand"
 
     def __init__(self, guild_id: int) -> None:
         self.guild_id = guild_id
@@ -198,8 +645,6 @@ class GuildData:
         "Current spam state"
         self._last_move_timestamp: float = 0
         "Timestamp of last bot move"
-        self._lang_code: str = self.database.get_guild_language(guild_id) or os.getenv('DEFAULT_LANG')
-        "Server language code"
 
     @property
     def queue(self) -> AudioQueue:
@@ -209,16 +654,7 @@ class GuildData:
     @staticmethod
     def get_instance(guild_id: int) -> 'GuildData':
         """Get GuildData instance for server with specified ID"""
-
-        _guild_id = str(guild_id)
-        guild_data = GuildData._global_data.get(_guild_id)
-
-        # Register new instance if needed
-        if guild_data is None:
-            guild_data = GuildData(guild_id)
-            GuildData._global_data[_guild_id] = guild_data
-
-        return guild_data
+        return GuildData._global_data.get(guild_id)
 
     def create_spam(self, message: str, repeats: int, delay: float) -> SpamState:
         """Create new `SpamState` instance"""
@@ -235,29 +671,33 @@ class GuildData:
         self._last_move_timestamp = cur_timestamp
         return True
 
-    def save_audio(self, audio: AudioSource, name: str) -> None:
+    async def save_audio(self, audio: AudioSource, name: str) -> None:
         """Save YouTube video to database"""
         if isinstance(audio, YoutubeVideo):
             audio_type = 'youtube'
         else:
             audio_type = 'unknown'
-        self.database.save_guild_audio(self.guild_id, SavedAudio(name, audio_type, audio))
+        await self.database.save_guild_audio(self.guild_id, SavedAudio(name, audio_type, audio))
 
-    def get_saved_audio(self) -> list[SavedAudio]:
+    async def get_saved_audio(self) -> list[SavedAudio]:
         """Get saved audio list"""
-        return self.database.get_guild_saved_audio(self.guild_id)
+        return await self.database.get_guild_saved_audio(self.guild_id)
 
-    def get_saved_audio_by_name(self, name: str) -> SavedAudio | None:
+    async def get_saved_audio_by_name(self, name: str) -> SavedAudio | None:
         """Get saved audio by name"""
-        return self.database.get_guild_saved_audio_by_name(self.guild_id, name)
+        return await self.database.get_guild_saved_audio_by_name(self.guild_id, name)
+
+    async def count_saved_audio(self) -> int:
+        """Get count of saved audio"""
+        return await self.database.count_guild_saved_audio(self.guild_id)
 
-    def delete_saved_audio(self, name: str) -> None:
+    async def delete_saved_audio(self, name: str) -> None:
         """Delete saved audio by name"""
-        self.database.delete_guild_audio(self.guild_id, name)
+        await self.database.delete_guild_audio(self.guild_id, name)
 
-    def clear_saves(self) -> None:
+    async def clear_saves(self) -> None:
         """Clear saved audio list"""
-        self.database.clear_guild_saved_audio(self.guild_id)
+        await self.database.clear_guild_saved_audio(self.guild_id)
 
     def delete(self):
         """Delete GuildData instance"""
@@ -266,26 +706,33 @@ class GuildData:
     @property
     def lang_code(self) -> str:
         """Server language code"""
-        # TODO: don't set this on __init__, get and cache it here instead
-        return self._lang_code
+        return self.settings.get_language(self.guild_id) or os.getenv('DEFAULT_LANG')
 
     @lang_code.setter
     def lang_code(self, value: str) -> None:
-        self._lang_code = value
-        self.database.set_guild_language(self.guild_id, value)
+        self.settings.set_language(self.guild_id, value)
 
     @property
     def lang(self) -> Language:
         """Server language"""
-        return langs[self._lang_code]
+        return langs[self.lang_code]
 
 
-database: 'SQLiteBotDatabase' = SQLiteBotDatabase('bot-data.sqlite')
+database = AsyncBotDatabase(
+    SQLiteBotDatabase('bot-data.sqlite', int(os.getenv('DB_BUSY_TIMEOUT')),
+                      tuned=os.getenv('ENABLE_DB_TUNING').lower() == 'true', readers=int(os.getenv('DB_READERS'))),
+    commit_interval=int(os.getenv('DB_COMMIT_INTERVAL_MS')) / 1000,
+)
 "Bot database"
-langs: dict[str, Language] = _load_langs(LANGS_DIR)
-"Loaded languages"
+guild_settings = GuildSettingsCache(database)
+"Server settings"
+langs = LanguageCatalog(LANGS_DIR)
+"Available languages, loaded on first use"
 
 GuildData.database = database
+GuildData.settings = guild_settings
+ytdlp.segment_cache.database = database.sync
+queue_journal.database = database
 
 
 # Check default language validity
@@ -0,0 +1,315 @@
+"""
+Module with asynchronous access to bot database from a dedicated thread
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from bot import metrics
+from bot.schemas import AudioSource, SkipSegment, PlaybackState, QueueChanges
+
+_logger = logging.getLogger(__name__)
+
+_read_wait = metrics.histogram('db.read_wait_seconds')
+"Time reads spend in queue"
+_write_wait = metrics.histogram('db.write_wait_seconds')
+"Time writes spend in queue"
+_execute_time = metrics.histogram('db.execute_seconds')
+"Time of executing reads and writes, without commit"
+_commit_time = metrics.histogram('db.commit_seconds')
+"Time of group commits"
+_batch_size = metrics.histogram('db.commit_batch_size', buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+"Count of writes committed at once"
+
+
+@dataclass
+class _Job:
+    """Database call waiting in queue"""
+
+    func: Callable
+    "Repository method"
+    args: tuple
+    "Method arguments"
+    future: Future = field(default_factory=Future)
+    "Future with method result"
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    "Timestamp when call was queued"
+
+
+class AsyncBotDatabase:
+    """
+    Runs bot database repository calls on a dedicated thread, so disk doesn't block event loop.
+
+    Writes are executed in order of arrival, but committed in groups: first write
+    opens a transaction, which is committed `commit_interval` seconds later, or once
+    `max_batch` writes are collected. So one fsync covers many writes. Futures of writes
+    are done once they are committed, and get the commit error if commit fails. Reads
+    are taken before queued writes and never wait for commit; they see all executed
+    writes, so a coroutine always reads its own awaited writes. Writes that weren't
+    committed yet are lost if process crashes, so `close` must be called on shutdown.
+
+    If repository has readers, reads run concurrently on reader threads while all
+    queued writes are committed, as readers see only committed writes.
+    """
+
+    def __init__(self, repository: 'BotDatabaseRepository', commit_interval: float, max_batch: int = 200) -> None:
+        """
+        :param repository: Repository with deferred commit support. Must only be used through this instance
+        :param commit_interval: Max time between write and its commit (in seconds)
+        :param max_batch: Count of writes after which they are committed without waiting
+        """
+
+        self.repository = repository
+        "Underlying repository"
+        self.commit_interval = commit_interval
+        "Max time between write and its commit (in seconds)"
+        self.max_batch = max_batch
+        "Count of writes after which they are committed without waiting"
+        self.sync = _SyncBotDatabase(self)
+        "Blocking interface for code running outside of event loop"
+        self._reads: deque[_Job] = deque()
+        self._writes: deque[_Job] = deque()
+        self._uncommitted = 0
+        "Count of executed writes that weren't committed"
+        self._executed: list[tuple[Future, any]] = []
+        "Futures of executed writes that weren't committed, with results of writes"
+        self._commit_at: float | None = None
+        "Timestamp when executed writes must be committed"
+        self._unsynced = 0
+        "Count of queued and executed writes that weren't committed. Readers can't see them"
+        self._readers = ThreadPoolExecutor(repository.readers, 'database-reader', repository.attach_reader) \
+            if repository.readers else None
+        self._closed = False
+        self._cond = threading.Condition()
+
+        repository.deferred_commit = True
+        self._thread = threading.Thread(target=self._run, name='database', daemon=True)
+        self._thread.start()
+
+        metrics.gauge('db.queue_length', lambda: len(self._reads) + len(self._writes))
+
+    # Queue
+
+    def submit_read(self, func: Callable, *args) -> Future:
+        """Queue repository read, taken before queued writes"""
+
+        if self._readers is not None and not self._unsynced:
+            job = _Job(func, args)
+            self._readers.submit(self._execute, job, _read_wait, False)
+            return job.future
+
+        return self._submit(self._reads, func, args)
+
+    def submit_write(self, func: Callable, *args) -> Future:
+        """Queue repository write. Returned future is done when write is committed"""
+        return self._submit(self._writes, func, args, is_write=True)
+
+    def write_nowait(self, func: Callable, *args) -> None:
+        """Queue repository write without waiting for it. Errors are logged"""
+        self.submit_write(func, *args).add_done_callback(_log_error)
+
+    def flush(self) -> Future:
+        """Commit all queued writes. Returned future is done when they are committed"""
+        return self._submit(self._writes, self._commit, ())
+
+    def close(self) -> None:
+        """Commit all queued writes and stop database thread. Blocks until done. Does nothing if already closed"""
+
+        if self._closed:
+            return
+        self.flush()
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+        self._thread.join()
+        if self._readers is not None:
+            self._readers.shutdown()
+
+    def _submit(self, jobs: deque[_Job], func: Callable, args: tuple, is_write: bool = False) -> Future:
+        job = _Job(func, args)
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Database is closed')
+
+            jobs.append(job)
+            if is_write:
+                self._unsynced += 1
+            self._cond.notify()
+
+        return job.future
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._reads and not self._writes:
+                    if self._closed:
+                        return
+
+                    timeout = None if self._commit_at is None else self._commit_at - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+
+                if self._reads:
+                    job, wait = self._reads.popleft(), _read_wait
+                elif self._writes:
+                    job, wait = self._writes.popleft(), _write_wait
+                else:
+                    job = None
+
+            if job is not None:
+                self._execute(job, wait, is_write=wait is _write_wait)
+
+            if self._uncommitted and (self._uncommitted >= self.max_batch or time.monotonic() >= self._commit_at):
+                self._commit()
+
+    def _execute(self, job: _Job, wait: metrics.Histogram, is_write: bool) -> None:
+        started = time.perf_counter()
+        wait.observe(started - job.enqueued_at)
+
+        # Cancelled writes are counted too, as they are counted in `_unsynced`
+        if is_write and job.func != self._commit:
+            if not self._uncommitted:
+                self._commit_at = time.monotonic() + self.commit_interval
+            self._uncommitted += 1
+
+        if not job.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = job.func(*job.args)
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            # Write is done only when it's committed
+            if is_write and job.func != self._commit:
+                self._executed.append((job.future, result))
+            else:
+                job.future.set_result(result)
+
+        _execute_time.observe(time.perf_counter() - started)
+
+    def _commit(self) -> None:
+        """Commit executed writes. Runs on database thread"""
+
+        if not self._uncommitted:
+            return
+
+        started = time.perf_counter()
+        executed, self._executed = self._executed, []
+
+        try:
+            self.repository.commit()
+        except Exception as e:
+            _logger.exception('Failed to commit %s writes', self._uncommitted)
+            self.repository.rollback()
+            error = e
+        else:
+            error = None
+
+        _commit_time.observe(time.perf_counter() - started)
+        _batch_size.observe(self._uncommitted)
+
+        with self._cond:
+            self._unsynced -= self._uncommitted
+        self._uncommitted = 0
+        self._commit_at = None
+
+        for future, result in executed:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    # Repository interface
+
+    async def _read(self, func: Callable, *args) -> any:
+        return await asyncio.wrap_future(self.submit_read(func, *args))
+
+    async def _write(self, func: Callable, *args) -> any:
+        return await asyncio.wrap_future(self.submit_write(func, *args))
+
+    async def get_guild_saved_audio(self, guild_id: int) -> list['SavedAudio']:
+        """Get saved audio list"""
+        return await self._read(self.repository.get_guild_saved_audio, guild_id)
+
+    async def get_guild_saved_audio_by_name(self, guild_id: int, name: str) -> 'SavedAudio | None':
+        """Get saved audio by name"""
+        return await self._read(self.repository.get_guild_saved_audio_by_name, guild_id, name)
+
+    async def count_guild_saved_audio(self, guild_id: int) -> int:
+        """Get count of saved audio"""
+        return await self._read(self.repository.count_guild_saved_audio, guild_id)
+
+    async def save_guild_audio(self, guild_id: int, audio: 'SavedAudio') -> None:
+        """Save audio, replacing saved audio with the same name"""
+        await self._write(self.repository.save_guild_audio, guild_id, audio)
+
+    async def delete_guild_audio(self, guild_id: int, name: str) -> None:
+        """Delete saved audio by name"""
+        await self._write(self.repository.delete_guild_audio, guild_id, name)
+
+    async def clear_guild_saved_audio(self, guild_id: int) -> None:
+        """Clear saved audio list"""
+        await self._write(self.repository.clear_guild_saved_audio, guild_id)
+
+    async def get_guild_language(self, guild_id: int) -> str | None:
+        """Get guild language"""
+        return await self._read(self.repository.get_guild_language, guild_id)
+
+    async def set_guild_language(self, guild_id: int, lang_code: str) -> None:
+        """Set guild language"""
+        await self._write(self.repository.set_guild_language, guild_id, lang_code)
+
+    async def get_guild_languages(self, shard_count: int = 0, shard_ids: list[int] | None = None) -> dict[int, str]:
+        """Get languages of all servers that have it set"""
+        return await self._read(self.repository.get_guild_languages, shard_count, shard_ids)
+
+    async def get_playback_states(self) -> tuple[list[PlaybackState], float | None]:
+        """Get saved playback states of all servers and timestamp of last save"""
+        return await self._read(self.repository.get_playback_states)
+
+    async def get_queue_items(self, guild_id: int) -> list[AudioSource]:
+        """Get saved queue of server"""
+        return await self._read(self.repository.get_queue_items, guild_id)
+
+    async def save_queue_changes(self, changes: list[QueueChanges], heartbeat: float | None) -> None:
+        """Apply queue changes of servers and save timestamp of last save, if set"""
+        await self._write(self.repository.save_queue_changes, changes, heartbeat)
+
+    async def delete_orphan_queue_items(self, shard_count: int = 0, shard_ids: list[int] | None = None) -> None:
+        """Delete saved queues of servers without playback state"""
+        await self._write(self.repository.delete_orphan_queue_items, shard_count, shard_ids)
+
+
+def _log_error(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        _logger.error('Database write failed', exc_info=future.exception())
+
+
+class _SyncBotDatabase:
+    """Blocking interface of `AsyncBotDatabase`, for code running in other threads"""
+
+    def __init__(self, database: AsyncBotDatabase) -> None:
+        self._database = database
+
+    def get_video_skip_segments(self, video_id: str) -> tuple[list[SkipSegment], float] | None:
+        """Get SponsorBlock segments of video and timestamp when they were fetched"""
+        return self._database.submit_read(self._database.repository.get_video_skip_segments, video_id).result()
+
+    def set_video_skip_segments(self, video_id: str, segments: list[SkipSegment]) -> None:
+        """Set SponsorBlock segments of video. Doesn't wait for write"""
+        self._database.write_nowait(self._database.repository.set_video_skip_segments, video_id, segments)
+
+    def get_guild_language(self, guild_id: int) -> str | None:
+        """Get guild language"""
+        return self._database.submit_read(self._database.repository.get_guild_language, guild_id).result()
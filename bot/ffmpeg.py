@@ -0,0 +1,255 @@
+"""
+Module with supervisor of ffmpeg processes used for playback
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+from dataclasses import dataclass, field
+
+from bot import metrics
+
+_logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+class PlaybackBusyError(Exception):
+    """Raised when no playback slot can be given to server"""
+
+
+@dataclass
+class _Process:
+    """Tracked ffmpeg process"""
+
+    process: subprocess.Popen
+    "ffmpeg process"
+    guild_id: int
+    "ID of server the process plays for"
+    cpu_time: float = 0.0
+    "CPU time used by process at last sample (in seconds)"
+    cpu_percent: float = 0.0
+    "CPU usage between last two samples (percent of one core)"
+    rss: int = 0
+    "Resident memory size at last sample (in bytes)"
+    sampled_at: float = field(default_factory=time.monotonic)
+    "Timestamp of last sample"
+    orphaned_at: float | None = None
+    "Timestamp since which server of the process doesn't play anything"
+
+
+class FFmpegSupervisor:
+    """
+    Tracks ffmpeg processes of all servers and limits count of servers playing at once.
+
+    Server takes a playback slot when it starts playing and keeps it until its
+    queue ends, so playback is never interrupted between audios. Servers beyond
+    the limit wait for a free slot in order. Processes are sampled in background:
+    exited ones are reaped, and ones whose server doesn't play anymore are killed.
+
+    Slots must only be used from event loop; process tracking is thread-safe.
+    """
+
+    ORPHAN_GRACE = 30
+    "Time (in seconds) after which process of server without playback slot is killed"
+
+    def __init__(self, max_slots: int, queue_limit: int, queue_timeout: float, sample_interval: float) -> None:
+        """
+        :param max_slots: Max count of servers playing at once. 0 disables limit
+        :param queue_limit: Max count of servers waiting for a slot
+        :param queue_timeout: Max time to wait for a slot (in seconds)
+        :param sample_interval: Interval between process samples (in seconds)
+        """
+
+        self.max_slots = max_slots
+        "Max count of servers playing at once. 0 disables limit"
+        self.queue_limit = queue_limit
+        "Max count of servers waiting for a slot"
+        self.queue_timeout = queue_timeout
+        "Max time to wait for a slot (in seconds)"
+        self.sample_interval = sample_interval
+        "Interval between process samples (in seconds)"
+        self._slots: set[int] = set()
+        "IDs of servers holding playback slot"
+        self._waiters: deque[tuple[int, asyncio.Future]] = deque()
+        "Servers waiting for playback slot, in order of arrival"
+        self._processes: dict[int, _Process] = {}
+        "PID to tracked process mapping"
+        self._lock = threading.Lock()
+        self._sampler: threading.Thread | None = None
+
+    @property
+    def has_free_slot(self) -> bool:
+        """Can server start playing without waiting"""
+        return self.max_slots == 0 or (len(self._slots) < self.max_slots and not self._waiters)
+
+    def is_admitted(self, guild_id: int) -> bool:
+        """Does server hold playback slot"""
+        return guild_id in self._slots
+
+    async def admit(self, guild_id: int) -> None:
+        """
+        Take playback slot for server, waiting for it if all slots are taken.
+
+        :raises PlaybackBusyError: If too many servers are waiting, or slot wasn't freed in time
+        """
+
+        if guild_id in self._slots:
+            return
+
+        if self.has_free_slot:
+            self._slots.add(guild_id)
+            return
+
+        if len(self._waiters) >= self.queue_limit:
+            raise PlaybackBusyError(guild_id)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((guild_id, waiter))
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise PlaybackBusyError(guild_id) from None
+        finally:
+            # Timed out or cancelled
+            if waiter.cancelled():
+                try:
+                    self._waiters.remove((guild_id, waiter))
+                except ValueError:
+                    pass
+
+    def release(self, guild_id: int) -> None:
+        """Free playback slot of server and pass it to next waiting one"""
+
+        self._slots.discard(guild_id)
+
+        while self._waiters and (self.max_slots == 0 or len(self._slots) < self.max_slots):
+            waiting_guild_id, waiter = self._waiters.popleft()
+
+            if not waiter.done():
+                self._slots.add(waiting_guild_id)
+                waiter.set_result(None)
+
+    def track(self, process: subprocess.Popen, guild_id: int) -> None:
+        """Start tracking ffmpeg process of server"""
+
+        with self._lock:
+            self._processes[process.pid] = _Process(process, guild_id)
+
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name='ffmpeg-supervisor', daemon=True)
+                self._sampler.start()
+
+    def kill_guild(self, guild_id: int) -> int:
+        """
+        Free playback slot of server and kill its ffmpeg processes that are left.
+
+        :returns: Count of killed processes
+        """
+
+        self.release(guild_id)
+
+        with self._lock:
+            processes = [p for p in self._processes.values() if p.guild_id == guild_id]
+
+        killed = 0
+        for proc in processes:
+            if proc.process.poll() is None:
+                _logger.info('Killing leftover ffmpeg process %s of server %s', proc.process.pid, guild_id)
+                proc.process.kill()
+                killed += 1
+
+        return killed
+
+    def processes(self) -> list[dict[str, any]]:
+        """Get state of tracked processes"""
+
+        with self._lock:
+            return [{
+                'pid': pid,
+                'guild_id': p.guild_id,
+                'cpu_percent': p.cpu_percent,
+                'rss': p.rss,
+            } for pid, p in self._processes.items()]
+
+    def sample(self) -> None:
+        """Reap exited processes, update CPU and memory usage, kill orphaned processes"""
+
+        with self._lock:
+            processes = list(self._processes.items())
+
+        now = time.monotonic()
+
+        for pid, proc in processes:
+            # Reaps zombie if process has exited
+            if proc.process.poll() is not None:
+                with self._lock:
+                    self._processes.pop(pid, None)
+                continue
+
+            usage = _read_usage(pid)
+            if usage is not None:
+                cpu_time, rss = usage
+                elapsed = now - proc.sampled_at
+                if elapsed > 0 and proc.cpu_time:
+                    proc.cpu_percent = (cpu_time - proc.cpu_time) / elapsed * 100
+                proc.cpu_time, proc.rss, proc.sampled_at = cpu_time, rss, now
+
+            # Process is left after disconnect or failed cleanup
+            if proc.guild_id in self._slots:
+                proc.orphaned_at = None
+            elif proc.orphaned_at is None:
+                proc.orphaned_at = now
+            elif now - proc.orphaned_at > self.ORPHAN_GRACE:
+                _logger.warning('Killing orphaned ffmpeg process %s of server %s', pid, proc.guild_id)
+                proc.process.kill()
+
+    def _sample_loop(self) -> None:
+        while True:
+            time.sleep(self.sample_interval)
+
+            try:
+                self.sample()
+            except Exception:
+                _logger.exception('Failed to sample ffmpeg processes')
+
+    def _total(self, attr: str) -> float:
+        with self._lock:
+            return sum(getattr(p, attr) for p in self._processes.values())
+
+
+def _read_usage(pid: int) -> tuple[float, int] | None:
+    """Get (CPU time in seconds, resident memory size in bytes) of process from procfs"""
+
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Process name can contain spaces, so fields are counted from its end
+            stat = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss = int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+    # utime and stime are 14th and 15th fields, state is 3rd
+    return (int(stat[11]) + int(stat[12])) / _CLOCK_TICKS, rss
+
+
+supervisor = FFmpegSupervisor(
+    max_slots=int(os.getenv('FFMPEG_MAX_PLAYING')),
+    queue_limit=int(os.getenv('FFMPEG_QUEUE_LIMIT')),
+    queue_timeout=int(os.getenv('FFMPEG_QUEUE_TIMEOUT')),
+    sample_interval=int(os.getenv('FFMPEG_SAMPLE_INTERVAL')),
+)
+"Supervisor of all playback ffmpeg processes"
+
+metrics.gauge('ffmpeg.processes', lambda: len(supervisor._processes))
+metrics.gauge('ffmpeg.playing_guilds', lambda: len(supervisor._slots))
+metrics.gauge('ffmpeg.waiting_guilds', lambda: len(supervisor._waiters))
+metrics.gauge('ffmpeg.cpu_percent', lambda: supervisor._total('cpu_percent'))
+metrics.gauge('ffmpeg.rss_bytes', lambda: supervisor._total('rss'))
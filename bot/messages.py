@@ -0,0 +1,231 @@
+"""
+Module with scheduler of outbound messages, paced by Discord rate limits of channels
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+
+from bot import metrics
+
+_logger = logging.getLogger(__name__)
+
+_queue_wait = metrics.histogram('messages.queue_wait_seconds')
+"Time messages spend in channel queue"
+
+
+class OutgoingMessage:
+    """Message queued by `MessageScheduler`. Awaiting it gives sent `discord.Message`"""
+
+    def __init__(self, scheduler: 'MessageScheduler', channel, content: str, status: bool) -> None:
+        self.scheduler = scheduler
+        "Scheduler that sends message"
+        self.channel = channel
+        "Channel the message is sent to"
+        self.content = content
+        "Message text"
+        self.status = status
+        "Can message be merged with other status messages if channel is backlogged"
+        self.group: list[OutgoingMessage] = [self]
+        "Messages sent as one Discord message together with this one"
+        self.sent = False
+        "Was message taken from queue to be sent"
+        self.queued_at = time.perf_counter()
+        "Timestamp when message was queued"
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._future.add_done_callback(_log_error)
+
+    def __await__(self):
+        return asyncio.shield(self._future).__await__()
+
+    def edit(self, content: str) -> asyncio.Future:
+        """
+        Replace message text. If message wasn't sent yet, it's sent with new text
+        instead, without extra request. Returned future gives edited `discord.Message`
+        """
+        return self.scheduler.edit(self, content)
+
+
+@dataclass
+class _Edit:
+    """Queued edit of sent message"""
+
+    message: OutgoingMessage
+    "Edited message"
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    "Future with edited `discord.Message`"
+
+
+class _Channel:
+    """Queue and rate bucket of channel"""
+
+    def __init__(self, rate: int) -> None:
+        self.queue: deque[OutgoingMessage | _Edit] = deque()
+        "Queued messages and edits"
+        self.tokens = float(rate)
+        "Count of requests that can be made now"
+        self.updated_at = time.monotonic()
+        "Timestamp when tokens were last refilled"
+        self.task: asyncio.Task | None = None
+        "Task sending queued messages"
+
+
+class MessageScheduler:
+    """
+    Sends messages to channels in order, through a queue per channel.
+
+    Each channel has a token bucket of `RATE` requests per `PERIOD` seconds, like
+    Discord limits messages in a channel, so busy channels wait in their own queue
+    instead of hitting rate limits, which would also delay other channels. If channel
+    is backlogged, consecutive status messages in its queue are sent as one message.
+    Messages can be edited in place, which is free if they weren't sent yet.
+    Must only be used from event loop.
+    """
+
+    RATE = 5
+    "Count of messages and edits that can be sent to channel per `PERIOD`"
+    PERIOD = 5.0
+    "Period of channel rate bucket (in seconds)"
+    MAX_LENGTH = 2000
+    "Max length of Discord message"
+
+    def __init__(self) -> None:
+        self._channels: dict[int, _Channel] = {}
+        self.merged = 0
+        "Count of status messages merged into previous ones"
+
+        metrics.gauge('messages.queued', lambda: sum(len(channel.queue) for channel in self._channels.values()))
+        metrics.gauge('messages.merged', lambda: self.merged)
+
+    def send(self, channel, content: str, status: bool = False) -> OutgoingMessage:
+        """
+        Queue message to channel.
+
+        :param channel: `discord.abc.Messageable` to send message to
+        :param content: Message text
+        :param status: Can message be merged with other status messages if channel is backlogged
+        """
+
+        message = OutgoingMessage(self, channel, content, status)
+        self._enqueue(channel, message)
+        return message
+
+    def edit(self, message: OutgoingMessage, content: str) -> asyncio.Future:
+        """
+        Replace text of queued or sent message. Returned future gives edited `discord.Message`.
+        If message was merged with others and new text doesn't fit in it, text is sent as new message
+        """
+
+        # Queued message is sent with new text
+        if not message.sent:
+            message.content = content
+            return asyncio.shield(message._future)
+
+        length = sum(len(queued.content) + 1 for queued in message.group) - 1 - len(message.content) + len(content)
+        if len(message.group) > 1 and length > self.MAX_LENGTH:
+            return asyncio.shield(self.send(message.channel, content, message.status)._future)
+
+        message.content = content
+        edit = _Edit(message.group[0])
+        edit.future.add_done_callback(_log_error)
+        self._enqueue(message.channel, edit)
+        return asyncio.shield(edit.future)
+
+    def _enqueue(self, channel, item: OutgoingMessage | _Edit) -> None:
+        state = self._channels.get(channel.id)
+        if state is None:
+            state = self._channels[channel.id] = _Channel(self.RATE)
+
+        state.queue.append(item)
+        if state.task is None:
+            state.task = asyncio.create_task(self._run(channel, state))
+
+    async def _run(self, channel, state: _Channel) -> None:
+        """Send queued messages of channel"""
+
+        while state.queue:
+            await self._take_token(state)
+            item = state.queue.popleft()
+
+            if isinstance(item, _Edit):
+                await self._send_edit(channel, state, item)
+            else:
+                await self._send(channel, state, item)
+
+        state.task = None
+        # Bucket is kept until it refills, so next messages don't exceed the limit
+        asyncio.get_running_loop().call_later(self.PERIOD, self._forget, channel.id, state)
+
+    def _forget(self, channel_id: int, state: _Channel) -> None:
+        if state.task is None and self._channels.get(channel_id) is state:
+            del self._channels[channel_id]
+
+    async def _take_token(self, state: _Channel) -> None:
+        """Wait until request can be made to channel"""
+
+        while True:
+            now = time.monotonic()
+            state.tokens = min(self.RATE, state.tokens + (now - state.updated_at) * self.RATE / self.PERIOD)
+            state.updated_at = now
+
+            if state.tokens >= 1:
+                state.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - state.tokens) * self.PERIOD / self.RATE)
+
+    async def _send(self, channel, state: _Channel, message: OutgoingMessage) -> None:
+        """Send message, merged with following status messages if they are waiting too"""
+
+        group = [message]
+        if message.status:
+            length = len(message.content)
+            while state.queue and isinstance(state.queue[0], OutgoingMessage) and state.queue[0].status \
+                    and length + 1 + len(state.queue[0].content) <= self.MAX_LENGTH:
+                group.append(state.queue.popleft())
+                length += 1 + len(group[-1].content)
+
+        self.merged += len(group) - 1
+        now = time.perf_counter()
+        for queued in group:
+            queued.group = group
+            queued.sent = True
+            _queue_wait.observe(now - queued.queued_at)
+
+        try:
+            sent = await channel.send('\n'.join(queued.content for queued in group))
+        except Exception as e:
+            for queued in group:
+                queued._future.set_exception(e)
+        else:
+            for queued in group:
+                queued._future.set_result(sent)
+
+    async def _send_edit(self, channel, state: _Channel, edit: _Edit) -> None:
+        """Edit sent message to current text of its group"""
+
+        # Later edits of the same message are covered by this one
+        edits = [edit] + [item for item in state.queue if isinstance(item, _Edit) and item.message is edit.message]
+        for item in edits[1:]:
+            state.queue.remove(item)
+
+        try:
+            sent = await edit.message._future
+            await sent.edit(content='\n'.join(queued.content for queued in edit.message.group))
+        except Exception as e:
+            for item in edits:
+                item.future.set_exception(e)
+        else:
+            for item in edits:
+                item.future.set_result(sent)
+
+
+def _log_error(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        _logger.warning('Failed to send message: %s', future.exception())
+
+
+scheduler = MessageScheduler()
+"Scheduler of all outbound messages"
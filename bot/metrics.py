@@ -0,0 +1,151 @@
+"""
+Module with simple in-process metrics
+"""
+
+import os
+import json
+import time
+import bisect
+import asyncio
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"Default histogram bucket upper bounds (in seconds)"
+
+
+class Histogram:
+    """Thread-safe histogram with fixed buckets"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """
+        :param buckets: Sorted bucket upper bounds
+        """
+
+        self.buckets = buckets
+        "Sorted bucket upper bounds"
+        self._counts = [0] * (len(buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Register value"""
+
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    def snapshot(self) -> dict[str, any]:
+        """Get histogram state"""
+
+        with self._lock:
+            return {
+                'count': self._count,
+                'sum': self._sum,
+                'max': self._max,
+                'buckets': dict(zip((*self.buckets, float('inf')), self._counts)),
+            }
+
+
+class Gauge:
+    """Value that can go up and down, or be computed on demand"""
+
+    def __init__(self, func: callable = None) -> None:
+        """
+        :param func: Function returning current value. If not set, value is set manually
+        """
+
+        self._func = func
+        self._value = 0
+
+    def set(self, value: float) -> None:
+        """Set value"""
+        self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        """Increase value"""
+        self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        """Decrease value"""
+        self._value -= amount
+
+    @property
+    def value(self) -> float:
+        """Current value"""
+        return self._func() if self._func is not None else self._value
+
+    def snapshot(self) -> float:
+        """Get gauge state"""
+        return self.value
+
+
+_registry: dict[str, Histogram | Gauge] = {}
+"Name to metric mapping"
+_export_task: asyncio.Task | None = None
+
+
+def histogram(name: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    """Get histogram by name, creating it if needed"""
+
+    metric = _registry.get(name)
+    if metric is None:
+        metric = _registry[name] = Histogram(buckets)
+
+    return metric
+
+
+def gauge(name: str, func: callable = None) -> Gauge:
+    """Get gauge by name, creating it if needed"""
+
+    metric = _registry.get(name)
+    if metric is None:
+        metric = _registry[name] = Gauge(func)
+
+    return metric
+
+
+def snapshot() -> dict[str, any]:
+    """Get state of all metrics"""
+    return {name: metric.snapshot() for name, metric in _registry.items()}
+
+
+def write(path: str) -> None:
+    """Write state of all metrics to JSON file. File is replaced atomically, so it can be read at any time"""
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump({'time': time.time(), 'pid': os.getpid(), 'metrics': snapshot()}, f)
+
+    os.replace(tmp_path, path)
+
+
+def start_export(path: str, interval: float) -> None:
+    """
+    Start writing metrics to file every `interval` seconds. Does nothing if already started.
+
+    File is written from event loop, so it stops being updated when event loop hangs.
+    """
+
+    global _export_task
+
+    if _export_task is None or _export_task.done():
+        os.makedirs(os.path.dirname(os.path.join('.', path)), exist_ok=True)
+        _export_task = asyncio.create_task(_run_export(path, interval))
+
+
+async def _run_export(path: str, interval: float) -> None:
+    while True:
+        try:
+            write(path)
+        except Exception:
+            _logger.exception('Failed to write metrics')
+
+        await asyncio.sleep(interval)
@@ -0,0 +1,143 @@
+"""
+Module for saving queues to database, so playback can be resumed after restart
+"""
+
+import time
+import asyncio
+from dataclasses import replace
+
+from settings import SHARD_IDS
+from bot.schemas import AudioSource, PlaybackState, QueueChanges
+from bot.sharding import get_process_name
+
+
+HEARTBEAT_KEY = 'playback_heartbeat' if SHARD_IDS is None else f'playback_heartbeat:{get_process_name()}'
+"Database metadata key of last save timestamp. Each process of sharded bot has its own"
+
+
+class QueueJournal:
+    """
+    Collects queue changes and saves them to database in batches.
+
+    Queue items are saved as rows keyed by sequence number, so adding or removing
+    audio at queue ends writes one row instead of the whole queue. Changes are
+    coalesced until `flush`: audio added and played between two flushes is never written.
+    Must only be used from event loop.
+    """
+
+    database: 'AsyncBotDatabase | None' = None
+    "Bot database. Changes are not recorded until it's set"
+
+    def __init__(self) -> None:
+        self._changes: dict[int, QueueChanges] = {}
+        "Server ID to unsaved changes mapping"
+        self._states: dict[int, PlaybackState] = {}
+        "Server ID to playback state mapping of servers that play something"
+        self._closed = False
+        self._task: asyncio.Task | None = None
+
+    @property
+    def recording(self) -> bool:
+        """Are changes recorded"""
+        return self.database is not None and not self._closed
+
+    def _get_changes(self, guild_id: int) -> QueueChanges:
+        changes = self._changes.get(guild_id)
+        if changes is None:
+            changes = self._changes[guild_id] = QueueChanges(guild_id)
+        return changes
+
+    def insert(self, guild_id: int, seq: int, audio: AudioSource) -> None:
+        """Record audio added to queue"""
+        if self.recording:
+            self._get_changes(guild_id).items[seq] = audio
+
+    def delete(self, guild_id: int, seq: int) -> None:
+        """Record audio removed from queue"""
+        if self.recording:
+            self._get_changes(guild_id).items[seq] = None
+
+    def clear(self, guild_id: int) -> None:
+        """Record removal of all audio from queue"""
+
+        if self.recording:
+            changes = self._get_changes(guild_id)
+            changes.cleared = True
+            changes.items.clear()
+
+    def set_current(self, guild_id: int, audio: AudioSource | None, on_replay: bool) -> None:
+        """Record change of current audio or replay flag"""
+
+        if not self.recording:
+            return
+
+        state = self._states.get(guild_id)
+
+        if audio is None:
+            self._states.pop(guild_id, None)
+        elif state is None or state.current is not audio:
+            self._states[guild_id] = PlaybackState(guild_id, audio, on_replay,
+                                                   state.channel_id if state else None, 0.0, time.time())
+        else:
+            state.on_replay = on_replay
+
+        changes = self._get_changes(guild_id)
+        changes.state_changed = True
+
+    def set_position(self, guild_id: int, channel_id: int, position: float) -> None:
+        """Record start of current audio playback from `position` (in seconds)"""
+
+        state = self._states.get(guild_id)
+
+        if self.recording and state is not None:
+            state.channel_id = channel_id
+            state.position = position
+            state.position_at = time.time()
+            self._get_changes(guild_id).state_changed = True
+
+    def forget(self, guild_id: int) -> None:
+        """Record removal of queue and playback state"""
+
+        if self.recording:
+            self.clear(guild_id)
+            self._states.pop(guild_id, None)
+            self._get_changes(guild_id).state_changed = True
+
+    def flush(self) -> None:
+        """Save collected changes to database"""
+
+        if not self.recording or not (self._changes or self._states):
+            return
+
+        changes, self._changes = self._changes, {}
+
+        for guild_changes in changes.values():
+            if guild_changes.state_changed:
+                state = self._states.get(guild_changes.guild_id)
+                # Copy, so state isn't changed while it's being saved
+                guild_changes.state = replace(state) if state is not None else None
+
+        # Heartbeat tells how long audio played after last position change
+        heartbeat = time.time() if self._states else None
+
+        self.database.write_nowait(self.database.repository.save_queue_changes, list(changes.values()), heartbeat)
+
+    def start(self, interval: float) -> None:
+        """Start saving changes every `interval` seconds. Does nothing if already started"""
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def close(self) -> None:
+        """Save collected changes and stop recording, so queues destroyed on shutdown stay saved"""
+
+        self.flush()
+        self._closed = True
+
+        if self._task is not None:
+            self._task.cancel()
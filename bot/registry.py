@@ -0,0 +1,167 @@
+"""
+Module with registry of per-server state
+"""
+
+import time
+import asyncio
+import logging
+from collections.abc import Callable
+
+from bot import metrics
+
+_logger = logging.getLogger(__name__)
+
+EVICTION_INTERVAL = 60
+"Interval between idle entry checks (in seconds)"
+
+
+class GuildRegistry:
+    """
+    Server ID to state mapping with eviction of idle entries.
+
+    Entry is evicted if it wasn't accessed for `idle_timeout` seconds and `is_idle`
+    returns True for it. Removed and evicted values are passed to `on_remove`.
+    All registries are evicted together by `start_eviction` and cleared by `remove_guild`.
+    Must only be used from event loop.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            idle_timeout: float,
+            factory: Callable[[int], any] = None,
+            is_idle: Callable[[any], bool] = None,
+            on_remove: Callable[[any], None] = None,
+    ) -> None:
+        """
+        :param name: Registry name, used in metrics
+        :param idle_timeout: Time after last access (in seconds) after which entry can be evicted
+        :param factory: Function creating state for server ID. If not set, states are added with `set`
+        :param is_idle: Function checking that state can be evicted. If not set, any state can be
+        :param on_remove: Function called with state when it's removed or evicted
+        """
+
+        self.name = name
+        "Registry name"
+        self.idle_timeout = idle_timeout
+        "Time after last access (in seconds) after which entry can be evicted"
+        self._factory = factory
+        self._is_idle = is_idle
+        self._on_remove = on_remove
+        self._entries: dict[int, any] = {}
+        "Server ID to state mapping"
+        self._accessed: dict[int, float] = {}
+        "Server ID to last access timestamp mapping"
+
+        _registries.append(self)
+        metrics.gauge(f'registry.{name}.entries', lambda: len(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._entries
+
+    def get(self, guild_id: int) -> any:
+        """
+        Get state of server, creating it if needed.
+
+        :raises KeyError: If state doesn't exist and registry has no factory
+        """
+
+        value = self._entries.get(guild_id)
+
+        if value is None:
+            if self._factory is None:
+                raise KeyError(guild_id)
+            value = self._entries[guild_id] = self._factory(guild_id)
+
+        self._accessed[guild_id] = time.monotonic()
+        return value
+
+    def set(self, guild_id: int, value: any) -> None:
+        """Set state of server, removing previous one"""
+
+        if self._entries.get(guild_id) is not value:
+            self.remove(guild_id)
+
+        self._entries[guild_id] = value
+        self._accessed[guild_id] = time.monotonic()
+
+    def peek(self, guild_id: int) -> any:
+        """Get state of server without creating it or marking it as accessed. Returns None if it doesn't exist"""
+        return self._entries.get(guild_id)
+
+    def remove(self, guild_id: int) -> any:
+        """Remove state of server. Returns removed state, or None if it didn't exist"""
+
+        value = self._entries.pop(guild_id, None)
+        self._accessed.pop(guild_id, None)
+
+        if value is not None and self._on_remove is not None:
+            self._on_remove(value)
+
+        return value
+
+    def evict_idle(self) -> int:
+        """
+        Remove entries that weren't accessed for `idle_timeout` seconds and are idle.
+
+        :returns: Count of evicted entries
+        """
+
+        deadline = time.monotonic() - self.idle_timeout
+        expired = [guild_id for guild_id, accessed in self._accessed.items() if accessed < deadline]
+        evicted = 0
+
+        for guild_id in expired:
+            if self._is_idle is None or self._is_idle(self._entries[guild_id]):
+                self.remove(guild_id)
+                evicted += 1
+
+        return evicted
+
+
+_registries: list[GuildRegistry] = []
+"All created registries"
+_eviction_task: asyncio.Task | None = None
+
+
+def remove_guild(guild_id: int) -> None:
+    """Remove all state of server, e.g. when bot was removed from it"""
+
+    for reg in _registries:
+        reg.remove(guild_id)
+
+
+def evict_idle() -> int:
+    """
+    Evict idle entries from all registries.
+
+    :returns: Count of evicted entries
+    """
+
+    return sum(reg.evict_idle() for reg in _registries)
+
+
+def start_eviction() -> None:
+    """Start evicting idle entries periodically. Does nothing if already started"""
+
+    global _eviction_task
+
+    if _eviction_task is None or _eviction_task.done():
+        _eviction_task = asyncio.create_task(_run_eviction())
+
+
+async def _run_eviction() -> None:
+    while True:
+        await asyncio.sleep(EVICTION_INTERVAL)
+
+        try:
+            evicted = evict_idle()
+        except Exception:
+            _logger.exception('Failed to evict idle server state')
+            continue
+
+        if evicted:
+            _logger.debug('Evicted %s idle server state entries', evicted)
@@ -0,0 +1,143 @@
+"""
+Module for resuming playback after restart
+"""
+
+import os
+import asyncio
+import logging
+
+from discord import Guild, ClientException
+from discord.ext.commands import Bot
+
+from settings import SHARD_COUNT, SHARD_IDS
+from bot import ffmpeg
+from bot.audio import AudioQueue, AudioController, queue_journal
+from bot.data import database
+from bot.schemas import PlaybackState
+from bot.sharding import is_own_guild
+from bot.utils.discord_utils import is_users_in_channel
+
+_logger = logging.getLogger(__name__)
+
+_resumed = False
+"Was playback already resumed, as `on_ready` can be called multiple times"
+
+
+async def resume_playback(bot: Bot) -> int:
+    """
+    Rejoin voice channels and resume playback that was interrupted by restart.
+
+    Servers are resumed `RESUME_CONCURRENCY` at a time, and voice connections are
+    started at least `RESUME_INTERVAL_MS` apart, so resuming many servers doesn't flood
+    yt-dlp and voice gateway. Does nothing if called again.
+
+    :returns: Count of resumed servers
+    """
+
+    global _resumed
+
+    if _resumed:
+        return 0
+    _resumed = True
+
+    states, heartbeat = await database.get_playback_states()
+    # Servers of other shards are resumed by their processes
+    states = [state for state in states if is_own_guild(state.guild_id)]
+    await database.delete_orphan_queue_items(SHARD_COUNT, SHARD_IDS)
+
+    if not states:
+        return 0
+
+    _logger.info('Resuming playback on %s servers', len(states))
+
+    limit = asyncio.Semaphore(int(os.getenv('RESUME_CONCURRENCY')))
+    connect_lock = asyncio.Lock()
+    interval = int(os.getenv('RESUME_INTERVAL_MS')) / 1000
+
+    async def _resume_one(state: PlaybackState) -> bool:
+        async with limit:
+            # Space out voice connections
+            async with connect_lock:
+                await asyncio.sleep(interval)
+
+            try:
+                return await _resume_guild(bot.get_guild(state.guild_id), state, heartbeat)
+            except Exception:
+                _logger.exception('Failed to resume playback on server %s', state.guild_id)
+                queue_journal.forget(state.guild_id)
+                return False
+
+    results = await asyncio.gather(*map(_resume_one, states))
+    _logger.info('Resumed playback on %s servers', sum(results))
+    return sum(results)
+
+
+async def _resume_guild(guild: Guild | None, state: PlaybackState, heartbeat: float | None) -> bool:
+    """Resume playback on server. Returns False if playback can't be resumed"""
+
+    channel = guild.get_channel(state.channel_id) if guild is not None and state.channel_id else None
+
+    # Nobody to play for
+    if channel is None or not is_users_in_channel(channel):
+        queue_journal.forget(state.guild_id)
+        return False
+
+    queue = AudioQueue.get_queue(guild.id)
+
+    # Somebody started playing again before server was resumed
+    if queue.current is not None or len(queue) != 0:
+        return False
+
+    items = await database.get_queue_items(guild.id)
+    played = _get_played(state, heartbeat)
+    position = state.position
+
+    # Current audio had ended before restart
+    if played is None:
+        position = played = 0.0
+        if not state.on_replay:
+            if not items:
+                queue_journal.forget(guild.id)
+                return False
+            state.current = items.pop(0)
+
+    try:
+        await ffmpeg.supervisor.admit(guild.id)
+    except ffmpeg.PlaybackBusyError:
+        queue_journal.forget(guild.id)
+        return False
+
+    try:
+        voice_client = guild.voice_client or await channel.connect()
+    except (ClientException, asyncio.TimeoutError):
+        ffmpeg.supervisor.release(guild.id)
+        raise
+
+    # Rebuild queue, it's saved again as it's rebuilt
+    queue.clear()
+    queue.extend([state.current, *items])
+    queue.on_replay = state.on_replay
+
+    await AudioController.get_controller(voice_client).resume(position, played)
+    return True
+
+
+def _get_played(state: PlaybackState, heartbeat: float | None) -> float | None:
+    """
+    Get time (in seconds) current audio played from `state.position` till bot was stopped.
+
+    Audio is considered playing from `position_at` till last save. Played time doesn't include
+    removed SponsorBlock segments, so it's converted to audio position when they are known.
+    Returns None if audio had ended.
+    """
+
+    played = 0.0
+    if heartbeat is not None and heartbeat > state.position_at:
+        played = heartbeat - state.position_at
+
+    # Segments only make audio end earlier
+    duration = getattr(state.current, 'duration', None)
+    if duration and state.position + played >= duration - 1:
+        return None
+
+    return played
@@ -2,11 +2,74 @@
 Module with all data schemas used in bot
 """
 
+import sys
 from asyncio import sleep
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from typing import Self
 
 
+class Template(str):
+    """
+    Localized text with format template parsed in advance, so `format` doesn't parse it again.
+
+    Parts are (literal text, field, conversion, format spec) tuples, where field is argument
+    index or name, or None after last literal. Templates with fields that aren't plain
+    indexes or names (e.g. `{0.title}`) have no parts and are formatted by `str.format`.
+    """
+
+    def __new__(cls, text: str, parts: tuple[tuple[str, int | str | None, str | None, str], ...] | None) -> 'Template':
+        template = super().__new__(cls, text)
+        template.parts = parts
+        template._printf, template._count = _to_printf(parts)
+        return template
+
+    def format(self, *args, **kwargs) -> str:
+        # Most templates take arguments in order, they are formatted by `%` operator in C
+        if self._printf is not None and not kwargs and len(args) == self._count:
+            return self._printf % args
+
+        if self.parts is None:
+            return str.format(self, *args, **kwargs)
+
+        result = []
+        for literal, field, conversion, spec in self.parts:
+            result.append(literal)
+            if field is None:
+                continue
+
+            value = args[field] if type(field) is int else kwargs[field]
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            result.append(value if spec == '' and type(value) is str else format(value, spec))
+
+        return ''.join(result)
+
+
+def _to_printf(parts: tuple | None) -> tuple[str | None, int]:
+    """
+    Convert parsed template to printf-style format and count of its arguments.
+    Returns None if template has format specs, or doesn't take arguments in order
+    """
+
+    if parts is None:
+        return None, 0
+
+    result = []
+    count = 0
+    for literal, field, conversion, spec in parts:
+        result.append(literal.replace('%', '%%'))
+        if field is None:
+            continue
+        if field != count or spec != '':
+            return None, 0
+        result.append('%' + (conversion or 's'))
+        count += 1
+
+    return ''.join(result), count
+
+
 class Language(dict):
     """
     Language dictionary wrapper.
@@ -16,7 +79,7 @@ class Language(dict):
 
     def __init__(
             self,
-            lang: dict[str, str] | None = None,
+            lang: dict[str, str | Template] | None = None,
             code: str | None = None
     ) -> None:
         """
@@ -78,27 +141,50 @@ class SpamState:
 
 
 @dataclass
+class SkipSegment:
+    """Audio segment to skip (SponsorBlock integration)"""
+
+    start: float
+    "Segment start in seconds"
+    end: float
+    "Segment end in seconds"
+    category: str
+    "SponsorBlock category (sponsor, intro, etc.)"
+
+
+@dataclass(slots=True)
 class AudioSource:
     """Base class for audio sources."""
 
     title: str
     "Audio title"
-    source_url: str
-    "Direct link to audio file, playble by `discord.FFmpegPCMAudio`"
+    source_url: str | None
+    "Direct link to audio file, playble by `discord.FFmpegPCMAudio`. None if not resolved yet"
+
+    @property
+    def is_resolved(self) -> bool:
+        """Is direct link to audio file known"""
+        return self.source_url is not None
 
     def serialize(self) -> dict[str, any]:
         """Serialize audio source to dictionary"""
-        return self.__dict__
+        return {f.name: getattr(self, f.name) for f in fields(self)}
 
     @classmethod
     def deserialize(cls, data: dict[str, any]) -> Self:
-        """Deserialize audio source from dictionary"""
-        return cls(**data)
+        """Deserialize audio source from dictionary. Unknown keys, like removed fields, are ignored"""
+        names = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in names})
 
 
-@dataclass
+@dataclass(slots=True)
 class YoutubeVideo(AudioSource):
-    """Class for storing information about YouTube video."""
+    """
+    Class for storing information about YouTube video.
+
+    Queues can hold many thousands of videos, so only fields needed for playback
+    and queue view are kept. Description and thumbnail aren't used, so they aren't stored.
+    """
 
     origin_query: str
     "Original search query"
@@ -107,15 +193,15 @@ class YoutubeVideo(AudioSource):
     title: str
     "Video title"
     author: str
-    "Video author"
-    description: str
-    "Video description"
+    "Video author. Interned, as many videos share few authors"
     duration: int
     "Video duration in seconds"
-    duration_str: str
-    "Video duration in format `MM:SS` / `HH:MM:SS` / `DD:HH:MM:SS`"
-    thumbnail: str
-    "Link to video thumbnail"
+    acodec: str | None = None
+    "Audio codec of direct link (e.g. `opus`), None if unknown"
+
+    def __post_init__(self) -> None:
+        if self.author is not None:
+            self.author = sys.intern(self.author)
 
     @staticmethod
     def from_ydl(vid_info: dict[str, any]) -> 'YoutubeVideo':
@@ -127,13 +213,69 @@ class YoutubeVideo(AudioSource):
             id=vid_info.get('id'),
             title=vid_info.get('title'),
             author=vid_info.get('uploader'),
-            description=vid_info.get('description'),
             duration=vid_info.get('duration'),
-            duration_str=vid_info.get('duration_string'),
-            thumbnail=vid_info.get('thumbnail'),
+            acodec=vid_info.get('acodec'),
+        )
+
+    @staticmethod
+    def from_ydl_flat(entry: dict[str, any]) -> 'YoutubeVideo':
+        """Create unresolved video (without direct link) from flat playlist entry"""
+
+        return YoutubeVideo(
+            source_url=None,
+            origin_query=entry.get('url'),
+            id=entry.get('id'),
+            title=entry.get('title'),
+            author=entry.get('uploader') or entry.get('channel'),
+            duration=entry.get('duration'),
         )
 
     @property
     def url(self) -> str:
         """Video URL"""
         return f'https://www.youtube.com/watch?v={self.id}'
+
+    @property
+    def duration_str(self) -> str | None:
+        """Video duration in format `M:SS` / `H:MM:SS`, None if unknown"""
+
+        if self.duration is None:
+            return None
+
+        minutes, seconds = divmod(int(self.duration), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f'{hours}:{minutes:02}:{seconds:02}' if hours else f'{minutes}:{seconds:02}'
+
+
+@dataclass
+class PlaybackState:
+    """Playback state of server, saved to resume playback after restart"""
+
+    guild_id: int
+    "Server ID"
+    current: AudioSource
+    "Current audio"
+    on_replay: bool = False
+    "Audio replay flag"
+    channel_id: int | None = None
+    "ID of voice channel bot plays in"
+    position: float = 0.0
+    "Playback position of current audio at `position_at` (in seconds)"
+    position_at: float = 0.0
+    "Timestamp when `position` was measured"
+
+
+@dataclass
+class QueueChanges:
+    """Unsaved changes of server queue"""
+
+    guild_id: int
+    "Server ID"
+    cleared: bool = False
+    "Were all saved queue items removed before applying `items`"
+    items: dict[int, AudioSource | None] = field(default_factory=dict)
+    "Sequence number to added audio mapping, None if audio was removed"
+    state_changed: bool = False
+    "Was playback state changed"
+    state: PlaybackState | None = None
+    "New playback state, None if nothing is playing"
@@ -0,0 +1,23 @@
+"""
+Module with helpers for bot run as several processes by `launcher.py`, each with its own shards
+"""
+
+from settings import SHARD_COUNT, SHARD_IDS
+
+
+def get_shard_id(guild_id: int, shard_count: int) -> int:
+    """Get ID of shard server belongs to, as Discord assigns it"""
+    return (guild_id >> 22) % shard_count
+
+
+def is_own_guild(guild_id: int) -> bool:
+    """Is server handled by this process. Always True if bot isn't sharded"""
+    return SHARD_IDS is None or get_shard_id(guild_id, SHARD_COUNT) in SHARD_IDS
+
+
+def get_process_name() -> str:
+    """Get name of this process, unique among processes of sharded bot"""
+
+    if SHARD_IDS is None:
+        return 'main'
+    return f'shards-{SHARD_COUNT}-' + '-'.join(map(str, SHARD_IDS))
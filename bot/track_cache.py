@@ -0,0 +1,191 @@
+"""
+Module with local on-disk cache of audio tracks
+"""
+
+import os
+import time
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+FILE_EXT = '.opus'
+"Extension of cached track files"
+PART_EXT = '.part'
+"Extension of track files being downloaded"
+
+
+class TrackCache:
+    """
+    Cache of popular tracks stored as Opus files, keyed by video ID.
+
+    Track is admitted after it was played `min_plays` times and downloaded in
+    background while it plays. Least recently played tracks are evicted
+    when cache size exceeds `max_bytes`. Thread-safe.
+
+    Directory can be shared by processes of sharded bot: downloads are written
+    to per-process files and moved into place atomically. Each process indexes
+    files on start, and treats files removed by another process as not cached.
+    """
+
+    MAX_DURATION = 20 * 60
+    "Tracks longer than this (in seconds) are not cached"
+    MAX_PLAY_COUNTERS = 10_000
+    "Max count of tracks whose play count is remembered"
+
+    def __init__(self, path: str, max_bytes: int, min_plays: int, ffmpeg_executable: str) -> None:
+        """
+        :param path: Cache directory
+        :param max_bytes: Max total size of cached files. 0 disables cache
+        :param min_plays: Count of plays after which track is cached
+        :param ffmpeg_executable: ffmpeg executable used for downloading
+        """
+
+        self.path = path
+        "Cache directory"
+        self.max_bytes = max_bytes
+        "Max total size of cached files"
+        self.min_plays = min_plays
+        "Count of plays after which track is cached"
+        self.ffmpeg_executable = ffmpeg_executable
+        "ffmpeg executable used for downloading"
+        self.size = 0
+        "Total size of cached files"
+        self._files: OrderedDict[str, int] = OrderedDict()
+        "Video ID to file size mapping, least recently played first"
+        self._plays: OrderedDict[str, int] = OrderedDict()
+        "Video ID to play count mapping"
+        self._downloading: set[str] = set()
+        "IDs of videos being downloaded"
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='track-cache')
+
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        """Is cache enabled"""
+        return self.max_bytes > 0
+
+    def _load(self) -> None:
+        """Index files that are already in cache directory"""
+
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+
+        # Downloads of other processes can be running, so only abandoned ones are removed
+        part_deadline = time.time() - self.MAX_DURATION - 60
+
+        for entry in os.scandir(self.path):
+            # Unfinished download
+            if entry.name.endswith(PART_EXT):
+                try:
+                    if entry.stat().st_mtime < part_deadline:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+            elif entry.name.endswith(FILE_EXT):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name.removesuffix(FILE_EXT), stat.st_size))
+
+        for _, video_id, size in sorted(files):
+            self._files[video_id] = size
+            self.size += size
+
+        self._evict()
+
+    def _file_path(self, video_id: str) -> str:
+        return os.path.join(self.path, video_id + FILE_EXT)
+
+    def get(self, video_id: str) -> str | None:
+        """Get path to cached track file and mark it as recently played, or None if it isn't cached"""
+
+        with self._lock:
+            if video_id not in self._files:
+                return None
+            self._files.move_to_end(video_id)
+
+        path = self._file_path(video_id)
+
+        # Persist recency, so it survives restart
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.size -= self._files.pop(video_id, 0)
+            return None
+
+        return path
+
+    def register_play(self, video_id: str, source_url: str, duration: int | None, acodec: str | None) -> None:
+        """Count track play and start caching it in background if it's popular enough"""
+
+        if not self.enabled or duration is None or duration > self.MAX_DURATION:
+            return
+
+        with self._lock:
+            plays = self._plays.get(video_id, 0) + 1
+            self._plays[video_id] = plays
+            self._plays.move_to_end(video_id)
+
+            while len(self._plays) > self.MAX_PLAY_COUNTERS:
+                self._plays.popitem(last=False)
+
+            if plays < self.min_plays or video_id in self._files or video_id in self._downloading:
+                return
+
+            self._downloading.add(video_id)
+
+        self._executor.submit(self._download, video_id, source_url, duration, acodec)
+
+    def _download(self, video_id: str, source_url: str, duration: int, acodec: str | None) -> None:
+        """Download track into cache"""
+
+        path = self._file_path(video_id)
+        part_path = f'{path}.{os.getpid()}{PART_EXT}'
+
+        # Opus stream is only remuxed
+        codec_args = ('-c:a', 'copy') if acodec == 'opus' else ('-c:a', 'libopus', '-b:a', '128k')
+
+        try:
+            subprocess.run(
+                [self.ffmpeg_executable, '-reconnect', '1', '-reconnect_streamed', '1',
+                 '-i', source_url, '-vn', '-map_metadata', '-1', *codec_args,
+                 '-f', 'opus', '-loglevel', 'error', '-y', part_path],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=duration + 60,
+                check=True,
+            )
+            os.replace(part_path, path)
+            size = os.path.getsize(path)
+        except (OSError, subprocess.SubprocessError) as e:
+            _logger.info('Failed to cache track %s: %s', video_id, e)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return
+        finally:
+            with self._lock:
+                self._downloading.discard(video_id)
+
+        with self._lock:
+            self._files[video_id] = size
+            self.size += size
+            self._evict()
+
+    def _evict(self) -> None:
+        """Remove least recently played tracks until cache fits into `max_bytes`. Lock must be held."""
+
+        while self.size > self.max_bytes and self._files:
+            video_id, size = self._files.popitem(last=False)
+            self.size -= size
+
+            try:
+                os.remove(self._file_path(video_id))
+            except FileNotFoundError:
+                pass
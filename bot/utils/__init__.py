@@ -2,20 +2,27 @@
 Module with various helper functions
 """
 
+import os
+import string
+import marshal
+import hashlib
 from ast import literal_eval
 from pathlib import Path
 from urllib.parse import urlparse
 
-import flatdict
-import yaml
+from bot.schemas import Language, Template
 
-from bot.schemas import Language
+LANG_CACHE_VERSION = 2
+"Version of compiled localization file format. Changing it invalidates cached files"
 
 
-def load_lang_file(path: str) -> Language:
+def load_lang_file(path: str, cache_dir: str | None = None) -> Language:
     """
     Load localization file in YAML format
 
+    If `cache_dir` is set, compiled file is cached there, and file is parsed
+    again only when its content changes. So YAML is parsed once, not on every start.
+
     ### Usage example::
 
         >>> lang = load_lang_file('langs/en.yaml')
@@ -25,20 +32,123 @@ def load_lang_file(path: str) -> Language:
         ... # unexisting_key (because key doesn't exist in dictionary)
 
     :param path: Path to file
+    :param cache_dir: Directory for compiled files
     """
 
     lang_code = Path(path).stem
 
-    with open(path, encoding='utf-8') as f:
+    if cache_dir is None:
+        with open(path, 'rb') as f:
+            return _make_language(_compile_lang(f.read(), lang_code), lang_code)
+
+    cache_path = os.path.join(cache_dir, lang_code + '.catalog')
+    cached = _read_lang_cache(cache_path)
+    mtime = os.stat(path).st_mtime_ns
+
+    # Modification time changes on checkout, so content hash is checked before parsing
+    if cached is not None and cached[0] == mtime:
+        data = cached[2]
+    else:
+        with open(path, 'rb') as f:
+            source = f.read()
+        digest = hashlib.sha256(source).digest()
+
+        data = cached[2] if cached is not None and cached[1] == digest else _compile_lang(source, lang_code)
+        _write_lang_cache(cache_path, (LANG_CACHE_VERSION, mtime, digest, data))
+
+    return _make_language(data, lang_code)
+
+
+def _make_language(data: dict[str, tuple[str, tuple | None]], lang_code: str) -> Language:
+    """Make language from compiled localization file"""
+    return Language(lang={key: Template(text, parts) for key, (text, parts) in data.items()}, code=lang_code)
+
+
+def _compile_lang(source: bytes, lang_code: str) -> dict[str, tuple[str, tuple | None]]:
+    """Parse localization file into flat dictionary of texts and their parsed format templates"""
+
+    # Only needed when file changes, so they don't slow down startup
+    import flatdict
+    import yaml
+
+    try:
+        data = yaml.load(source, Loader=yaml.FullLoader)
+        data_flat = dict(flatdict.FlatDict(data, delimiter='.'))
+    except (yaml.YAMLError, TypeError) as e:
+        raise SyntaxError('Invalid localization file format: %s' % lang_code) from e
+
+    compiled = {}
+
+    # Broken template would fail only when its message is sent
+    for key, value in data_flat.items():
         try:
-            data = yaml.load(f, Loader=yaml.FullLoader)
-            data_flat = flatdict.FlatDict(data, delimiter='.')
-        except (yaml.YAMLError, TypeError) as e:
-            raise SyntaxError('Invalid localization file format: %s' % lang_code) from e
+            compiled[key] = (value, _parse_template(value))
+        except (ValueError, TypeError) as e:
+            raise SyntaxError(f'Invalid template {key} in localization file: {lang_code}') from e
+
+    return compiled
+
+
+def _parse_template(template: str) -> tuple[tuple[str, int | str | None, str | None, str], ...] | None:
+    """
+    Parse format template into parts of `Template`.
+    Returns None if template has fields that can only be formatted by `str.format`
+
+    :raises ValueError: If template is invalid
+    """
+
+    parts = []
+    auto_index = 0
+
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        if field is None:
+            parts.append((literal, None, None, ''))
+            continue
+
+        # Attribute access, indexing and nested fields
+        if '.' in field or '[' in field or '{' in spec:
+            return None
+
+        if field == '':
+            if auto_index is None:
+                raise ValueError('Cannot switch from manual field numbering to automatic')
+            field = auto_index
+            auto_index += 1
+        elif field.isdigit():
+            if auto_index:
+                raise ValueError('Cannot switch from automatic field numbering to manual')
+            field = int(field)
+            auto_index = None
+
+        parts.append((literal, field, conversion, spec))
+
+    return tuple(parts)
 
-    lang = Language(lang=data_flat, code=lang_code)
 
-    return lang
+def _read_lang_cache(path: str) -> tuple[int, bytes, dict[str, str]] | None:
+    """Read compiled localization file. Returns modification time and hash of source, and its data"""
+
+    try:
+        with open(path, 'rb') as f:
+            version, mtime, digest, data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    return (mtime, digest, data) if version == LANG_CACHE_VERSION else None
+
+
+def _write_lang_cache(path: str, cached: tuple) -> None:
+    """Write compiled localization file. Does nothing if directory isn't writable"""
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(cached, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
 
 
 # def unescape_string(escaped_string: str) -> str:
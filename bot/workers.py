@@ -0,0 +1,250 @@
+"""
+Module with `YoutubeDL` extraction workers.
+
+Extraction runs in separate warm processes, so yt-dlp setup cost and memory
+growth don't affect the bot process. Run as `python -m bot.workers` to start a worker.
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import resource
+import threading
+import subprocess
+from abc import ABC, abstractmethod
+from multiprocessing.connection import Connection
+
+from yt_dlp import YoutubeDL
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"Project root directory, used as worker working directory"
+
+
+class ExtractionError(Exception):
+    """Raised when extraction failed"""
+
+
+class ExtractionTimeoutError(ExtractionError):
+    """Raised when extraction took longer than allowed"""
+
+
+class ExtractionWorkerError(ExtractionError):
+    """Raised when worker process died"""
+
+
+class Extractor(ABC):
+    """
+    Interface for running `YoutubeDL.extract_info` jobs.
+
+    Can be replaced with a fake implementation in tests.
+    """
+
+    @abstractmethod
+    def extract_info(self, url: str, options: dict[str, any]) -> dict[str, any]:
+        """
+        Get information about audio
+
+        :param url: Link or search query
+        :param options: `YoutubeDL` options
+
+        :raises ExtractionError: If extraction failed
+
+        :return: Sanitized result of `YoutubeDL().extract_info`
+        """
+
+    def start(self) -> None:
+        """Prepare extractor for jobs. Called on bot start, so first lookups don't wait for it"""
+
+    def close(self) -> None:
+        """Release extractor resources"""
+
+
+class LocalExtractor(Extractor):
+    """Extractor that runs `YoutubeDL` in current process"""
+
+    def extract_info(self, url: str, options: dict[str, any]) -> dict[str, any]:
+        try:
+            with YoutubeDL(options) as ydl:
+                return ydl.sanitize_info(ydl.extract_info(url, download=False))
+        except Exception as e:
+            raise ExtractionError(str(e)) from e
+
+
+class _Worker:
+    """Handle of worker process"""
+
+    def __init__(self, warm_options: dict[str, any]) -> None:
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'bot.workers', json.dumps(warm_options)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=_ROOT_DIR,
+        )
+        self._requests = Connection(os.dup(self._process.stdin.fileno()), readable=False)
+        self._responses = Connection(os.dup(self._process.stdout.fileno()), writable=False)
+        self._process.stdin.close()
+        self._process.stdout.close()
+
+        self.jobs = 0
+        "Count of finished jobs"
+        self.rss = 0
+        "Resident memory size of worker after last job (in bytes)"
+
+    def run(self, url: str, options: dict[str, any], timeout: float) -> dict[str, any]:
+        """Run extraction job in worker"""
+
+        try:
+            self._requests.send((url, options))
+            ready = self._responses.poll(timeout)
+        except OSError as e:
+            raise ExtractionWorkerError('Extraction worker is dead') from e
+
+        if not ready:
+            raise ExtractionTimeoutError(f'Extraction took longer than {timeout} s: {url}')
+
+        try:
+            ok, payload, self.rss = self._responses.recv()
+        except (OSError, EOFError) as e:
+            raise ExtractionWorkerError('Extraction worker is dead') from e
+
+        self.jobs += 1
+
+        if not ok:
+            raise ExtractionError(payload)
+
+        return payload
+
+    def kill(self) -> None:
+        """Kill worker process"""
+
+        self._requests.close()
+        self._responses.close()
+        self._process.kill()
+        self._process.wait()
+
+
+class ProcessExtractor(Extractor):
+    """
+    Extractor backed by pool of warm worker processes.
+
+    Workers are started by `start` or on first job, killed and respawned if job exceeds `job_timeout`
+    or worker dies, and recycled after `max_jobs` jobs or when RSS exceeds `max_rss`.
+    Thread-safe: each caller holds a worker for the job duration.
+    """
+
+    def __init__(
+            self,
+            size: int,
+            warm_options: dict[str, any],
+            job_timeout: float,
+            max_jobs: int,
+            max_rss: int,
+    ) -> None:
+        """
+        :param size: Count of worker processes
+        :param warm_options: `YoutubeDL` options to prepare instance with on worker start
+        :param job_timeout: Max job duration (in seconds)
+        :param max_jobs: Count of jobs after which worker is recycled
+        :param max_rss: Worker resident memory size after which it's recycled (in bytes)
+        """
+
+        self.warm_options = warm_options
+        "`YoutubeDL` options to prepare instance with on worker start"
+        self.job_timeout = job_timeout
+        "Max job duration (in seconds)"
+        self.max_jobs = max_jobs
+        "Count of jobs after which worker is recycled"
+        self.max_rss = max_rss
+        "Worker resident memory size after which it's recycled (in bytes)"
+        self.size = size
+        "Count of worker processes"
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        "Workers waiting for a job"
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start worker processes. Does nothing if already started"""
+
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+
+            for _ in range(self.size):
+                self._idle.put(_Worker(self.warm_options))
+
+        atexit.register(self.close)
+
+    def extract_info(self, url: str, options: dict[str, any]) -> dict[str, any]:
+        if not self._started:
+            self.start()
+
+        worker = self._idle.get()
+
+        try:
+            return worker.run(url, options, self.job_timeout)
+        except (ExtractionTimeoutError, ExtractionWorkerError):
+            worker.kill()
+            worker = _Worker(self.warm_options)
+            raise
+        finally:
+            if worker.jobs >= self.max_jobs or worker.rss >= self.max_rss:
+                worker.kill()
+                worker = _Worker(self.warm_options)
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+
+
+def _get_rss() -> int:
+    """Get resident memory size of current process (in bytes)"""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak value, but it's the best we have without procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_main(warm_options: dict[str, any]) -> None:
+    """Worker process loop: read jobs from stdin, write results to stdout"""
+
+    # yt-dlp prints to stdout, so move it away from response channel
+    responses = Connection(os.dup(sys.stdout.fileno()), readable=False)
+    requests = Connection(os.dup(sys.stdin.fileno()), writable=False)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    instances: dict[str, YoutubeDL] = {}
+    "Warm `YoutubeDL` instances by options"
+
+    # Prepare instance and YouTube extractor before first job
+    warm_ydl = YoutubeDL(warm_options)
+    warm_ydl.get_info_extractor('Youtube')
+    instances[json.dumps(warm_options, sort_keys=True)] = warm_ydl
+
+    while True:
+        try:
+            url, options = requests.recv()
+        except EOFError:
+            break
+
+        key = json.dumps(options, sort_keys=True)
+        ydl = instances.get(key)
+        if ydl is None:
+            ydl = instances[key] = YoutubeDL(options)
+
+        try:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+            responses.send((True, info, _get_rss()))
+        except Exception as e:
+            responses.send((False, str(e), _get_rss()))
+
+
+if __name__ == '__main__':
+    _worker_main(json.loads(sys.argv[1]))
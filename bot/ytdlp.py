@@ -2,14 +2,233 @@
 Module for working with YouTube, like searching videos, getting audio from videos, etc.
 """
 
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, fields, replace
+from itertools import islice
+
 import sponsorblock as sb
 
-from yt_dlp import YoutubeDL
 from settings import YDL_OPTIONS
-from bot.schemas import YoutubeVideo, AudioSource
+from bot.schemas import YoutubeVideo, AudioSource, SkipSegment
+from bot.cache import ResolverCache, SegmentCache, normalize_query, is_url_expired, is_playlist_url
+from bot.workers import Extractor, LocalExtractor, ProcessExtractor, ExtractionError
 
+_logger = logging.getLogger(__name__)
 _sb_client = sb.Client()
 
+extractor: Extractor
+"Extractor used for all lookups. Can be replaced with fake one in tests"
+if os.getenv('ENABLE_YTDLP_PROCESS_POOL').lower() == 'true':
+    extractor = ProcessExtractor(
+        size=int(os.getenv('YTDLP_WORKERS')),
+        warm_options=YDL_OPTIONS,
+        job_timeout=int(os.getenv('YTDLP_JOB_TIMEOUT')),
+        max_jobs=int(os.getenv('YTDLP_WORKER_MAX_JOBS')),
+        max_rss=int(os.getenv('YTDLP_WORKER_MAX_RSS_MB')) * 1024 * 1024,
+    )
+else:
+    extractor = LocalExtractor()
+
+cache = ResolverCache(int(os.getenv('YTDLP_CACHE_SIZE')))
+"Cache of lookup results"
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('YTDLP_WORKERS')),
+    thread_name_prefix='ytdlp'
+)
+"Executor for blocking `YoutubeDL` calls"
+_global_limit = asyncio.Semaphore(int(os.getenv('YTDLP_WORKERS')))
+"Limit of concurrent lookups for all servers"
+_guild_limits: dict[int | None, asyncio.Semaphore] = {}
+"Limits of concurrent lookups per server"
+_guild_searches: dict[int | None, set[asyncio.Task]] = {}
+"Pending (queued or running) lookups per server"
+_guild_playlists: dict[int | None, set[asyncio.Task]] = {}
+"Background playlist resolution tasks per server"
+
+PLAYLIST_CONCURRENCY = 2
+"Max count of concurrently resolved entries of one playlist"
+_background_limit = asyncio.Semaphore(max(1, int(os.getenv('YTDLP_WORKERS')) // 2))
+"Limit of concurrent background lookups, so they can't take all global slots"
+
+NEGATIVE_CACHE_TTL = 30
+"Time to remember failed lookups (in seconds), so they can't be retried in a tight loop"
+
+
+@dataclass
+class _Flight:
+    """Lookup shared by all callers with the same normalized query"""
+
+    task: asyncio.Task
+    "Lookup task"
+    waiters: int = 0
+    "Count of callers waiting for result"
+
+
+_flights: dict[str, _Flight] = {}
+"Normalized query to in-flight lookup mapping"
+_failures: dict[str, tuple[Exception, float]] = {}
+"Normalized query to (error, expiration timestamp) mapping of failed lookups"
+
+segment_cache = SegmentCache(int(os.getenv('YTDLP_CACHE_SIZE')))
+"Cache of SponsorBlock segments"
+_sb_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sponsorblock')
+"Executor for SponsorBlock lookups"
+_segment_lookups: dict[str, Future] = {}
+"Video ID to in-flight SponsorBlock lookup mapping"
+_segment_lookups_lock = threading.Lock()
+
+SEGMENTS_PREFETCH_LIMIT = 5
+"Max count of videos to look up segments for when they are enqueued"
+MIN_KEPT_INTERVAL = 1
+"Audio between segments shorter than this (in seconds) is removed too"
+
+
+class ResolverBusyError(Exception):
+    """Raised when too many lookups are already queued"""
+
+
+class SearchCancelledError(Exception):
+    """Raised when lookup was cancelled by `cancel_guild_searches`"""
+
+
+async def search_async(url_or_search: str, guild_id: int | None = None) -> list[AudioSource]:
+    """
+    Same as `search`, but runs on a bounded executor and doesn't block the event loop.
+
+    Lookups are limited globally (`YTDLP_WORKERS`) and per server (`YTDLP_GUILD_CONCURRENCY`).
+    Concurrent lookups of the same query share one extraction and its result or error.
+
+    :param url_or_search: Link to video or search query
+    :param guild_id: ID of server that requested the lookup
+
+    :raises ResolverBusyError: If too many lookups are queued
+    :raises SearchCancelledError: If lookup was cancelled by `cancel_guild_searches`
+
+    :returns: List of `AudioSource`
+    """
+
+    # Don't wait for a free slot if result is already cached
+    cached = cache.get(url_or_search)
+    if cached is not None:
+        return [cached]
+
+    key = normalize_query(url_or_search)
+    searches = _guild_searches.get(guild_id, set())
+
+    # Joining in-flight lookup costs nothing, so it's never rejected
+    if key not in _flights and (sum(map(len, _guild_searches.values())) >= int(os.getenv('YTDLP_QUEUE_LIMIT'))
+            or len(searches) >= int(os.getenv('YTDLP_GUILD_QUEUE_LIMIT'))):
+        raise ResolverBusyError(url_or_search)
+
+    # Server is stored only once its lookup is admitted, so rejected lookups leave nothing behind
+    searches = _guild_searches.setdefault(guild_id, searches)
+    task = asyncio.create_task(_join_search(key, url_or_search, guild_id))
+    searches.add(task)
+
+    try:
+        await asyncio.wait((task,))
+    finally:
+        task.cancel()
+        searches.discard(task)
+
+        # Forget server if it has no more lookups
+        if not searches:
+            _guild_searches.pop(guild_id, None)
+            _guild_limits.pop(guild_id, None)
+
+    if task.cancelled():
+        raise SearchCancelledError(url_or_search)
+
+    # Callers must not share playlist entries, they are resolved in place
+    return [replace(audio) for audio in task.result()]
+
+
+async def _join_search(key: str, url_or_search: str, guild_id: int | None) -> list[AudioSource]:
+    """Wait for shared lookup of query, starting it if needed"""
+
+    failure = _failures.get(key)
+    if failure is not None:
+        error, expires_at = failure
+        if expires_at > time.monotonic():
+            raise error
+        del _failures[key]
+
+    flight = _flights.get(key)
+    if flight is None:
+        flight = _Flight(asyncio.create_task(_run_search(url_or_search, guild_id)))
+        flight.task.add_done_callback(lambda task: _on_search_done(key, task))
+        _flights[key] = flight
+
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    finally:
+        flight.waiters -= 1
+
+        # Nobody needs the result anymore
+        if flight.waiters == 0 and not flight.task.done():
+            flight.task.cancel()
+            _forget_flight(key, flight.task)
+
+
+def _forget_flight(key: str, task: asyncio.Task) -> None:
+    """Remove shared lookup from in-flight mapping, unless it was already replaced by a new one"""
+
+    flight = _flights.get(key)
+    if flight is not None and flight.task is task:
+        del _flights[key]
+
+
+def _on_search_done(key: str, task: asyncio.Task) -> None:
+    """Finish shared lookup and remember its error, if any"""
+
+    _forget_flight(key, task)
+
+    if task.cancelled() or task.exception() is None:
+        return
+
+    now = time.monotonic()
+    for failed_key in [k for k, (_, expires_at) in _failures.items() if expires_at <= now]:
+        del _failures[failed_key]
+
+    _failures[key] = (task.exception(), now + NEGATIVE_CACHE_TTL)
+
+
+async def _run_search(url_or_search: str, guild_id: int | None) -> list[AudioSource]:
+    """Run `search` in executor, respecting concurrency limits"""
+
+    guild_limit = _guild_limits.get(guild_id)
+    if guild_limit is None:
+        guild_limit = asyncio.Semaphore(int(os.getenv('YTDLP_GUILD_CONCURRENCY')))
+        _guild_limits[guild_id] = guild_limit
+
+    # Acquire server slot first, so one server can't hold global slots while waiting
+    async with guild_limit, _global_limit:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, _resolve, url_or_search)
+
+
+def cancel_guild_searches(guild_id: int | None) -> int:
+    """
+    Cancel all pending lookups of server.
+
+    :returns: Count of cancelled lookups
+    """
+
+    searches = _guild_searches.get(guild_id, set())
+    playlists = _guild_playlists.get(guild_id, set())
+
+    for task in searches | playlists:
+        task.cancel()
+
+    return len(searches)
+
 
 def search(url_or_search: str) -> list[AudioSource]:
     """
@@ -23,27 +242,133 @@ def search(url_or_search: str) -> list[AudioSource]:
     :returns: List of `AudioSource`
     """
 
-    ydl_res = _search(url_or_search)
-    res = []
+    cached = cache.get(url_or_search)
+    if cached is not None:
+        return [cached]
+
+    return _resolve(url_or_search)
 
-    # if ydl_res.get('_type') == 'playlist':
-    #     for audio in ydl_res['entries']:
-    #         audio['original_url'] = ydl_res.get('original_url')
-    #         res.append(YoutubeVideo.from_ydl(audio))
-    # else:
-    #     res.append(YoutubeVideo.from_ydl(ydl_res))
 
-    if ydl_res['extractor'] == 'youtube':
-        res.append(YoutubeVideo.from_ydl(ydl_res))
+def _resolve(url_or_search: str) -> list[AudioSource]:
+    """Same as `search`, but always runs `YoutubeDL` lookup"""
+
+    # If only stream link is expired, refresh it by video link instead of searching again
+    stale = cache.get_metadata(url_or_search)
+    ydl_res = _search(stale.url if stale is not None else url_or_search)
+
+    if ydl_res.get('_type') == 'playlist':
+        entries = [entry for entry in ydl_res['entries'] if entry is not None]
     else:
-        res.append(AudioSource(
-            source_url=ydl_res.get('url'),
-            title=ydl_res.get('title'),
-        ))
+        entries = [ydl_res]
+
+    res = []
+    for entry in entries:
+        # Flat playlist entry, will be resolved later
+        if entry.get('_type') == 'url':
+            if entry.get('ie_key') == 'Youtube':
+                res.append(YoutubeVideo.from_ydl_flat(entry))
+        elif entry.get('extractor') == 'youtube':
+            res.append(YoutubeVideo.from_ydl(entry))
+        else:
+            res.append(AudioSource(
+                source_url=entry.get('url'),
+                title=entry.get('title'),
+            ))
+
+    if not res:
+        raise ExtractionError(f'Nothing found: {url_or_search}')
+
+    # Resolve first entry right away, so it can be played immediately
+    if not res[0].is_resolved:
+        resolve(res[0])
+
+    # Query is mapped to a video only if it isn't a playlist
+    if len(res) == 1 and isinstance(res[0], YoutubeVideo):
+        cache.put(url_or_search, res[0])
+    else:
+        for audio in res:
+            if isinstance(audio, YoutubeVideo) and audio.is_resolved:
+                cache.put(audio.url, audio)
 
     return res
 
 
+def resolve(video: YoutubeVideo) -> None:
+    """
+    Get stream link and full metadata of video in place.
+
+    Used for playlist entries and videos with expired stream link.
+
+    :raises ExtractionError: If video is unavailable
+    """
+
+    resolved = search(video.url)[0]
+
+    for field in fields(resolved):
+        if field.name != 'origin_query':
+            setattr(video, field.name, getattr(resolved, field.name))
+
+
+def ensure_resolved(audio: AudioSource) -> None:
+    """
+    Resolve audio if it's unresolved playlist entry or its stream link is expired.
+
+    Blocking, so it shouldn't be called from the event loop.
+
+    :raises ExtractionError: If audio is unavailable
+    """
+
+    if not isinstance(audio, YoutubeVideo):
+        return
+
+    if not audio.is_resolved or is_url_expired(audio.source_url):
+        resolve(audio)
+
+
+def resolve_in_background(sources: list[AudioSource], guild_id: int | None) -> None:
+    """
+    Resolve unresolved playlist entries in background with bounded parallelism.
+
+    Cancelled by `cancel_guild_searches`.
+    """
+
+    pending = [audio for audio in sources if isinstance(audio, YoutubeVideo) and not audio.is_resolved]
+    if not pending:
+        return
+
+    task = asyncio.create_task(_resolve_entries(pending))
+    tasks = _guild_playlists.setdefault(guild_id, set())
+    tasks.add(task)
+
+    def on_done(_):
+        tasks.discard(task)
+        if not tasks and _guild_playlists.get(guild_id) is tasks:
+            del _guild_playlists[guild_id]
+
+    task.add_done_callback(on_done)
+
+
+async def _resolve_entries(entries: list[YoutubeVideo]) -> None:
+    """Resolve playlist entries in order, `PLAYLIST_CONCURRENCY` at a time"""
+
+    loop = asyncio.get_running_loop()
+    entries_iter = iter(entries)
+
+    async def worker():
+        for entry in entries_iter:
+            async with _background_limit, _global_limit:
+                # Could be resolved on demand while waiting
+                if entry.is_resolved:
+                    continue
+
+                try:
+                    await loop.run_in_executor(_executor, resolve, entry)
+                except ExtractionError as e:
+                    _logger.info('Failed to resolve playlist entry %s: %s', entry.id, e)
+
+    await asyncio.gather(*(worker() for _ in range(PLAYLIST_CONCURRENCY)))
+
+
 def _search(url_or_search: str) -> dict[str, any]:
     """
     Get information about audio
@@ -51,64 +376,218 @@ def _search(url_or_search: str) -> dict[str, any]:
     :return: Result of `YoutubeDL().extract_info`
     """
 
-    with YoutubeDL(YDL_OPTIONS) as ydl:
-        ydl_res = ydl.extract_info(url_or_search, download=False)
+    options = YDL_OPTIONS
+
+    # Only list playlist entries, they are resolved separately
+    if is_playlist_url(url_or_search):
+        options = {**YDL_OPTIONS, 'extract_flat': 'in_playlist'}
 
-    return ydl_res
+    return extractor.extract_info(url_or_search, options)
 
 
-def get_skip_segments(video_id: str) -> list[sb.Segment] | None:
+async def get_direct_link(url: str, audio_only: bool = False) -> str:
+    """
+    Get direct link to video or audio file, without blocking the event loop.
+
+    :param url: Link to video
+    :param audio_only: Get link to audio instead of video
+
+    :returns: Direct link
+    """
+
+    _format = 'bestaudio' if audio_only else 'best*[acodec!=none]'
+
+    async with _global_limit:
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(_executor, extractor.extract_info, url, {'format': _format})
+
+    return info['url']
+
+
+def get_skip_segments(video_id: str) -> list[SkipSegment] | None:
     """
     Get segments to skip from video using SponsorBlock.
 
-    Used to skip sponsor inserts, intros, etc.
+    Used to skip sponsor inserts, intros, etc. Segments are cached. If they aren't
+    cached and lookup takes longer than `SPONSORBLOCK_TIMEOUT_MS`, returns None
+    without waiting, so playback isn't delayed. Lookup then finishes in background.
 
     :param video_id: Youtube video ID (/watch?v=...)
 
-    :return: List of segments
+    :return: List of segments, or None if there are no segments or they are unknown yet
     """
 
+    segments = segment_cache.get(video_id)
+    if segments is not None:
+        return segments or None
+
     try:
-        return _sb_client.get_skip_segments(video_id)
-    except sb.errors.HTTPException:
+        segments = _fetch_skip_segments(video_id).result(int(os.getenv('SPONSORBLOCK_TIMEOUT_MS')) / 1000)
+    except TimeoutError:
+        _logger.info('SponsorBlock lookup of %s is late, playing without segments', video_id)
         return None
 
+    return segments or None
+
+
+def prefetch_skip_segments(sources: list[AudioSource]) -> None:
+    """Start looking up segments of enqueued videos in background, so they are cached before playback"""
+
+    if os.getenv('ENABLE_SPONSORBLOCK').lower() != 'true':
+        return
+
+    videos = (audio for audio in sources if isinstance(audio, YoutubeVideo))
+
+    # Later videos will be prefetched before playback anyway.
+    # Called from event loop, so segments saved in database are looked up in background
+    for video in islice(videos, SEGMENTS_PREFETCH_LIMIT):
+        if segment_cache.get(video.id, persisted=False) is None:
+            _fetch_skip_segments(video.id, check_database=True)
+
+
+def _fetch_skip_segments(video_id: str, check_database: bool = False) -> Future:
+    """Look up segments in background, sharing one lookup between concurrent callers"""
+
+    with _segment_lookups_lock:
+        future = _segment_lookups.get(video_id)
+
+        if future is None:
+            future = _sb_executor.submit(_load_skip_segments, video_id, check_database)
+            _segment_lookups[video_id] = future
+            future.add_done_callback(lambda _: _segment_lookups.pop(video_id, None))
 
-def get_ffmpeg_sponsor_filter(segments: list[sb.Segment], vid_duration_s: int) -> str:
+    return future
+
+
+def _load_skip_segments(video_id: str, check_database: bool = False) -> list[SkipSegment]:
     """
-    Get ffmpeg arguments for removing SponsorBlock segments from video.
+    Look up segments using SponsorBlock and store them in cache.
+    If `check_database` is set, segments saved in database are used if they are there
+    """
+
+    if check_database:
+        segments = segment_cache.get(video_id)
+        if segments is not None:
+            return segments
 
-    Works by trimming parts of audio track that do not contain segments,
-    with subsequent concatenation.
+    try:
+        segments = [
+            SkipSegment(segment.start, segment.end, segment.category)
+            for segment in _sb_client.get_skip_segments(video_id)
+        ]
+    except sb.errors.NotFoundException:
+        segments = []
+    except (sb.errors.HTTPException, OSError) as e:
+        _logger.info('SponsorBlock lookup of %s failed: %s', video_id, e)
+        segment_cache.put_error(video_id)
+        return []
+
+    segment_cache.put(video_id, segments)
+    return segments
+
+
+@dataclass
+class SponsorOptions:
+    """ffmpeg arguments for removing SponsorBlock segments"""
+
+    before_options: str
+    "Input arguments (seek)"
+    options: str
+    "Output arguments (duration limit, filter)"
+    needs_transcoding: bool
+    "Is audio filter used, so audio stream can't be copied as is"
+
+
+def get_kept_intervals(
+        segments: list[SkipSegment],
+        vid_duration_s: float | None
+) -> list[tuple[float, float | None]]:
     """
+    Get intervals of audio that remain after removing segments.
+
+    Segments are sorted, clamped to duration and merged if they overlap
+    or the gap between them is shorter than `MIN_KEPT_INTERVAL`.
 
-    filter_complex = ''
-    count_of_segments = 0
+    :returns: Sorted list of (start, end) intervals. End of last interval is None if it lasts till the end
+    """
 
-    # Include interval between video start and first segment
+    kept = []
     start = 0
-    end = segments[0].start
-    if end - start > 1:
-        filter_complex += f"[0:a]atrim={start}:{end},asetpts=PTS-STARTPTS[a0];"
-        count_of_segments += 1
-
-    # Include intervals between other segments
-    for i, segment in enumerate(segments):
-        # Determine start and end of video trimming
-        next_segment = segments[i + 1] if i + 1 < len(segments) else None
-        start = segment.end
-        end = next_segment.start if next_segment else vid_duration_s
-
-        # If interval is too small, then skip it
-        if end - start < 1 and len(segments) > 1:
+
+    for segment in sorted(segments, key=lambda seg: seg.start):
+        seg_start = max(segment.start, 0)
+        seg_end = segment.end if vid_duration_s is None else min(segment.end, vid_duration_s)
+
+        if seg_end <= seg_start:
             continue
 
-        filter_complex += f"[0:a]atrim={start}:{end},asetpts=PTS-STARTPTS[a{count_of_segments}];"
-        count_of_segments += 1
+        # Keep interval before segment only if it isn't too small
+        if seg_start - start >= MIN_KEPT_INTERVAL:
+            kept.append((start, seg_start))
+
+        start = max(start, seg_end)
+
+    # Interval after last segment
+    if vid_duration_s is None or vid_duration_s - start >= MIN_KEPT_INTERVAL:
+        kept.append((start, None))
+
+    return kept
+
+
+def get_source_position(segments: list[SkipSegment], vid_duration_s: float | None,
+                        start: float, played: float) -> float:
+    """
+    Get position in video (in seconds) audio reaches after playing for `played` seconds from `start`,
+    with segments removed. Returns end of last kept interval if audio ends earlier
+    """
+
+    position = start
+
+    for interval_start, interval_end in get_kept_intervals(segments, vid_duration_s):
+        if interval_end is not None and interval_end <= position:
+            continue
+
+        position = max(position, interval_start)
+        if interval_end is None or position + played <= interval_end:
+            return position + played
+
+        played -= interval_end - position
+        position = interval_end
+
+    return position
+
+
+def get_ffmpeg_sponsor_options(segments: list[SkipSegment], vid_duration_s: float | None) -> SponsorOptions | None:
+    """
+    Get ffmpeg arguments for removing SponsorBlock segments from video.
+
+    Audio before first kept interval is skipped by input seek, so ffmpeg doesn't decode it.
+    If only one interval is kept, it's cut by seek and duration limit without any filter.
+    Otherwise kept intervals are selected by single `aselect` filter.
+
+    :returns: Arguments, or None if there is nothing to remove
+    """
+
+    kept = get_kept_intervals(segments, vid_duration_s)
+
+    if not kept:
+        return None
+
+    # Nothing to remove
+    if kept == [(0, None)]:
+        return None
 
-    for i in range(count_of_segments):
-        filter_complex += f"[a{i}]"
+    # Timestamps start from 0 after input seek, so intervals are shifted
+    seek = kept[0][0]
+    kept = [(start - seek, end - seek if end is not None else None) for start, end in kept]
+    before_options = f'-ss {seek:.3f}' if seek > 0 else ''
 
-    filter_complex += f"concat=n={count_of_segments}:v=0:a=1[outa]"
+    if len(kept) == 1:
+        end = kept[0][1]
+        return SponsorOptions(before_options, f'-t {end:.3f}' if end is not None else '', False)
 
-    return f'-filter_complex "{filter_complex}" -map "[outa]"'
+    conditions = '+'.join(
+        f'between(t,{start:.3f},{end:.3f})' if end is not None else f'gte(t,{start:.3f})'
+        for start, end in kept
+    )
+    return SponsorOptions(before_options, f'-af "aselect=\'{conditions}\',asetpts=N/SR/TB"', True)
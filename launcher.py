@@ -0,0 +1,247 @@
+"""
+Launcher running bot as several processes, each with its own range of shards.
+
+Bot process uses one CPU core at most, so big bots are split into processes that
+connect to Discord with different shards. Processes share database and track cache.
+Crashed processes are restarted with growing delay, and metrics written by processes
+are reported to log periodically.
+
+Usage::
+
+    python launcher.py [process count]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import subprocess
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+
+load_dotenv()        # From .env file in project root
+load_dotenv('.env')  # From .env file in current directory
+
+os.environ.setdefault('SHARD_PROCESSES', '2')
+os.environ.setdefault('SHARD_COUNT', '0')
+os.environ.setdefault('METRICS_INTERVAL', '15')
+os.environ.setdefault('LOG_LEVEL', 'INFO')
+os.environ.setdefault('LOG_FORMAT', logging.BASIC_FORMAT)
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL'), format=os.getenv('LOG_FORMAT'))
+_logger = logging.getLogger('launcher')
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+"Script of bot process"
+METRICS_DIR = 'metrics'
+"Directory with metrics files of bot processes"
+START_INTERVAL = 5.5
+"Min time between process starts (in seconds), as Discord allows one shard to connect per 5 seconds"
+RESTART_DELAY_MAX = 60
+"Max delay before restarting crashed process (in seconds)"
+STABLE_TIME = 120
+"Time after which running process is considered stable, and its restart delay is reset (in seconds)"
+STOP_TIMEOUT = 30
+"Time given to processes to shut down before they are killed (in seconds)"
+REPORT_INTERVAL = 60
+"Interval between metrics reports (in seconds)"
+
+
+@dataclass
+class ShardProcess:
+    """Bot process running range of shards"""
+
+    index: int
+    "Process number"
+    shard_ids: list[int]
+    "IDs of shards run by process"
+    process: subprocess.Popen | None = None
+    "Running process"
+    started_at: float = 0.0
+    "Timestamp of last start"
+    restart_at: float = 0.0
+    "Timestamp after which process can be started"
+    restart_delay: float = 1.0
+    "Delay before next restart (in seconds)"
+    restarts: int = 0
+    "Count of restarts"
+    metrics: dict[str, any] = field(default_factory=dict)
+    "Last metrics written by process"
+
+    @property
+    def metrics_file(self) -> str:
+        """Metrics file of process"""
+        return os.path.join(METRICS_DIR, f'process-{self.index}.json')
+
+    @property
+    def is_running(self) -> bool:
+        """Is process running"""
+        return self.process is not None and self.process.poll() is None
+
+
+def split_shards(shard_count: int, process_count: int) -> list[list[int]]:
+    """Split shard IDs into `process_count` contiguous ranges of nearly equal size"""
+    return [list(range(i * shard_count // process_count, (i + 1) * shard_count // process_count))
+            for i in range(process_count)]
+
+
+class Launcher:
+    """Starts bot processes and restarts them when they exit"""
+
+    def __init__(self, process_count: int, shard_count: int) -> None:
+        """
+        :param process_count: Count of bot processes
+        :param shard_count: Total count of shards, at least `process_count`
+        """
+
+        self.shard_count = shard_count
+        "Total count of shards"
+        self.processes = [ShardProcess(i, ids) for i, ids in enumerate(split_shards(shard_count, process_count))]
+        "Bot processes"
+        self._stopping = False
+        self._next_start = 0.0
+        self._next_report = time.monotonic() + REPORT_INTERVAL
+
+    def run(self) -> None:
+        """Run processes until launcher is interrupted"""
+
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        os.makedirs(METRICS_DIR, exist_ok=True)
+
+        _logger.info('Running %s shards in %s processes', self.shard_count, len(self.processes))
+
+        try:
+            while not self._stopping:
+                self._check()
+                time.sleep(0.5)
+        finally:
+            self.stop()
+
+    def _on_signal(self, signum: int, frame) -> None:
+        self._stopping = True
+
+    def _check(self) -> None:
+        """Restart exited processes, start pending ones and report metrics"""
+
+        now = time.monotonic()
+
+        for proc in self.processes:
+            if proc.process is not None and not proc.is_running:
+                # Process that crashes right after start is restarted less and less often
+                if now - proc.started_at > STABLE_TIME:
+                    proc.restart_delay = 1.0
+                proc.restart_at = now + proc.restart_delay
+
+                _logger.warning('Process %s (shards %s) exited with code %s, restarting in %ss',
+                                proc.index, proc.shard_ids, proc.process.returncode, proc.restart_delay)
+
+                proc.restart_delay = min(proc.restart_delay * 2, RESTART_DELAY_MAX)
+                proc.restarts += 1
+                proc.process = None
+
+            if proc.process is None and proc.restart_at <= now and self._next_start <= now:
+                self._start(proc)
+                self._next_start = now + START_INTERVAL
+
+        if now >= self._next_report:
+            self._next_report = now + REPORT_INTERVAL
+            self.report()
+
+    def _start(self, proc: ShardProcess) -> None:
+        """Start bot process"""
+
+        env = dict(os.environ,
+                   SHARD_COUNT=str(self.shard_count),
+                   SHARD_IDS=','.join(map(str, proc.shard_ids)),
+                   METRICS_FILE=proc.metrics_file)
+
+        # Own session, so terminal interrupt reaches only launcher, which stops processes in order
+        proc.process = subprocess.Popen([sys.executable, BOT_SCRIPT], env=env, start_new_session=True)
+        proc.started_at = time.monotonic()
+        _logger.info('Started process %s (shards %s), PID %s', proc.index, proc.shard_ids, proc.process.pid)
+
+    def report(self) -> None:
+        """Log state and metrics of all processes"""
+
+        stale_after = int(os.getenv('METRICS_INTERVAL')) * 3
+
+        for proc in self.processes:
+            try:
+                with open(proc.metrics_file) as f:
+                    proc.metrics = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+            if not proc.is_running:
+                _logger.info('Process %s (shards %s): not running, %s restarts',
+                             proc.index, proc.shard_ids, proc.restarts)
+                continue
+
+            # Metrics are written after bot is ready
+            metrics = proc.metrics.get('metrics', {}) if proc.metrics.get('pid') == proc.process.pid else {}
+            age = time.time() - proc.metrics.get('time', 0)
+
+            _logger.info(
+                'Process %s (shards %s): PID %s, %s restarts, RSS %.0f MB, %s servers, '
+                'latency %.0f ms, %s playing, %s waiting, ffmpeg CPU %.0f%%',
+                proc.index, proc.shard_ids, proc.process.pid, proc.restarts,
+                _get_rss(proc.process.pid) / 2 ** 20,
+                metrics.get('bot.guilds', '?'),
+                metrics.get('bot.latency', float('nan')) * 1000,
+                metrics.get('ffmpeg.playing_guilds', '?'),
+                metrics.get('ffmpeg.waiting_guilds', '?'),
+                metrics.get('ffmpeg.cpu_percent', 0),
+            )
+
+            if metrics and age > stale_after:
+                _logger.warning('Process %s (shards %s) did not update metrics for %.0fs, it may be hanging',
+                                proc.index, proc.shard_ids, age)
+
+    def stop(self) -> None:
+        """Stop all processes, killing ones that don't stop in time"""
+
+        running = [proc for proc in self.processes if proc.is_running]
+        _logger.info('Stopping %s processes', len(running))
+
+        # Bot saves its state and disconnects on interrupt
+        for proc in running:
+            proc.process.send_signal(signal.SIGINT)
+
+        deadline = time.monotonic() + STOP_TIMEOUT
+
+        for proc in running:
+            try:
+                proc.process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                _logger.warning('Killing process %s (shards %s) that did not stop in time',
+                                proc.index, proc.shard_ids)
+                proc.process.kill()
+                proc.process.wait()
+
+
+def _get_rss(pid: int) -> int:
+    """Get resident memory size of process (in bytes), or 0 if it's unknown"""
+
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def main() -> None:
+    process_count = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv('SHARD_PROCESSES'))
+    shard_count = int(os.getenv('SHARD_COUNT')) or process_count
+
+    assert process_count > 0, 'Process count should be positive'
+    assert shard_count >= process_count, 'SHARD_COUNT should be at least process count'
+
+    Launcher(process_count, shard_count).run()
+
+
+if __name__ == '__main__':
+    main()
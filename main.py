@@ -2,17 +2,44 @@ import os
 import logging
 import bot.commands as _
 
-from settings import bot
-from bot.data import GuildData, AudioQueue
+from settings import bot, SHARD_COUNT, SHARD_IDS
+from bot import ytdlp, registry, metrics
+from bot.data import GuildData, database, guild_settings, langs
+from bot.audio import cleanup_playback, queue_journal, audio_nodes
+from bot.resume import resume_playback
 from bot.utils.discord_utils import is_users_in_channel, get_bot_channel
 
 logger = logging.getLogger('bot')
 
+metrics.gauge('bot.guilds', lambda: len(bot.guilds))
+metrics.gauge('bot.voice_clients', lambda: len(bot.voice_clients))
+metrics.gauge('bot.latency', lambda: bot.latency)
+if SHARD_COUNT:
+    metrics.gauge('bot.shard_latencies', lambda: dict(bot.latencies))
+
 
 @bot.event
 async def on_ready():
     """Runs when bot is ready"""
-    logger.info('Bot is ready!')
+    registry.start_eviction()
+    ytdlp.extractor.start()
+    audio_nodes.start()
+    queue_journal.start(int(os.getenv('QUEUE_SAVE_INTERVAL')))
+    if os.getenv('METRICS_FILE'):
+        metrics.start_export(os.getenv('METRICS_FILE'), int(os.getenv('METRICS_INTERVAL')))
+
+    if SHARD_COUNT:
+        logger.info('Bot is ready! Shards: %s of %s', SHARD_IDS or 'all', SHARD_COUNT)
+    else:
+        logger.info('Bot is ready!')
+    await resume_playback(bot)
+
+
+@bot.event
+async def on_guild_remove(guild):
+    """Forget server state when bot is removed from server"""
+    cleanup_playback(guild.id)
+    registry.remove_guild(guild.id)
 
 
 @bot.event
@@ -22,6 +49,12 @@ async def on_voice_state_update(member, before, after):
     if he changed channel and bot is alone.
     """
 
+    # Bot was disconnected, e.g. kicked from channel or connection was lost
+    if member.id == bot.user.id:
+        if after.channel is None:
+            cleanup_playback(member.guild.id)
+        return
+
     if member.bot:
         return
 
@@ -48,8 +81,29 @@ async def on_voice_state_update(member, before, after):
         # Bot will disconnect if user will not return to channel in 750ms
         # await sleep(0.75)
         # if not is_users_in_channel(ch):
+        ytdlp.cancel_guild_searches(ch.guild.id)
         await ch.guild.voice_client.disconnect()
-        AudioQueue.del_queue(ch.guild.id)
+        cleanup_playback(ch.guild.id)
+
+
+async def setup_hook():
+    """Load server settings before connecting to gateway, as shards dispatch commands before `on_ready`"""
+    await guild_settings.load()
+
+
+_close_bot = bot.close
+
+
+async def close():
+    """Save queues before voice clients are disconnected on shutdown, so playback is resumed after restart"""
+    queue_journal.close()
+    database.close()
+    await _close_bot()
+
 
+bot.setup_hook = setup_hook
+bot.close = close
 
+# Broken localization files fail here instead of in commands. Compiled files are cached, so it's fast
+langs.load_all()
 bot.run(os.getenv('BOT_TOKEN'))
@@ -21,7 +21,38 @@ os.environ.setdefault('SAVES_LIMIT', '16')
 os.environ.setdefault('LOG_FILEPATH', 'debug.log')
 os.environ.setdefault('LOG_LEVEL', 'INFO')
 os.environ.setdefault('ENABLE_SPONSORBLOCK', 'true')
+os.environ.setdefault('SPONSORBLOCK_TIMEOUT_MS', '1500')
 os.environ.setdefault('LOG_FORMAT', logging.BASIC_FORMAT)
+os.environ.setdefault('YTDLP_WORKERS', '8')
+os.environ.setdefault('YTDLP_GUILD_CONCURRENCY', '1')
+os.environ.setdefault('YTDLP_QUEUE_LIMIT', '64')
+os.environ.setdefault('YTDLP_GUILD_QUEUE_LIMIT', '4')
+os.environ.setdefault('YTDLP_CACHE_SIZE', '2048')
+os.environ.setdefault('ENABLE_YTDLP_PROCESS_POOL', 'true')
+os.environ.setdefault('PLAYBACK_MODE', 'opus')
+os.environ.setdefault('TRACK_CACHE_DIR', 'track-cache')
+os.environ.setdefault('TRACK_CACHE_MAX_MB', '1024')
+os.environ.setdefault('TRACK_CACHE_MIN_PLAYS', '2')
+os.environ.setdefault('FFMPEG_MAX_PLAYING', '100')
+os.environ.setdefault('FFMPEG_QUEUE_LIMIT', '32')
+os.environ.setdefault('FFMPEG_QUEUE_TIMEOUT', '60')
+os.environ.setdefault('FFMPEG_SAMPLE_INTERVAL', '10')
+os.environ.setdefault('GUILD_IDLE_TIMEOUT', '1800')
+os.environ.setdefault('QUEUE_SAVE_INTERVAL', '5')
+os.environ.setdefault('RESUME_CONCURRENCY', '4')
+os.environ.setdefault('RESUME_INTERVAL_MS', '500')
+os.environ.setdefault('YTDLP_JOB_TIMEOUT', '30')
+os.environ.setdefault('YTDLP_WORKER_MAX_JOBS', '200')
+os.environ.setdefault('YTDLP_WORKER_MAX_RSS_MB', '512')
+os.environ.setdefault('SHARD_COUNT', '0')
+os.environ.setdefault('SHARD_IDS', '')
+os.environ.setdefault('DB_BUSY_TIMEOUT', '30')
+os.environ.setdefault('DB_COMMIT_INTERVAL_MS', '50')
+os.environ.setdefault('ENABLE_DB_TUNING', 'true')
+os.environ.setdefault('DB_READERS', '0')
+os.environ.setdefault('METRICS_FILE', '')
+os.environ.setdefault('METRICS_INTERVAL', '15')
+os.environ.setdefault('AUDIO_NODES', '')
 
 # Setup logging
 os.makedirs(os.path.dirname(os.path.join('.', os.getenv('LOG_FILEPATH'))), exist_ok=True)
@@ -61,7 +92,30 @@ else:
 _ENV_HELP = 'Please read README.md to learn how to configure bot.'
 assert os.getenv('BOT_TOKEN') is not None, 'BOT_TOKEN not specified. ' + _ENV_HELP
 assert os.getenv('SAVES_LIMIT').isdigit(), 'SAVES_LIMIT should be integer. ' + _ENV_HELP
+assert os.getenv('PLAYBACK_MODE') in ('opus', 'pcm'), 'PLAYBACK_MODE should be opus or pcm. ' + _ENV_HELP
+for _var in ('YTDLP_WORKERS', 'YTDLP_GUILD_CONCURRENCY', 'YTDLP_QUEUE_LIMIT', 'YTDLP_GUILD_QUEUE_LIMIT',
+             'YTDLP_CACHE_SIZE', 'YTDLP_JOB_TIMEOUT', 'YTDLP_WORKER_MAX_JOBS', 'YTDLP_WORKER_MAX_RSS_MB',
+             'SPONSORBLOCK_TIMEOUT_MS', 'TRACK_CACHE_MAX_MB', 'TRACK_CACHE_MIN_PLAYS',
+             'FFMPEG_MAX_PLAYING', 'FFMPEG_QUEUE_LIMIT', 'FFMPEG_QUEUE_TIMEOUT', 'FFMPEG_SAMPLE_INTERVAL',
+             'GUILD_IDLE_TIMEOUT', 'QUEUE_SAVE_INTERVAL', 'RESUME_CONCURRENCY', 'RESUME_INTERVAL_MS',
+             'SHARD_COUNT', 'DB_BUSY_TIMEOUT', 'DB_COMMIT_INTERVAL_MS', 'DB_READERS',
+             'METRICS_INTERVAL'):
+    assert os.getenv(_var).isdigit(), f'{_var} should be integer. ' + _ENV_HELP
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT'))
+"Total count of shards. 0 if bot isn't sharded"
+SHARD_IDS = [int(i) for i in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+"IDs of shards run by this process. None if it runs all shards"
+
+assert SHARD_IDS is None or SHARD_COUNT, 'SHARD_IDS requires SHARD_COUNT. ' + _ENV_HELP
+assert SHARD_IDS is None or all(0 <= i < SHARD_COUNT for i in SHARD_IDS), \
+    'SHARD_IDS should be less than SHARD_COUNT. ' + _ENV_HELP
 
 indents = Intents.default()
 indents.message_content = True
-bot = commands.Bot(command_prefix=os.getenv('BOT_COMMAND_PREFIX'), intents=indents)
+
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix=os.getenv('BOT_COMMAND_PREFIX'), intents=indents,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix=os.getenv('BOT_COMMAND_PREFIX'), intents=indents)